@@ -1,9 +1,80 @@
-from PyQt6.QtWidgets import QApplication
-from ui.main_ui import DMToolsUI
+import argparse
+import os
 import sys
 
-if __name__ == "__main__":
+import instrumentation
+from startup_profile import StartupProfile
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Dungeon Master Music Player")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each startup phase took once the window is up")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record timing spans, counters and histograms and log a summary on exit")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="like --metrics, and also write the session as Chrome trace JSON to FILE on exit")
+    parser.add_argument("--control", action="store_true",
+                        help="accept JSON commands from local clients on a Unix socket and a loopback TCP port")
+    parser.add_argument("--control-port", type=int, metavar="PORT",
+                        help="TCP port of the control server (default 47474, 0 picks a free port)")
+    parser.add_argument("--control-socket", metavar="PATH",
+                        help="Unix socket of the control server (default cache/control.sock)")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a window (or Qt), driven only through the control server")
+    parser.add_argument("--folder", help="with --headless, the folder to load as the playlist at startup")
+    args = parser.parse_args()
+    if args.metrics or args.trace:
+        instrumentation.enable(trace=args.trace is not None)
+
+    control_options = {key: value for key, value in (("port", args.control_port), ("socket_path", args.control_socket))
+                       if value is not None}
+    if args.headless:
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "hide")
+        import control_server
+        status = control_server.run_headless(folder=args.folder, debug=True, **control_options)
+        if instrumentation.is_enabled():
+            instrumentation.log_summary()
+        if args.trace:
+            instrumentation.export_chrome_trace(args.trace)
+        return status
+
+    # Heavy modules are imported here, phase by phase, so the profile can attribute their cost
+    profile = StartupProfile()
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "hide")  # Must be set before pygame is imported
+    import numpy  # noqa: F401
+    profile.mark("import numpy")
+    from PyQt6.QtCore import QTimer
+    from PyQt6.QtWidgets import QApplication
+    profile.mark("import PyQt6")
+    import pygame  # noqa: F401
+    profile.mark("import pygame")
+    from ui import DMToolsUI
+    profile.mark("import application modules")
+
     app = QApplication(sys.argv)
+    profile.mark("create QApplication")
     window = DMToolsUI(debug=True)  # Assuming you want debug logging enabled
+    profile.mark("build main window")
+    if args.control:
+        window.start_control_server(**control_options)
     window.show()
-    sys.exit(app.exec())
+    profile.mark("show main window")
+
+    if args.profile_startup:
+        def first_frame() -> None:
+            profile.mark("first event loop pass")
+            print(profile.report())
+
+        # Runs once the event loop has processed the initial show and paint events
+        QTimer.singleShot(0, first_frame)
+    status = app.exec()
+    if instrumentation.is_enabled():
+        instrumentation.log_summary()
+    if args.trace:
+        instrumentation.export_chrome_trace(args.trace)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
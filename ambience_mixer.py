@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import pygame
+
+from analysis_cache import AnalysisCache
+import instrumentation
+from decoders import stream_audio
+
+logger = logging.getLogger(__name__)
+
+
+class AmbienceLayer:
+    """One looping ambience source with its own gain.
+
+    The loop is decoded once to 16-bit PCM, written to the ambience cache
+    block by block as it decodes, and then
+    read back memory-mapped, so only the pages around the play position
+    are resident however long the loop is. Until the loop is ready, or
+    whenever a block could not be mixed in time, ``underruns`` is counted
+    up and the layer contributes silence.
+    """
+
+    def __init__(self, name: str, path: str, gain: float = 1.0) -> None:
+        self.name = name
+        self.path = path
+        self.gain = gain
+        self.error: Optional[str] = None
+        self.underruns = 0
+        self.position = 0
+        self._applied_gain = gain
+        self._pcm: Optional[np.ndarray] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._pcm is not None
+
+    @property
+    def frames(self) -> int:
+        return len(self._pcm) if self._pcm is not None else 0
+
+    def load(self, cache: AnalysisCache, sample_rate: int, channels: int) -> None:
+        """Decode the loop into the cache if needed and memory-map it."""
+        params = {"kind": "ambience", "sr": sample_rate, "channels": channels}
+        cached = cache.get(self.path, params)
+        if cached is None:
+            if not cache.put_blocks(self.path, params, "pcm", self._pcm_blocks(sample_rate, channels), {}):
+                raise ValueError("no audio decoded, or the loop does not fit in the cache")
+            cached = cache.get(self.path, params)
+        self._pcm = cached[0]["pcm"]
+
+    def _pcm_blocks(self, sample_rate: int, channels: int):
+        """Decode the loop as 16-bit PCM blocks with the mixer's channel count."""
+        for block in stream_audio(self.path, sample_rate, mono=False):
+            if block.shape[1] != channels:
+                block = block.mean(axis=1, keepdims=True) if channels == 1 \
+                    else block[:, np.arange(channels) % block.shape[1]]
+            yield np.clip(block * 32767.0, -32768, 32767).astype(np.int16)
+
+    def mix_into(self, out: np.ndarray) -> None:
+        """Add the next ``len(out)`` frames of the loop, at this layer's gain, to ``out``."""
+        frames = len(out)
+        pcm = self._pcm
+        start = self.position
+        stop = start + frames
+        if stop <= len(pcm):
+            chunk = pcm[start:stop]
+        else:
+            # Wrap around the loop point; loops shorter than a block are tiled
+            chunk = np.take(pcm, np.arange(start, stop) % len(pcm), axis=0)
+        self.position = stop % len(pcm)
+        scale = 1.0 / 32768.0
+        if self.gain == self._applied_gain:
+            out += chunk * np.float32(self.gain * scale)
+        else:
+            # Ramp to a new gain over one block so volume changes do not click
+            ramp = np.linspace(self._applied_gain, self.gain, frames, dtype=np.float32) * scale
+            out += chunk * ramp[:, None]
+            self._applied_gain = self.gain
+
+
+class AmbienceMixer:
+    """Plays any number of looping ambience layers on one reserved mixer channel.
+
+    A feeder thread sums the layers block by block with NumPy into a single
+    output block and keeps the channel's play and queue slots filled, so
+    the mixing cost grows linearly with the number of layers and the
+    pygame mixer only ever sees one stream. Loops are loaded on a
+    background thread; a layer starts contributing as soon as it is ready.
+    The caller reserves ``channel_id`` with ``pygame.mixer.set_reserved``.
+    """
+
+    def __init__(self, cache: Optional[AnalysisCache] = None, block_frames: int = 4096,
+                 channel_id: int = 1) -> None:
+        self.sample_rate, _, self.channels = pygame.mixer.get_init()
+        self.cache = cache or AnalysisCache(os.path.join("cache", "ambience"), max_bytes=1024 * 1024 * 1024)
+        self.block_frames = block_frames
+        self.channel = pygame.mixer.Channel(channel_id)
+        self.layers: dict[str, AmbienceLayer] = {}
+        self.output_underruns = 0
+        self.mix_seconds = 0.0
+        self.blocks_mixed = 0
+        self._in_flight: deque = deque()
+        self._lock = threading.Condition()
+        self._poll = block_frames / self.sample_rate / 4
+        self._shutdown = False
+        self._thread: Optional[threading.Thread] = None
+
+    def add_layer(self, name: str, path: str, gain: float = 1.0) -> AmbienceLayer:
+        """Start looping ``path`` as layer ``name``, replacing any layer with that name."""
+        layer = AmbienceLayer(name, path, gain)
+        with self._lock:
+            self.layers[name] = layer
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ambience", daemon=True)
+                self._thread.start()
+            self._lock.notify()
+        threading.Thread(target=self._load, args=(layer,), name="ambience-load", daemon=True).start()
+        return layer
+
+    def _load(self, layer: AmbienceLayer) -> None:
+        try:
+            layer.load(self.cache, self.sample_rate, self.channels)
+            logger.info(f"Ambience layer {layer.name} ready: {layer.frames / self.sample_rate:.1f} s loop")
+        except Exception as e:
+            layer.error = str(e)
+            logger.error(f"Error loading ambience {layer.path}: {e}")
+
+    def remove_layer(self, name: str) -> None:
+        with self._lock:
+            self.layers.pop(name, None)
+            if not self.layers:
+                # The feeder idles until the next layer; blocks left in flight would then look like underruns
+                self.channel.stop()
+                self._in_flight.clear()
+
+    def set_gain(self, name: str, gain: float) -> None:
+        layer = self.layers.get(name)
+        if layer is not None:
+            layer.gain = gain
+
+    def set_volume(self, volume: float) -> None:
+        self.channel.set_volume(volume)
+
+    def stats(self) -> dict:
+        return {
+            "layers": {name: {"ready": layer.ready, "underruns": layer.underruns, "gain": layer.gain}
+                       for name, layer in self.layers.items()},
+            "output_underruns": self.output_underruns,
+            "mix_us_per_block": round(self.mix_seconds / self.blocks_mixed * 1e6, 1) if self.blocks_mixed else None,
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._shutdown = True
+            self.layers.clear()
+            self._lock.notify()
+        self.channel.stop()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._shutdown and not self.layers:
+                    self._lock.wait()
+                if self._shutdown:
+                    return
+                self._service()
+            time.sleep(self._poll)
+
+    def _service(self) -> None:
+        """Drop finished blocks and top the channel up to one playing and one queued block."""
+        # See PlaybackEngine._service for why blocks are matched by sound object
+        playing = self.channel.get_sound() or self.channel.get_queue()
+        if playing is None and self._in_flight:
+            self.output_underruns += 1
+            for layer in self.layers.values():
+                if layer.ready:
+                    layer.underruns += 1
+        while self._in_flight and self._in_flight[0] is not playing:
+            self._in_flight.popleft()
+        while len(self._in_flight) < 2:
+            sound = self._mix_block()
+            self.channel.queue(sound)
+            self._in_flight.append(sound)
+
+    def _mix_block(self):
+        start = time.perf_counter()
+        out = np.zeros((self.block_frames, self.channels), dtype=np.float32)
+        for layer in self.layers.values():
+            if layer.ready:
+                layer.mix_into(out)
+            elif layer.error is None:
+                layer.underruns += 1
+        pcm = np.clip(out * 32767.0, -32768, 32767).astype(np.int16)
+        sound = pygame.sndarray.make_sound(pcm if self.channels > 1 else pcm[:, 0])
+        elapsed = time.perf_counter() - start
+        self.mix_seconds += elapsed
+        instrumentation.observe("ambience.mix_block_ms", elapsed * 1000)
+        self.blocks_mixed += 1
+        return sound
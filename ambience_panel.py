@@ -0,0 +1,48 @@
+import os
+
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QHBoxLayout, QLabel, QPushButton, QSlider, QVBoxLayout, QWidget
+
+from ambience_mixer import AmbienceMixer
+
+
+class AmbiencePanel(QWidget):
+    """One row per ambience layer: its name, a gain slider and a remove button."""
+
+    def __init__(self, mixer: AmbienceMixer, parent=None) -> None:
+        super().__init__(parent)
+        self.mixer = mixer
+        self.rows: dict[str, QWidget] = {}
+        self.rows_layout = QVBoxLayout()
+        self.rows_layout.addStretch()
+        self.setLayout(self.rows_layout)
+
+    def add_layer(self, path: str) -> None:
+        """Start looping a file as a new layer and add its row."""
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in self.rows:
+            self.remove_layer(name)
+        self.mixer.add_layer(name, path, gain=0.5)
+
+        row = QWidget(self)
+        row_layout = QHBoxLayout()
+        row_layout.setContentsMargins(0, 0, 0, 0)
+        row_layout.addWidget(QLabel(name, row))
+        slider = QSlider(Qt.Orientation.Horizontal, row)
+        slider.setRange(0, 100)
+        slider.setValue(50)
+        slider.valueChanged.connect(lambda value: self.mixer.set_gain(name, value / 100))
+        row_layout.addWidget(slider)
+        remove_button = QPushButton("Remove", row)
+        remove_button.clicked.connect(lambda: self.remove_layer(name))
+        row_layout.addWidget(remove_button)
+        row.setLayout(row_layout)
+
+        self.rows_layout.insertWidget(self.rows_layout.count() - 1, row)
+        self.rows[name] = row
+
+    def remove_layer(self, name: str) -> None:
+        self.mixer.remove_layer(name)
+        row = self.rows.pop(name, None)
+        if row is not None:
+            row.deleteLater()
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_path ON entries(path);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+"""
+TOUCH_FLUSH_SECONDS = 30.0  # Access times are written back at most this often; they only order evictions
+
+
+class AnalysisCache:
+    """Content-addressed on-disk cache for per-track analysis results.
+
+    Entries are keyed by the track path, its size and mtime, and the analysis
+    parameters, so editing or replacing a file automatically misses. Arrays
+    are stored as ``.npy`` files and returned memory-mapped. The entry index
+    is a small SQLite database, so storing an entry costs one row write
+    whatever the size of the cache. Access times of reads are kept in
+    memory and written back in batches.
+    """
+
+    INDEX_FILE = "index.db"
+    LEGACY_INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: str = os.path.join("cache", "analysis"),
+                 max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, self.INDEX_FILE), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._import_legacy_index()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self._touched: dict[str, float] = {}  # Key -> access time not written back yet
+        self._flushed_at = time.monotonic()
+
+    def _import_legacy_index(self) -> None:
+        """Move the entries of an index.json written by older versions into the database."""
+        legacy_path = os.path.join(self.cache_dir, self.LEGACY_INDEX_FILE)
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entries (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+                [(key, entry["path"], entry["size"], entry["last_access"]) for key, entry in legacy.items()])
+        os.remove(legacy_path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touches(force=True)
+            self._conn.close()
+
+    @staticmethod
+    def _normalise_path(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def make_key(self, path: str, params: dict) -> Optional[str]:
+        """Build the cache key for a track and analysis parameters."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        ident = json.dumps({
+            "path": self._normalise_path(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "params": params,
+        }, sort_keys=True)
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _contains(self, key: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, path: str, params: dict, touch: bool = True) -> Optional[tuple[dict, dict]]:
+        """Return ``(arrays, values)`` for a cached analysis, or None on a miss.
+
+        With ``touch=False`` the entry's access time is not updated, so the
+        lookup does not count towards keeping the entry.
+        """
+        key = self.make_key(path, params)
+        if key is None:
+            return None
+        with self._lock:
+            if not self._contains(key):
+                return None
+            entry_dir = self._entry_dir(key)
+            try:
+                with open(os.path.join(entry_dir, "meta.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                arrays = {name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="r")
+                          for name in meta["arrays"]}
+            except (OSError, ValueError, KeyError):
+                with self._conn:
+                    self._remove_entry(key)
+                return None
+            if touch:
+                self._touched[key] = time.time()
+                self._flush_touches()
+            return arrays, meta["values"]
+
+    def has(self, path: str, params: dict) -> bool:
+        """Return True if an analysis is cached, without loading it or touching its access time."""
+        key = self.make_key(path, params)
+        with self._lock:
+            return key is not None and self._contains(key)
+
+    def put(self, path: str, params: dict, arrays: dict, values: dict) -> None:
+        """Store analysis arrays and scalar values for a track.
+
+        An entry larger than the whole cache is not stored, rather than
+        evicting everything else to make room for it.
+        """
+        key = self.make_key(path, params)
+        if key is None:
+            return
+        if sum(np.asarray(array).nbytes for array in arrays.values()) > self.max_bytes:
+            logging.warning(f"Analysis of {path} is larger than the cache; not cached")
+            return
+        with self._lock:
+            tmp_dir = self._entry_dir(key) + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            size = 0
+            for name, array in arrays.items():
+                array_path = os.path.join(tmp_dir, f"{name}.npy")
+                np.save(array_path, np.ascontiguousarray(array))
+                size += os.path.getsize(array_path)
+            self._write_meta(tmp_dir, path, params, list(arrays), values)
+            self._commit(key, path, tmp_dir, size)
+
+    def put_blocks(self, path: str, params: dict, name: str, blocks: Iterable[np.ndarray], values: dict) -> bool:
+        """Store one array, given as consecutive blocks along its first axis, as entry array ``name``.
+
+        Each block is written to disk as it arrives, so the array is never
+        held in memory whole. Returns False if nothing was stored because
+        there were no blocks or the array outgrew the cache.
+        """
+        key = self.make_key(path, params)
+        if key is None:
+            return False
+        parent = os.path.dirname(self._entry_dir(key))
+        os.makedirs(parent, exist_ok=True)
+        # A private directory, so the slow part runs without the lock
+        tmp_dir = tempfile.mkdtemp(suffix=".tmp", dir=parent)
+        try:
+            size = self._write_blocks(os.path.join(tmp_dir, f"{name}.npy"), blocks, path)
+            if not size:
+                return False
+            self._write_meta(tmp_dir, path, params, [name], values)
+            with self._lock:
+                self._commit(key, path, tmp_dir, size)
+            return True
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _write_blocks(self, array_path: str, blocks: Iterable[np.ndarray], path: str) -> int:
+        """Write blocks as one ``.npy`` array and return the file size, or 0 if there was nothing to store."""
+        header = None
+        rows = 0
+        with open(array_path, "wb") as f:
+            for block in blocks:
+                if header is None:
+                    header = {"descr": np.lib.format.dtype_to_descr(block.dtype), "fortran_order": False,
+                              "shape": (0,) + block.shape[1:]}
+                    np.lib.format.write_array_header_1_0(f, header)
+                f.write(np.ascontiguousarray(block).tobytes())
+                rows += len(block)
+                if f.tell() > self.max_bytes:
+                    logging.warning(f"Analysis of {path} is larger than the cache; not cached")
+                    return 0
+            if header is None:
+                return 0
+            # NumPy pads the header for up to 21 digits of the first dimension, so the real shape fits in place
+            header["shape"] = (rows,) + header["shape"][1:]
+            f.seek(0)
+            np.lib.format.write_array_header_1_0(f, header)
+            return f.seek(0, os.SEEK_END)
+
+    @staticmethod
+    def _write_meta(entry_dir: str, path: str, params: dict, names: list[str], values: dict) -> None:
+        with open(os.path.join(entry_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"path": path, "params": params, "arrays": names, "values": values}, f)
+
+    def _commit(self, key: str, path: str, tmp_dir: str, size: int) -> None:
+        """Move a fully written entry into place, index it and evict to fit; the caller holds the lock."""
+        entry_dir = self._entry_dir(key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        with self._conn:
+            previous = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, self._normalise_path(path), size, time.time()))
+            self._total += size - (previous[0] if previous is not None else 0)
+            self._touched.pop(key, None)
+            self._evict(keep=key)
+
+    def invalidate(self, path: str) -> int:
+        """Drop every cached analysis of a track. Returns the number of entries removed."""
+        target = self._normalise_path(path)
+        with self._lock, self._conn:
+            keys = [key for (key,) in self._conn.execute("SELECT key FROM entries WHERE path = ?", (target,))]
+            for key in keys:
+                self._remove_entry(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        """Remove all cached analyses."""
+        with self._lock, self._conn:
+            for (key,) in self._conn.execute("SELECT key FROM entries").fetchall():
+                self._remove_entry(key)
+
+    def total_bytes(self) -> int:
+        """Return the disk space used by cached arrays."""
+        with self._lock:
+            return self._total
+
+    def _flush_touches(self, force: bool = False) -> None:
+        """Write pending access times back, at most every TOUCH_FLUSH_SECONDS unless forced."""
+        if not self._touched or (not force and time.monotonic() - self._flushed_at < TOUCH_FLUSH_SECONDS):
+            return
+        with self._conn:
+            self._conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                   [(accessed, key) for key, accessed in self._touched.items()])
+        self._touched.clear()
+        self._flushed_at = time.monotonic()
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Evict least recently used entries until the cache fits its budget; ``keep`` is never evicted.
+
+        Entries without arrays free nothing, so they are never evicted either.
+        """
+        if self._total <= self.max_bytes:
+            return
+        self._flush_touches(force=True)
+        victims = self._conn.execute(
+            "SELECT key FROM entries WHERE size > 0 AND key != ? ORDER BY last_access", (keep or "",)).fetchall()
+        for (key,) in victims:
+            if self._total <= self.max_bytes:
+                break
+            self._remove_entry(key)
+
+    def _remove_entry(self, key: str) -> None:
+        """Forget an entry and delete its files; the caller commits."""
+        row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._total -= row[0]
+        self._touched.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
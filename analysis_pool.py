@@ -0,0 +1,303 @@
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from PyQt6.QtCore import QObject, pyqtSignal
+
+import instrumentation
+from analysis_cache import AnalysisCache
+from library_catalog import LibraryCatalog
+from spectrogram import analysis_params, expected_envelope_bins, iter_spectrogram_data
+from tempo import fast_beat
+
+CURRENT_PRIORITY = 0
+
+
+def _run_analysis(job_id: int, audio_file: str, cancelled, progress) -> bool:
+    """Worker process entry point: stream the analysis of one track into the progress queue."""
+    try:
+        expected_bins = expected_envelope_bins(audio_file)
+    except Exception:
+        expected_bins = 0
+    progress.put(("started", job_id, expected_bins, None, None))
+    for envelope, energy, mel in iter_spectrogram_data(audio_file):
+        if cancelled.get(job_id):
+            return False
+        progress.put(("chunk", job_id, envelope, energy, mel))
+    tempo, confidence, beat_time = fast_beat(audio_file)
+    progress.put(("done", job_id, tempo, confidence, beat_time))
+    return True
+
+
+class _Job:
+    def __init__(self, job_id: int, audio_file: str, priority: int) -> None:
+        self.job_id = job_id
+        self.audio_file = audio_file
+        self.priority = priority
+        self.expected_bins = 0
+        self.envelopes: list[np.ndarray] = []
+        self.energies: list[np.ndarray] = []
+        self.mels: list[np.ndarray] = []
+        self.future: Optional[Future] = None
+        self.submitted_at = 0.0
+        self.cancelled = False
+
+
+class AnalysisPool(QObject):
+    """Bounded process pool for track analysis with cancellation and prefetch.
+
+    The current track is always analysed first; the next few playlist
+    entries are analysed speculatively so their results are already cached
+    when playback reaches them. Partial results of the current track are
+    streamed through ``chunk_ready``. All bookkeeping happens on the Qt main
+    thread; worker processes only read audio and push results to a queue,
+    and finished analyses are written to the cache on a writer thread.
+    """
+
+    analysis_started = pyqtSignal(str, int)
+    chunk_ready = pyqtSignal(str, object, object, object)  # Envelope, energy and mel spectrogram chunks
+    analysis_finished = pyqtSignal(str)
+    analysis_failed = pyqtSignal(str, str)
+
+    _message_received = pyqtSignal(str, int, object, object, object)
+    _job_done = pyqtSignal(int, object)
+    _job_stored = pyqtSignal(object)
+
+    def __init__(self, cache: Optional[AnalysisCache] = None, max_workers: int = 2,
+                 prefetch: int = 2, logger: Optional[logging.Logger] = None,
+                 catalog: Optional[LibraryCatalog] = None) -> None:
+        super().__init__()
+        self.cache = cache
+        self.catalog = catalog
+        self.max_workers = max_workers
+        self.prefetch = prefetch
+        self.logger = logger or logging.getLogger()
+        self.current_file: Optional[str] = None
+
+        # Worker and manager processes are started on the first submitted job, not at startup
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._cancelled = None
+        self._progress = None
+        self._listener: Optional[threading.Thread] = None
+
+        self._ids = itertools.count()
+        self._pending: list[tuple[int, int, str]] = []
+        self._jobs: dict[str, _Job] = {}
+        self._running: dict[int, _Job] = {}
+        self._active: dict[int, _Job] = {}
+        self._storing: dict[str, _Job] = {}  # Finished jobs whose results are still being written to the cache
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis-writer")
+
+        self._message_received.connect(self._on_message)
+        self._job_done.connect(self._on_job_done)
+        self._job_stored.connect(self._on_job_stored)
+
+    def _start(self) -> None:
+        """Start the worker processes, the manager holding the shared state and the progress listener."""
+        # Spawn instead of fork so workers do not inherit Qt and SDL state
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        self._manager = context.Manager()
+        self._cancelled = self._manager.dict()
+        self._progress = self._manager.Queue()
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def request(self, audio_file: str, upcoming: list[str]) -> None:
+        """Make ``audio_file`` the current track and prefetch the upcoming ones."""
+        self.current_file = audio_file
+        wanted = {audio_file: CURRENT_PRIORITY}
+        for offset, path in enumerate(upcoming[:self.prefetch], start=1):
+            wanted.setdefault(path, offset)
+
+        # Cancel work for tracks that are no longer current or upcoming
+        for path, job in list(self._jobs.items()):
+            if path not in wanted:
+                self._cancel(job)
+
+        for path, priority in wanted.items():
+            job = self._jobs.get(path)
+            if job is not None:
+                job.priority = priority
+                heapq.heappush(self._pending, (priority, job.job_id, path))
+                continue
+            job = self._storing.get(path)
+            if job is not None:
+                if path == audio_file:
+                    self._replay(job)
+                    self.analysis_finished.emit(path)
+                continue
+            if self.cache is not None:
+                if path != audio_file:
+                    # A prefetch only needs to know it is cached; a lookup that touches the entry rewrites the index
+                    if self.cache.has(path, analysis_params(False)):
+                        continue
+                else:
+                    cached = self.cache.get(path, analysis_params(False))
+                    if cached is not None:
+                        arrays, _ = cached
+                        self.analysis_started.emit(path, arrays["envelope"].shape[1])
+                        self.chunk_ready.emit(path, arrays["envelope"], arrays["energy"], arrays["mel"])
+                        self.analysis_finished.emit(path)
+                        continue
+            job = _Job(next(self._ids), path, priority)
+            self._jobs[path] = job
+            heapq.heappush(self._pending, (priority, job.job_id, path))
+
+        # A job that is already running for the current track replays what it has so far
+        job = self._jobs.get(audio_file)
+        if job is not None and job.future is not None:
+            self._replay(job)
+
+        self._dispatch()
+
+    def _replay(self, job: _Job) -> None:
+        """Emit what a job has streamed so far, for a track that became current again."""
+        self.analysis_started.emit(job.audio_file, job.expected_bins)
+        for envelope, energy, mel in zip(job.envelopes, job.energies, job.mels):
+            self.chunk_ready.emit(job.audio_file, envelope, energy, mel)
+
+    def cancel_all(self) -> None:
+        """Cancel all pending and running analyses."""
+        self.current_file = None
+        for job in list(self._jobs.values()):
+            self._cancel(job)
+
+    def shutdown(self) -> None:
+        """Cancel outstanding work and stop the worker processes."""
+        self.cancel_all()
+        # Finished analyses are still written; each write takes a few milliseconds
+        self._writer.shutdown(wait=True)
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            self._progress.put(None)
+        except (OSError, EOFError):
+            pass
+        self._listener.join(timeout=1.0)
+        self._manager.shutdown()
+
+    def _cancel(self, job: _Job) -> None:
+        job.cancelled = True
+        if self._jobs.get(job.audio_file) is job:
+            del self._jobs[job.audio_file]
+        if job.future is not None:
+            self._cancelled[job.job_id] = True
+            self.logger.debug(f"Cancelled analysis of {job.audio_file}")
+
+    def _dispatch(self) -> None:
+        """Submit pending jobs in priority order while worker slots are free."""
+        while self._pending:
+            priority, job_id, path = self._pending[0]
+            job = self._jobs.get(path)
+            if job is None or job.job_id != job_id or job.future is not None or job.priority != priority:
+                heapq.heappop(self._pending)  # Stale heap entry
+                continue
+            if len(self._running) >= self.max_workers:
+                if priority != CURRENT_PRIORITY:
+                    break
+                # The current track must not wait behind speculative work: preempt the least urgent job
+                victim = max((j for j in self._running.values() if not j.cancelled),
+                             key=lambda j: j.priority, default=None)
+                if (victim is None or victim.priority == CURRENT_PRIORITY
+                        or any(j.cancelled for j in self._running.values())):
+                    break
+                self._cancel(victim)
+                requeued = _Job(next(self._ids), victim.audio_file, victim.priority)
+                self._jobs[victim.audio_file] = requeued
+                heapq.heappush(self._pending, (requeued.priority, requeued.job_id, requeued.audio_file))
+                break
+            heapq.heappop(self._pending)
+            if self._executor is None:
+                self._start()
+            self.logger.debug(f"Starting analysis of {path} (priority {priority})")
+            job.submitted_at = time.perf_counter()
+            job.future = self._executor.submit(_run_analysis, job.job_id, path,
+                                               self._cancelled, self._progress)
+            self._running[job.job_id] = job
+            self._active[job.job_id] = job
+            job.future.add_done_callback(
+                lambda future, job_id=job.job_id: self._job_done.emit(job_id, future))
+
+    def _listen(self) -> None:
+        """Forward worker progress messages to the main thread."""
+        while True:
+            try:
+                message = self._progress.get()
+            except (OSError, EOFError):
+                return
+            if message is None:
+                return
+            self._message_received.emit(*message)
+
+    def _on_message(self, kind: str, job_id: int, first, second, third) -> None:
+        job = self._active.get(job_id)
+        if job is None or job.cancelled:
+            return
+        is_current = job.audio_file == self.current_file
+        if kind == "started":
+            job.expected_bins = first
+            if is_current:
+                self.analysis_started.emit(job.audio_file, first)
+        elif kind == "chunk":
+            job.envelopes.append(first)
+            job.energies.append(second)
+            job.mels.append(third)
+            if is_current:
+                self.chunk_ready.emit(job.audio_file, first, second, third)
+        elif kind == "done":
+            del self._active[job_id]
+            if self._jobs.get(job.audio_file) is job:
+                del self._jobs[job.audio_file]
+            self._storing[job.audio_file] = job
+            future = self._writer.submit(self._store, job, first, second, third)
+            future.add_done_callback(lambda future, job=job: self._job_stored.emit(job))
+            self.logger.debug(f"Finished analysis of {job.audio_file}")
+            if is_current:
+                self.analysis_finished.emit(job.audio_file)
+
+    def _store(self, job: _Job, tempo: float, confidence: float, beat_time: float) -> None:
+        """Write a finished analysis to the cache; runs on the writer thread."""
+        try:
+            if self.cache is not None:
+                self.cache.put(job.audio_file, analysis_params(False),
+                               {"envelope": np.concatenate(job.envelopes, axis=1),
+                                "energy": np.concatenate(job.energies),
+                                "mel": np.concatenate(job.mels, axis=1)},
+                               {"tempo": tempo, "tempo_confidence": confidence, "beat_time": beat_time})
+            if self.catalog is not None:
+                self.catalog.set_analysis_status(job.audio_file, "analysed")
+        except Exception as e:
+            self.logger.error(f"Could not store the analysis of {job.audio_file}: {e}")
+
+    def _on_job_stored(self, job: _Job) -> None:
+        if self._storing.get(job.audio_file) is job:
+            del self._storing[job.audio_file]
+
+    def _on_job_done(self, job_id: int, future: Future) -> None:
+        # A successful job stays active until its "done" message has been processed
+        job = self._running.pop(job_id, None)
+        self._cancelled.pop(job_id, None)
+        if job is None:
+            return
+        if not future.cancelled() and future.exception() is None and future.result():
+            instrumentation.observe("analysis.job_ms", (time.perf_counter() - job.submitted_at) * 1000)
+        if future.cancelled() or future.exception() is not None or not future.result():
+            self._active.pop(job_id, None)
+            if self._jobs.get(job.audio_file) is job:
+                del self._jobs[job.audio_file]
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error(f"Analysis of {job.audio_file} failed: {future.exception()}")
+            if self.catalog is not None:
+                self.catalog.set_analysis_status(job.audio_file, "failed")
+            if not job.cancelled:
+                self.analysis_failed.emit(job.audio_file, str(future.exception()))
+        self._dispatch()
@@ -0,0 +1,601 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+# Headless: no audio device and no display are needed
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "hide")
+
+import numpy as np
+import soundfile as sf
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_RATE = 44100
+
+TEMPO_BPMS = [75, 90, 120, 140, 174]
+
+# Vocabulary of the synthetic track names the search index is measured on
+SEARCH_WORDS = ("tavern inn forest battle dragon cave dungeon storm rain night market city castle village "
+                "tension boss epic calm mystery horror ship sea wind fire ice desert temple ritual chase "
+                "stealth sad happy festival bard lute drum choir ambient theme").split()
+
+# Library sizes; "full" is the reference configuration, "quick" a smoke run
+SIZES = {
+    "full": {"depth": 4, "branching": 8, "tree_files": 100_000, "flat_files": 10_000,
+             "audio_seconds": [30, 180, 600], "bpm_seconds": 30, "tempo_seconds": 180, "search_tracks": 200_000,
+             "repeat": 5},
+    "quick": {"depth": 3, "branching": 5, "tree_files": 5_000, "flat_files": 2_000,
+              "audio_seconds": [10, 30], "bpm_seconds": 10, "tempo_seconds": 30, "search_tracks": 20_000,
+              "repeat": 3},
+}
+
+
+def write_audio(path: str, seconds: float, kind: str, channels: int = 2, bpm: float = 120.0) -> None:
+    """Write a 16-bit test signal: a 440 Hz sine with a pulse on every beat, a drum loop, or white noise."""
+    rng = np.random.default_rng(0)
+    frames = int(seconds * SAMPLE_RATE)
+    t = np.arange(frames) / SAMPLE_RATE
+    if kind == "sine":
+        pulse = 0.5 + 0.5 * (np.mod(t, 60 / bpm) < 0.05)
+        signal = 0.5 * np.sin(2 * np.pi * 440 * t) * pulse
+    elif kind == "drums":
+        # Kick on the beat, hi-hat on every half beat, over a slowly swelling pad and a little noise
+        beat = np.mod(t, 60 / bpm)
+        kick = np.exp(-30 * beat) * np.sin(2 * np.pi * 60 * beat)
+        hat = np.exp(-80 * np.mod(t, 30 / bpm)) * rng.normal(0, 0.3, frames)
+        pad = 0.1 * np.sin(2 * np.pi * 220 * t) * np.sin(2 * np.pi * 0.1 * t)
+        signal = 0.6 * kick + 0.3 * hat + pad + rng.normal(0, 0.02, frames)
+    else:
+        signal = rng.uniform(-0.5, 0.5, frames)
+    sf.write(path, np.repeat(signal[:, None], channels, axis=1).astype(np.float32), SAMPLE_RATE, subtype="PCM_16")
+
+
+def _link(source: str, target: str) -> None:
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def build_library(workdir: str, size: dict) -> dict:
+    """Create the synthetic library under ``workdir``, reusing it if it was built with the same size."""
+    marker = os.path.join(workdir, "library.json")
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            library = json.load(f)
+        if library["size"] == size:
+            return library
+    except (OSError, ValueError, KeyError):
+        pass
+    for name in ("tree", "flat", "audio"):
+        shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+
+    # Library entries are hard links to one short track, so building 100k files stays cheap
+    template = os.path.join(workdir, "template.wav")
+    write_audio(template, 0.5, "sine")
+
+    tree = os.path.join(workdir, "tree")
+    folders = [tree]
+    level = [tree]
+    for _ in range(size["depth"]):
+        level = [os.path.join(parent, f"d{i}") for parent in level for i in range(size["branching"])]
+        folders.extend(level)
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    for i in range(size["tree_files"]):
+        _link(template, os.path.join(folders[i % len(folders)], f"track{i:06d}.wav"))
+
+    flat = os.path.join(workdir, "flat")
+    os.makedirs(flat)
+    for i in range(size["flat_files"]):
+        _link(template, os.path.join(flat, f"track{i:06d}.wav"))
+
+    audio_dir = os.path.join(workdir, "audio")
+    os.makedirs(audio_dir)
+    audio = {}
+    for seconds in sorted(set(size["audio_seconds"] + [size["bpm_seconds"]])):
+        for kind in ("sine", "noise"):
+            path = os.path.join(audio_dir, f"{kind}_{seconds}s.wav")
+            write_audio(path, seconds, kind)
+            audio[f"{kind}_{seconds}s"] = path
+
+    library = {"size": size, "tree": tree, "folders": len(folders), "flat": flat, "audio": audio}
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(library, f)
+    return library
+
+
+def measure(fn: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]] = None) -> dict:
+    """Run ``fn`` ``repeat`` times and return its timings in seconds; ``setup`` runs untimed before each run."""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            runs.append(time.perf_counter() - start)
+    return {"median": statistics.median(runs), "min": min(runs), "runs": runs}
+
+
+def bench_scan(library: dict, workdir: str, repeat: int) -> dict:
+    """Full recursive library scans into the catalog, cold and with nothing changed."""
+    from library_catalog import LibraryCatalog
+
+    state = {}
+
+    def fresh_catalog() -> None:
+        if "catalog" in state:
+            state["catalog"].close()
+        db_path = os.path.join(workdir, "scan.sqlite3")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        state["catalog"] = LibraryCatalog(db_path)
+
+    results = {"scan.catalog_cold": measure(lambda: state["catalog"].scan(library["tree"]), repeat, fresh_catalog),
+               "scan.catalog_warm": measure(lambda: state["catalog"].scan(library["tree"]), repeat)}
+    state["catalog"].close()
+    return results
+
+
+def bench_folder_tree(library: dict, workdir: str, repeat: int) -> dict:
+    """Expanding every node of the folder tree, straight from disk and through a warm catalog."""
+    from folder_tree import FolderTree
+    from library_catalog import LibraryCatalog
+
+    def expand_all(catalog) -> None:
+        folder_tree = FolderTree(library["tree"], catalog)
+        nodes = list(folder_tree.tree["folders"])
+        while nodes:
+            nodes.extend(folder_tree.load_children(nodes.pop()))
+
+    catalog = LibraryCatalog(os.path.join(workdir, "tree.sqlite3"))
+    catalog.scan(library["tree"])
+    results = {"folder_tree.expand_all_disk": measure(lambda: expand_all(None), repeat),
+               "folder_tree.expand_all_catalog": measure(lambda: expand_all(catalog), repeat)}
+    catalog.close()
+    return results
+
+
+def bench_playlist(library: dict, workdir: str, repeat: int) -> dict:
+    """Loading a large flat folder as a playlist, shuffling and unshuffling it."""
+    from library_catalog import LibraryCatalog
+    from music_player import MusicPlayer
+
+    db_path = os.path.join(workdir, "playlist.sqlite3")
+    state = {"catalog": None}
+
+    def fresh_catalog() -> None:
+        if state["catalog"] is not None:
+            state["catalog"].close()
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        state["catalog"] = LibraryCatalog(db_path)
+        player.catalog = state["catalog"]
+        player.clear_playlist()
+
+    player = MusicPlayer()
+    try:
+        results = {"playlist.load_cold": measure(lambda: player.load_playlist(library["flat"]), repeat, fresh_catalog),
+                   "playlist.load_warm": measure(lambda: player.load_playlist(library["flat"]), repeat,
+                                                 player.clear_playlist)}
+        player.catalog = None
+        results["playlist.load_no_catalog"] = measure(lambda: player.load_playlist(library["flat"]), repeat,
+                                                      player.clear_playlist)
+        results["playlist.shuffle"] = measure(player.shuffle_playlist, repeat)
+        results["playlist.unshuffle"] = measure(player.unshuffle_playlist, repeat)
+    finally:
+        player.shutdown()
+        if state["catalog"] is not None:
+            state["catalog"].close()
+    return results
+
+
+def bench_probe(library: dict, workdir: str, repeat: int) -> dict:
+    """Header-only duration probes over the flat folder."""
+    from decoders import get_duration
+
+    paths = [os.path.join(library["flat"], name) for name in sorted(os.listdir(library["flat"]))]
+    return {"decoders.probe_flat": measure(lambda: [get_duration(path) for path in paths], repeat)}
+
+
+def bench_analysis(library: dict, workdir: str, repeat: int) -> dict:
+    """Streaming waveform analysis of every test signal, and one full analysis with tempo."""
+    from spectrogram import generate_spectrogram_data
+
+    size = library["size"]
+    results = {}
+    for seconds in size["audio_seconds"]:
+        for kind in ("sine", "noise"):
+            path = library["audio"][f"{kind}_{seconds}s"]
+            results[f"analysis.stream_{kind}_{seconds}s"] = measure(lambda: generate_spectrogram_data(path), repeat)
+    path = library["audio"][f"sine_{size['bpm_seconds']}s"]
+    # Warm up first: the first tempo estimate also pays for importing librosa and compiling its kernels
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_spectrogram_data(path, include_bpm=True)
+    results[f"analysis.bpm_sine_{size['bpm_seconds']}s"] = measure(
+        lambda: generate_spectrogram_data(path, include_bpm=True), max(1, repeat // 2))
+    return results
+
+
+def bench_tempo(library: dict, workdir: str, repeat: int) -> dict:
+    """Tempo of pulse and drum tracks at known tempos: librosa over the whole track against the fast profile.
+
+    Besides the timings, each result records the mean absolute error in BPM
+    and the number of estimates off by more than 4 %, which are usually
+    octave errors.
+    """
+    from decoders import stream_audio
+    from spectrogram import SAMPLE_RATE as ANALYSIS_RATE
+    from tempo import exact_tempo, fast_tempo
+
+    seconds = library["size"]["tempo_seconds"]
+    tempo_dir = os.path.join(workdir, "tempo")
+    os.makedirs(tempo_dir, exist_ok=True)
+    tracks = []
+    for kind in ("sine", "drums"):
+        for bpm in TEMPO_BPMS:
+            path = os.path.join(tempo_dir, f"{kind}_{bpm}_{seconds}s.wav")
+            if not os.path.exists(path):
+                write_audio(path, seconds, kind, bpm=bpm)
+            tracks.append((path, bpm))
+
+    def exact(path: str) -> float:
+        return exact_tempo(np.concatenate(list(stream_audio(path, ANALYSIS_RATE))), ANALYSIS_RATE)
+
+    def fast(path: str) -> float:
+        return fast_tempo(path)[0]
+
+    # Warm up first: the first exact estimate also pays for importing librosa and compiling its kernels
+    with contextlib.redirect_stdout(io.StringIO()):
+        exact(tracks[0][0])
+    results = {}
+    for mode, estimate in (("exact", exact), ("fast", fast)):
+        runs, errors = [], []
+        for path, bpm in tracks:
+            estimates = []
+            runs.extend(measure(lambda: estimates.append(estimate(path)), max(1, repeat // 2))["runs"])
+            errors.append(estimates[-1] - bpm)
+        misses = sum(abs(error) > 0.04 * bpm for error, (_, bpm) in zip(errors, tracks))
+        results[f"analysis.tempo_{mode}_{seconds}s"] = {
+            "median": statistics.median(runs), "min": min(runs), "runs": runs,
+            "mean_abs_error_bpm": round(statistics.mean(abs(error) for error in errors), 2),
+            "misses": misses,
+        }
+        print(f"  {mode}: mean error {results[f'analysis.tempo_{mode}_{seconds}s']['mean_abs_error_bpm']} BPM, "
+              f"{misses} of {len(tracks)} tracks off by more than 4 %")
+    exact_median = results[f"analysis.tempo_exact_{seconds}s"]["median"]
+    print(f"  fast profile is {exact_median / results[f'analysis.tempo_fast_{seconds}s']['median']:.0f}x faster")
+    return results
+
+
+def bench_render(library: dict, workdir: str, repeat: int) -> dict:
+    """Drawing the spectrogram of the longest test signal into an offscreen view, and moving its playhead."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication
+    from spectrogram import iter_spectrogram_data
+    from spectrogram_view import SpectrogramView
+
+    app = QApplication.instance() or QApplication([])
+    seconds = max(library["size"]["audio_seconds"])
+    chunks = list(iter_spectrogram_data(library["audio"][f"noise_{seconds}s"]))
+    view = SpectrogramView()
+    view.resize(1600, 150)
+
+    def load() -> None:
+        view.clear()
+        for envelope, energy, mel in chunks:
+            view.append(mel, envelope)
+        view.refresh()
+
+    load()
+    results = {f"ui.render_spectrogram_{seconds}s": measure(view.refresh, repeat * 4),
+               f"ui.load_and_render_spectrogram_{seconds}s": measure(load, repeat)}
+    view.show()
+    app.processEvents()
+    frames = iter(range(10 ** 9))
+
+    def playhead_frame() -> None:
+        # One 60 fps frame: move the playhead by a pixel and paint the damaged columns
+        view.set_playhead(next(frames) % view.width(), view.width())
+        app.processEvents()
+
+    results["ui.playhead_frame"] = measure(playhead_frame, repeat * 100)
+    view.close()
+    return results
+
+
+def bench_search(library: dict, workdir: str, repeat: int) -> dict:
+    """Building the search index over synthetic track paths and querying it with typos, partial words and phrases."""
+    from search_index import SearchIndex
+
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(library["size"]["search_tracks"]):
+        # A dozen tracks per album folder, as in a real library
+        album = i // 12
+        if i % 12 == 0:
+            artist = rng.choice(SEARCH_WORDS, 2)
+        title = rng.choice(SEARCH_WORDS, 3, replace=False)
+        paths.append(os.path.join(os.sep, "music", f"{artist[0].title()} {artist[1]} {album % 97}",
+                                  f"Album {album}", f"{i % 12 + 1:02d} {' '.join(title)}.mp3"))
+    index = SearchIndex()
+
+    def build() -> None:
+        index.clear()
+        index.update((path, {}) for path in paths)
+
+    results = {f"search.build_{len(paths)}": measure(build, repeat)}
+    for label, query in (("exact", "tavern"), ("typo", "dargon"), ("partial", "stea"),
+                         ("phrase", "dragon battle night")):
+        results[f"search.query_{label}"] = measure(lambda query=query: index.search(query), repeat * 20)
+    return results
+
+
+def bench_control(library: dict, workdir: str, repeat: int) -> dict:
+    """Round trips of control commands through a headless player's server, over loopback TCP and the Unix socket."""
+    import socket
+    from control_server import ControlServer, HeadlessController, PlayerCommands
+    from music_player import MusicPlayer
+
+    player = MusicPlayer()
+    controller = HeadlessController(player)
+    server = ControlServer(PlayerCommands(controller), port=0, socket_path=os.path.join(workdir, "control.sock"))
+    controller.on_change = server.notify
+    server.start()
+    connections = [("tcp", socket.create_connection((server.host, server.port)))]
+    if server.socket_path is not None:
+        unix = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix.connect(server.socket_path)
+        connections.append(("unix", unix))
+    results = {}
+    try:
+        for transport, connection in connections:
+            stream = connection.makefile("rwb")
+
+            def round_trip(request: bytes) -> None:
+                stream.write(request)
+                stream.flush()
+                stream.readline()
+
+            round_trip(b'{"cmd": "subscribe"}\n')
+            results[f"control.status_{transport}"] = measure(lambda: round_trip(b'{"cmd": "status"}\n'), repeat * 100)
+            results[f"control.volume_{transport}"] = measure(
+                lambda: round_trip(b'{"cmd": "volume", "level": 0.8}\n'), repeat * 100)
+            stream.close()
+            connection.close()
+    finally:
+        server.stop()
+        player.shutdown()
+    return results
+
+
+def bench_scenes(library: dict, workdir: str, repeat: int) -> dict:
+    """Time from switching music to hearing it: loading a folder as on double-click against a warm or cold scene preset."""
+    from library_catalog import LibraryCatalog
+    from music_player import MusicPlayer
+    from scenes import Scene, ScenePresets
+
+    catalog = LibraryCatalog(os.path.join(workdir, "scenes.sqlite3"))
+    catalog.scan(library["flat"])
+    player = MusicPlayer(catalog=catalog)
+    scene = Scene("flat", folder=library["flat"])
+    warm = ScenePresets(player, os.path.join(workdir, "scenes_warm.json"))
+    cold = ScenePresets(player, os.path.join(workdir, "scenes_cold.json"), budget_bytes=0)
+    for presets in (warm, cold):
+        presets.save(scene)
+
+    def wait_for_audio() -> None:
+        # Audio starts when the engine hands the first decoded frames of the new track to the mixer
+        while player.engine.current is None or not player.engine.current.started:
+            time.sleep(0.0002)
+
+    def folder_switch() -> None:
+        player.clear_playlist()
+        player.load_playlist(library["flat"])
+        player.play_from_index(0)
+        wait_for_audio()
+
+    def wait_until_warm() -> None:
+        while scene.name not in warm.warm_names:
+            time.sleep(0.001)
+
+    try:
+        results = {"scenes.folder_switch": measure(folder_switch, repeat * 4),
+                   "scenes.cold_switch": measure(lambda: (player.start_scene(cold.take(scene.name)), wait_for_audio()),
+                                                 repeat * 4),
+                   "scenes.warm_switch": measure(lambda: (player.start_scene(warm.take(scene.name)), wait_for_audio()),
+                                                 repeat * 4, wait_until_warm)}
+    finally:
+        for presets in (warm, cold):
+            presets.shutdown()
+        player.shutdown()
+        catalog.close()
+    return results
+
+
+def bench_startup(library: dict, workdir: str, repeat: int) -> dict:
+    """Time from interpreter start to the main window's first event loop pass, in a fresh process each run."""
+    process_runs, window_runs = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "_startup"], cwd=workdir,
+                                capture_output=True, text=True, timeout=120, check=True).stdout
+        process_runs.append(time.perf_counter() - start)
+        window_runs.append(float(output.strip().splitlines()[-1]))
+    return {name: {"median": statistics.median(runs), "min": min(runs), "runs": runs}
+            for name, runs in (("ui.startup_process", process_runs), ("ui.startup_window", window_runs))}
+
+
+BENCHMARKS = {
+    "scan": bench_scan,
+    "folder_tree": bench_folder_tree,
+    "playlist": bench_playlist,
+    "probe": bench_probe,
+    "analysis": bench_analysis,
+    "tempo": bench_tempo,
+    "render": bench_render,
+    "search": bench_search,
+    "control": bench_control,
+    "scenes": bench_scenes,
+    "startup": bench_startup,
+}
+
+
+def _startup() -> None:
+    """Build the main window, print the seconds it took and exit (run in a child process)."""
+    start = time.perf_counter()
+    sys.path.insert(0, REPO_DIR)
+    from PyQt6.QtCore import QTimer
+    from PyQt6.QtWidgets import QApplication
+    from ui import DMToolsUI
+
+    app = QApplication(sys.argv)
+    window = DMToolsUI()
+    window.show()
+
+    def done() -> None:
+        print(time.perf_counter() - start)
+        window.close()
+        app.quit()
+
+    QTimer.singleShot(0, done)
+    app.exec()
+
+
+def run(size_name: str, only: Optional[list[str]], workdir: Optional[str]) -> dict:
+    """Build (or reuse) the synthetic library and run the selected benchmarks."""
+    size = SIZES[size_name]
+    keep = workdir is not None
+    workdir = os.path.abspath(workdir) if keep else tempfile.mkdtemp(prefix="dmtools-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, REPO_DIR)
+    cwd = os.getcwd()
+    os.chdir(workdir)  # Caches and logs written by the app land in the work directory
+    try:
+        start = time.perf_counter()
+        library = build_library(workdir, size)
+        print(f"Library ready in {time.perf_counter() - start:.1f} s: {library['folders']} folders, "
+              f"{size['tree_files']} tree files, {size['flat_files']} flat files in {workdir}")
+        results = {}
+        for name, bench in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            print(f"Running {name}...")
+            for key, result in bench(library, workdir, size["repeat"]).items():
+                results[key] = result
+                print(f"  {key:<40} {result['median'] * 1000:10.2f} ms (min {result['min'] * 1000:.2f} ms)")
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "size": size_name,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "commit": _git_commit(),
+        },
+        "results": results,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta: float) -> list[str]:
+    """Print a side-by-side table and return the names of benchmarks that regressed.
+
+    A benchmark regresses when its median is more than ``threshold`` (a
+    fraction) slower than the baseline and at least ``min_delta`` seconds
+    slower, so that noise on very short timings is not reported.
+    """
+    if baseline["meta"].get("size") != current["meta"].get("size"):
+        print(f"Warning: comparing a {baseline['meta'].get('size')} baseline with a "
+              f"{current['meta'].get('size')} run")
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>12} {result['median'] * 1000:10.2f} ms {'new':>8}")
+            continue
+        old, new = before["median"], result["median"]
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > threshold and new - old >= min_delta:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold and old - new >= min_delta:
+            flag = "  improved"
+        print(f"{name:<40} {old * 1000:9.2f} ms {new * 1000:9.2f} ms {change:+8.1%}{flag}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Headless benchmarks for library scanning, playlists and analysis.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("run", "compare"):
+        sub = subparsers.add_parser(command)
+        if command == "compare":
+            sub.add_argument("baseline", help="results JSON to compare against")
+            sub.add_argument("current", nargs="?", help="results JSON to compare; runs the suite if omitted")
+            sub.add_argument("--threshold", type=float, default=0.2,
+                             help="relative slowdown reported as a regression (default 0.2)")
+            sub.add_argument("--min-delta", type=float, default=0.002,
+                             help="smallest slowdown in seconds reported as a regression (default 0.002)")
+        sub.add_argument("--size", choices=sorted(SIZES), default="full")
+        sub.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+        sub.add_argument("--workdir", help="keep the synthetic library here and reuse it on later runs")
+        sub.add_argument("--output", help="write the results JSON here")
+    subparsers.add_parser("_startup")
+    args = parser.parse_args()
+
+    if args.command == "_startup":
+        _startup()
+        return 0
+
+    if args.command == "compare" and args.current:
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        current = run(args.size, args.only, args.workdir)
+        output = args.output or ("benchmark-results.json" if args.command == "run" else None)
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2)
+            print(f"Results written to {output}")
+    if args.command == "run":
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, current, args.threshold, args.min_delta)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from analysis_cache import AnalysisCache
+from library_catalog import LibraryCatalog
+from logging_utils import setup_logger
+from music_player import MusicPlayer
+from scenes import ScenePresets
+
+DEFAULT_PORT = 47474
+DEFAULT_SOCKET_PATH = os.path.join("cache", "control.sock")
+MAX_LINE_BYTES = 64 * 1024
+MAX_EVENT_BACKLOG = 256 * 1024  # Bytes of unsent events after which a subscriber is dropped instead of buffered
+
+
+class HeadlessController:
+    """Playback transport without Qt, with the methods of PlaybackController.
+
+    ``on_change`` is called after every change of state or track, from the
+    calling thread or, on auto-advance, from the engine's feeder thread.
+    """
+
+    def __init__(self, music_player: MusicPlayer) -> None:
+        self.music_player = music_player
+        self.duration = 0.0
+        self.on_change: Optional[Callable[[], None]] = None
+        music_player.on_track_change = self._changed
+
+    @property
+    def state(self) -> str:
+        if self.music_player.is_paused:
+            return "paused"
+        return "playing" if self.music_player.is_playing else "stopped"
+
+    def play_index(self, index: int) -> None:
+        self.music_player.play_from_index(index, fade=True)
+        self._changed()
+
+    def start_scene(self, prepared) -> None:
+        self.music_player.start_scene(prepared)
+        self._changed()
+
+    def next(self) -> None:
+        if self.music_player.playlist:
+            self.music_player.play_next_song(fade=True)
+            self._changed()
+
+    def previous(self) -> None:
+        if self.music_player.playlist:
+            self.music_player.play_previous_song(fade=True)
+            self._changed()
+
+    def pause(self) -> None:
+        self.music_player.pause_music()
+        self._changed()
+
+    def resume(self) -> None:
+        self.music_player.resume_music()
+        self._changed()
+
+    def stop(self) -> None:
+        self.music_player.stop_music()
+        self._changed()
+
+    def seek(self, seconds: float) -> None:
+        if self.state == "stopped":
+            return
+        self.music_player.seek(max(0.0, min(seconds, self.duration or seconds)))
+        self._changed()
+
+    def _changed(self) -> None:
+        if self.music_player.is_playing:
+            self.duration = self.music_player.duration_of(self.music_player.current_song)
+        if self.on_change is not None:
+            self.on_change()
+
+
+class PlayerCommands:
+    """The commands of the control protocol, run against a PlaybackController or HeadlessController.
+
+    Commands must run on the thread that owns the player (the Qt thread in
+    the GUI); ``ControlServer`` takes care of that. Each one returns the
+    player status afterwards. Invalid commands or arguments raise
+    ValueError.
+    """
+
+    def __init__(self, controller, presets: Optional[ScenePresets] = None) -> None:
+        self.controller = controller
+        self.music_player: MusicPlayer = controller.music_player
+        self.presets = presets
+        self.on_playlist_changed: Optional[Callable[[], None]] = None  # E.g. to refresh a playlist view
+        self._handlers = {
+            "status": lambda: None,
+            "play": self.play,
+            "pause": self.pause,
+            "resume": self.controller.resume,
+            "toggle": self.toggle,
+            "stop": self.controller.stop,
+            "next": self.controller.next,
+            "previous": self.controller.previous,
+            "seek": self.seek,
+            "volume": self.volume,
+            "scene": self.scene,
+        }
+
+    def run(self, name, args: dict) -> dict:
+        """Run the named command with keyword arguments and return the status."""
+        handler = self._handlers.get(name)
+        if handler is None:
+            raise ValueError(f"Unknown command: {name}")
+        try:
+            inspect.signature(handler).bind(**args)
+        except TypeError as e:
+            raise ValueError(f"Bad arguments for {name}: {e}")
+        handler(**args)
+        return self.status()
+
+    def status(self) -> dict:
+        player = self.music_player
+        state = self.controller.state
+        return {
+            "state": state,
+            "track": player.current_song,
+            "index": player.current_index if player.current_song is not None else None,
+            "position": round(player.engine.position(), 3) if state != "stopped" else 0.0,
+            "duration": self.controller.duration,
+            "volume": player.volume,
+            "tracks": len(player.playlist),
+        }
+
+    def play(self, index: Optional[int] = None) -> None:
+        """Play the track at ``index``, or resume, or start the current track when stopped."""
+        if index is not None:
+            if not 0 <= int(index) < len(self.music_player.playlist):
+                raise ValueError(f"No track at index {index}")
+            self.controller.play_index(int(index))
+        elif self.controller.state == "paused":
+            self.controller.resume()
+        elif self.controller.state == "stopped" and self.music_player.playlist:
+            self.controller.play_index(self.music_player.current_index)
+
+    def pause(self) -> None:
+        if self.controller.state == "playing":
+            self.controller.pause()
+
+    def toggle(self) -> None:
+        if self.controller.state == "playing":
+            self.controller.pause()
+        else:
+            self.play()
+
+    def seek(self, position: float) -> None:
+        self.controller.seek(float(position))
+
+    def volume(self, level: float) -> None:
+        self.music_player.set_volume(float(level))
+
+    def scene(self, name: Optional[str] = None, folder: Optional[str] = None) -> None:
+        """Switch to a saved scene by ``name``, or play a folder's tracks like double-clicking the folder."""
+        if (name is None) == (folder is None):
+            raise ValueError("Give either a scene name or a folder")
+        if name is not None:
+            if self.presets is None:
+                raise ValueError("Scenes are not available")
+            self.controller.start_scene(self.presets.take(str(name)))
+        else:
+            if not os.path.isdir(folder):
+                raise ValueError(f"Not a folder: {folder}")
+            self.music_player.clear_playlist()
+            self.music_player.load_playlist(folder)
+            if self.music_player.playlist:
+                self.controller.play_index(0)
+        if self.on_playlist_changed is not None:
+            self.on_playlist_changed()
+
+
+class ControlServer:
+    """Local control plane: newline-delimited JSON over a Unix socket and loopback TCP.
+
+    A request is one JSON object per line, e.g.
+    ``{"id": 1, "cmd": "seek", "position": 30}``. The reply echoes ``id``
+    and has ``ok`` with either the player ``status`` or an ``error``.
+    Sending ``{"cmd": "subscribe"}`` also pushes a
+    ``{"event": "status", "status": {...}}`` line to the connection
+    whenever playback changes; a subscriber that stops reading is
+    disconnected rather than buffered without bound.
+
+    The server runs on an asyncio loop, either on a background thread
+    (``start``) or on the calling thread (``run``). Commands run through
+    ``submit``, which hands a callable to the thread that owns the player
+    and returns a Future; without it they run on the loop itself, which
+    then owns the player. Only loopback and a user-only socket file are
+    bound, so another machine needs an SSH tunnel to connect.
+    """
+
+    def __init__(self, commands: PlayerCommands, submit: Optional[Callable[[Callable[[], object]], Future]] = None,
+                 port: Optional[int] = DEFAULT_PORT, socket_path: Optional[str] = DEFAULT_SOCKET_PATH,
+                 host: str = "127.0.0.1") -> None:
+        self.commands = commands
+        self.submit = submit
+        self.host = host
+        self.port = port  # The bound port once listening, so 0 picks a free one
+        self.socket_path = socket_path if hasattr(socket, "AF_UNIX") else None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._subscribers: set[asyncio.StreamWriter] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._status_pending = False
+        self._status_stale = False  # Playback changed again while a status push was pending
+
+    def start(self) -> None:
+        """Serve on a background thread; returns once the server is listening."""
+        self._thread = threading.Thread(target=self.run, name="control-server", daemon=True)
+        self._thread.start()
+        self._ready.wait(5.0)
+
+    def run(self) -> None:
+        """Serve on the calling thread until ``stop`` is called."""
+        asyncio.run(self._serve())
+
+    def stop(self) -> None:
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass  # The loop has already finished
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def notify(self) -> None:
+        """Push the player status to subscribers; safe to call from any thread."""
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._schedule_status)
+            except RuntimeError:
+                pass
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        servers, unix = [], False
+        try:
+            if self.port is not None:
+                server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_LINE_BYTES)
+                self.port = server.sockets[0].getsockname()[1]
+                servers.append(server)
+            if self.socket_path is not None and self._claim_socket_path():
+                server = await asyncio.start_unix_server(self._handle, self.socket_path, limit=MAX_LINE_BYTES)
+                os.chmod(self.socket_path, 0o600)
+                servers.append(server)
+                unix = True
+        except OSError as e:
+            logging.error(f"Control server could not listen: {e}")
+            for server in servers:
+                server.close()
+            self._loop = None
+            self._ready.set()
+            return
+        logging.info(f"Control server listening on {self.host}:{self.port}"
+                     + (f" and {self.socket_path}" if unix else ""))
+        self._ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            self._loop = None
+            for server in servers:
+                server.close()
+            for writer in list(self._connections):
+                writer.close()
+            if unix and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def _claim_socket_path(self) -> bool:
+        """Make room for the Unix socket, unless another running instance is listening on it."""
+        folder = os.path.dirname(self.socket_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        if not os.path.exists(self.socket_path):
+            return True
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            logging.warning(f"{self.socket_path} is in use by another instance; listening on TCP only")
+            return False
+        except OSError:
+            os.remove(self.socket_path)  # Left behind by an instance that did not shut down cleanly
+            return True
+        finally:
+            probe.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(self._encode({"id": None, "ok": False, "error": "Request too long"}))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    writer.write(self._encode(await self._reply(line, writer)))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            self._subscribers.discard(writer)
+            writer.close()
+
+    async def _reply(self, line: bytes, writer: asyncio.StreamWriter) -> dict:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            return {"id": None, "ok": False, "error": f"Bad request: {e}"}
+        reply = {"id": request.pop("id", None)}
+        name = request.pop("cmd", None)
+        if name == "subscribe":
+            self._subscribers.add(writer)
+            name = "status"
+        elif name == "unsubscribe":
+            self._subscribers.discard(writer)
+            name = "status"
+        try:
+            status = await self._call(lambda: self.commands.run(name, request))
+            reply.update(ok=True, status=status)
+        except ValueError as e:
+            reply.update(ok=False, error=str(e))
+        except Exception as e:
+            logging.exception(f"Control command {name} failed")
+            reply.update(ok=False, error=f"{type(e).__name__}: {e}")
+        return reply
+
+    async def _call(self, fn: Callable[[], object]):
+        if self.submit is None:
+            return fn()
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def _schedule_status(self) -> None:
+        if not self._subscribers or self._loop is None:
+            return
+        if self._status_pending:
+            # Coalesced into one more push once the pending one is out
+            self._status_stale = True
+            return
+        self._status_pending = True
+        task = self._loop.create_task(self._push_status())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _push_status(self) -> None:
+        try:
+            status = await self._call(self.commands.status)
+        finally:
+            self._status_pending = False
+        line = self._encode({"event": "status", "status": status})
+        for writer in list(self._subscribers):
+            if writer.transport.get_write_buffer_size() > MAX_EVENT_BACKLOG:
+                logging.warning("Dropping a control client that stopped reading events")
+                self._subscribers.discard(writer)
+                writer.close()
+            else:
+                writer.write(line)
+        if self._status_stale:
+            self._status_stale = False
+            self._schedule_status()
+
+    @staticmethod
+    def _encode(message: dict) -> bytes:
+        return json.dumps(message).encode("utf-8") + b"\n"
+
+
+def run_headless(port: Optional[int] = DEFAULT_PORT, socket_path: Optional[str] = DEFAULT_SOCKET_PATH,
+                 folder: Optional[str] = None, debug: bool = False) -> int:
+    """Run the player without Qt, driven only through the control server, until interrupted."""
+    setup_logger(debug)
+    catalog = LibraryCatalog()
+    analysis_cache = AnalysisCache()
+    player = MusicPlayer(debug=debug, catalog=catalog, analysis_cache=analysis_cache)
+    controller = HeadlessController(player)
+    presets = ScenePresets(player)
+    server = ControlServer(PlayerCommands(controller, presets), port=port, socket_path=socket_path)
+    controller.on_change = server.notify
+    if folder:
+        player.load_playlist(folder)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        presets.shutdown()
+        player.shutdown()
+        analysis_cache.close()
+        catalog.close()
+    return 0
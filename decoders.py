@@ -0,0 +1,328 @@
+import os
+import struct
+from typing import Iterator, Optional
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+import instrumentation
+
+
+class AudioInfo:
+    """Stream properties of an audio file, as read from its headers."""
+
+    def __init__(self, duration: float, sample_rate: int, channels: int) -> None:
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def __repr__(self) -> str:
+        return f"AudioInfo(duration={self.duration:.3f}, sample_rate={self.sample_rate}, channels={self.channels})"
+
+
+def _skip_id3v2(f) -> int:
+    """Skip an ID3v2 tag at the start of a file and return the offset of the audio data."""
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset = 10 + size + (10 if header[5] & 0x10 else 0)
+    else:
+        offset = 0
+    f.seek(offset)
+    return offset
+
+
+class Decoder:
+    """Probes and decodes one family of audio formats.
+
+    The base class probes with libsndfile and decodes with libsndfile,
+    falling back to audioread for files libsndfile cannot open. Subclasses
+    override ``probe`` to read duration, sample rate and channels straight
+    from the file headers, which costs one or two small reads instead of
+    opening a decoder.
+    """
+
+    extensions: tuple[str, ...] = ()
+
+    def probe(self, path: str) -> AudioInfo:
+        try:
+            info = sf.info(path)
+            return AudioInfo(info.duration, info.samplerate, info.channels)
+        except (sf.LibsndfileError, RuntimeError):
+            import audioread
+            with audioread.audio_open(path) as f:
+                return AudioInfo(f.duration, f.samplerate, f.channels)
+
+    def blocks(self, path: str, block_frames: int, start: float = 0.0) -> Iterator[tuple[np.ndarray, int]]:
+        """Yield (frames, channels) float32 blocks from ``start`` seconds on, and the native sample rate."""
+        try:
+            f = sf.SoundFile(path)
+        except (sf.LibsndfileError, RuntimeError):
+            # libsndfile cannot open this file (e.g. mp3 on older builds), fall back to audioread
+            import audioread
+            with audioread.audio_open(path) as f:
+                skip = int(start * f.samplerate)  # audioread cannot seek, so decode and drop the frames before start
+                for buf in f:
+                    block = np.frombuffer(buf, dtype="<i2").astype(np.float32) / 32768.0
+                    block = block.reshape(-1, f.channels)
+                    if skip:
+                        dropped = min(skip, len(block))
+                        block, skip = block[dropped:], skip - dropped
+                    yield block, f.samplerate
+            return
+        with f:
+            if start > 0:
+                f.seek(min(int(start * f.samplerate), f.frames))
+            while True:
+                block = f.read(block_frames, dtype="float32", always_2d=True)
+                if not len(block):
+                    break
+                yield block, f.samplerate
+
+
+class WavDecoder(Decoder):
+    """RIFF/RF64 WAVE files; probed from the ``fmt `` and ``data`` chunk headers."""
+
+    extensions = (".wav",)
+
+    def probe(self, path: str) -> AudioInfo:
+        with open(path, "rb") as f:
+            riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+            if riff not in (b"RIFF", b"RF64") or wave != b"WAVE":
+                raise ValueError("not a WAVE file")
+            fmt = None
+            data_size64 = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError("no data chunk")
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = struct.unpack("<HHIIHH", f.read(16))
+                    f.seek(size - 16 + (size & 1), 1)
+                elif chunk_id == b"ds64":
+                    data_size64 = struct.unpack("<QQ", f.read(16))[1]
+                    f.seek(size - 16 + (size & 1), 1)
+                elif chunk_id == b"data":
+                    if fmt is None:
+                        raise ValueError("data chunk before fmt chunk")
+                    if data_size64 is not None and size == 0xFFFFFFFF:
+                        size = data_size64
+                    size = min(size, os.fstat(f.fileno()).st_size - f.tell())
+                    break
+                else:
+                    f.seek(size + (size & 1), 1)
+        _, channels, sample_rate, _, block_align, _ = fmt
+        return AudioInfo(size // block_align / sample_rate, sample_rate, channels)
+
+
+class FlacDecoder(Decoder):
+    """FLAC files; probed from the STREAMINFO block."""
+
+    extensions = (".flac",)
+
+    def probe(self, path: str) -> AudioInfo:
+        with open(path, "rb") as f:
+            _skip_id3v2(f)
+            if f.read(4) != b"fLaC":
+                raise ValueError("not a FLAC file")
+            block = f.read(4 + 34)  # STREAMINFO is always the first metadata block
+        if len(block) < 38 or block[0] & 0x7F != 0:
+            raise ValueError("missing STREAMINFO")
+        fields = int.from_bytes(block[4 + 10:4 + 18], "big")
+        sample_rate = fields >> 44
+        channels = ((fields >> 41) & 0x7) + 1
+        total_samples = fields & ((1 << 36) - 1)
+        if not sample_rate or not total_samples:
+            return super().probe(path)  # Streamed encoders may leave the length out
+        return AudioInfo(total_samples / sample_rate, sample_rate, channels)
+
+
+class OggDecoder(Decoder):
+    """Ogg Vorbis and Opus files; probed from the identification header and the last page's granule position."""
+
+    extensions = (".ogg", ".oga", ".opus")
+
+    def probe(self, path: str) -> AudioInfo:
+        with open(path, "rb") as f:
+            page = f.read(27)
+            if len(page) < 27 or page[:4] != b"OggS":
+                raise ValueError("not an Ogg file")
+            segments = f.read(page[26])
+            packet = f.read(min(sum(segments), 64))
+            if packet[:7] == b"\x01vorbis":
+                channels, sample_rate = struct.unpack("<BI", packet[11:16])
+                granule_rate, pre_skip = sample_rate, 0
+            elif packet[:8] == b"OpusHead":
+                channels, pre_skip, sample_rate = struct.unpack("<BHI", packet[9:16])
+                granule_rate = 48000  # Opus granule positions always count 48 kHz samples
+            else:
+                return super().probe(path)
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(0, size - 65536))
+            tail = f.read()
+        last_page = tail.rfind(b"OggS")
+        if last_page < 0 or last_page + 14 > len(tail):
+            raise ValueError("no final Ogg page")
+        granule = struct.unpack("<q", tail[last_page + 6:last_page + 14])[0]
+        return AudioInfo(max(0, granule - pre_skip) / granule_rate, sample_rate or granule_rate, channels)
+
+
+class Mp3Decoder(Decoder):
+    """MPEG audio files; probed from the first frame header and its Xing/Info or VBRI tag.
+
+    Files without a tag are assumed to be constant bitrate, and their
+    duration is estimated from the file size.
+    """
+
+    extensions = (".mp3", ".mp2")
+
+    BITRATES = {
+        (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+        (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    }
+    SAMPLE_RATES = (44100, 48000, 32000)
+
+    def probe(self, path: str) -> AudioInfo:
+        with open(path, "rb") as f:
+            start = _skip_id3v2(f)
+            head = f.read(65536)
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(0, size - 128))
+            has_id3v1 = f.read(3) == b"TAG"
+        for i in range(len(head) - 4):
+            if head[i] != 0xFF or head[i + 1] & 0xE0 != 0xE0:
+                continue
+            header = int.from_bytes(head[i:i + 4], "big")
+            version_bits = (header >> 19) & 3  # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+            layer = 4 - ((header >> 17) & 3)
+            bitrate_index = (header >> 12) & 0xF
+            rate_index = (header >> 10) & 3
+            if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+                continue
+            break
+        else:
+            raise ValueError("no MPEG frame header")
+        mpeg1 = version_bits == 3
+        sample_rate = self.SAMPLE_RATES[rate_index] >> (0 if mpeg1 else 1 if version_bits == 2 else 2)
+        channels = 1 if (header >> 6) & 3 == 3 else 2
+        samples_per_frame = 384 if layer == 1 else 1152 if layer == 2 or mpeg1 else 576
+
+        side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+        xing = head[i + 4 + side_info:i + 4 + side_info + 12]
+        frames = None
+        padding = 0
+        if xing[:4] in (b"Xing", b"Info"):
+            flags = struct.unpack(">I", xing[4:8])[0]
+            if flags & 1:
+                frames = struct.unpack(">I", xing[8:12])[0]
+            # The LAME extension after the Xing fields records the encoder delay and padding
+            lame = i + 4 + side_info + 8 + 4 * bin(flags & 0xB).count("1") + (100 if flags & 4 else 0)
+            if head[lame:lame + 4] in (b"LAME", b"Lavf", b"Lavc") and len(head) >= lame + 24:
+                delay_padding = int.from_bytes(head[lame + 21:lame + 24], "big")
+                padding = (delay_padding >> 12) + (delay_padding & 0xFFF)
+        elif head[i + 36:i + 40] == b"VBRI":
+            frames = struct.unpack(">I", head[i + 50:i + 54])[0]
+        if frames:
+            samples = frames * samples_per_frame - padding
+            return AudioInfo(samples / sample_rate, sample_rate, channels)
+        bitrate = self.BITRATES[(1 if mpeg1 else 2, layer)][bitrate_index] * 1000
+        audio_bytes = size - start - i - (128 if has_id3v1 else 0)
+        return AudioInfo(audio_bytes * 8 / bitrate, sample_rate, channels)
+
+
+_DEFAULT_DECODER = Decoder()
+_DECODERS: dict[str, Decoder] = {}
+
+
+def register_decoder(decoder: Decoder) -> None:
+    """Make a decoder responsible for its file extensions, replacing any earlier one."""
+    for extension in decoder.extensions:
+        _DECODERS[extension.lower()] = decoder
+
+
+for _decoder in (WavDecoder(), FlacDecoder(), OggDecoder(), Mp3Decoder()):
+    register_decoder(_decoder)
+
+
+def decoder_for(path: str) -> Decoder:
+    return _DECODERS.get(os.path.splitext(path)[1].lower(), _DEFAULT_DECODER)
+
+
+def is_audio_file(name: str) -> bool:
+    """Return True if the file name has a playable audio extension (in any letter case)."""
+    return os.path.splitext(name)[1].lower() in _DECODERS
+
+
+def probe(path: str) -> AudioInfo:
+    """Read duration, sample rate and channels from the file headers, without decoding.
+
+    Falls back to opening the file with libsndfile or audioread when the
+    headers cannot be parsed.
+    """
+    decoder = decoder_for(path)
+    try:
+        return decoder.probe(path)
+    except (ValueError, struct.error, IndexError):
+        return _DEFAULT_DECODER.probe(path)
+
+
+def get_duration(path: str) -> float:
+    """Return the duration of an audio file in seconds."""
+    return probe(path).duration
+
+
+TAG_FIELDS = ("title", "artist", "album", "genre")
+
+
+def read_tags(path: str) -> dict:
+    """Return the non-empty title, artist, album and genre tags of an audio file.
+
+    Tags are read by libsndfile (Vorbis comments, WAV INFO chunks and ID3
+    tags on builds with MP3 support); files it cannot open have no tags.
+    """
+    try:
+        with sf.SoundFile(path) as f:
+            return {field: value for field in TAG_FIELDS if (value := getattr(f, field, "").strip())}
+    except (sf.LibsndfileError, RuntimeError):
+        return {}
+
+
+def stream_audio(path: str, sample_rate: int, mono: bool = True, block_frames: int = 65536,
+                 decoder: Optional[Decoder] = None, start: float = 0.0) -> Iterator[np.ndarray]:
+    """Decode an audio file block by block from ``start`` seconds on, resampled to ``sample_rate``.
+
+    Yields float32 arrays, 1-D when ``mono`` is set and (frames, channels)
+    otherwise. Only one block is held in memory at a time.
+    """
+    decoder = decoder or decoder_for(path)
+    resampler = None
+    empty = None
+    blocks = decoder.blocks(path, block_frames, start)
+    while True:
+        # Only the decoding and resampling are timed, not the consumer's work between blocks
+        with instrumentation.span("decode.block"):
+            decoded = next(blocks, None)
+            if decoded is None:
+                break
+            block, native_rate = decoded
+            if mono:
+                # A matrix-vector product is an order of magnitude faster than mean(axis=1) over a few channels
+                block = block @ np.full(block.shape[1], 1 / block.shape[1], dtype=np.float32)
+            if native_rate != sample_rate:
+                if resampler is None:
+                    channels = 1 if mono else block.shape[1]
+                    resampler = soxr.ResampleStream(native_rate, sample_rate, channels, dtype="float32")
+                    empty = np.zeros(block.shape[:0] + (0,) + block.shape[1:], dtype=np.float32)
+                block = resampler.resample_chunk(block)
+        if len(block):
+            yield block
+    if resampler is not None:
+        tail = resampler.resample_chunk(empty, last=True)
+        if len(tail):
+            yield tail
@@ -0,0 +1,249 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Optional
+
+from decoders import get_duration, is_audio_file, read_tags
+
+
+def list_directory(path: str) -> tuple[list[str], dict]:
+    """List one directory, returning its subfolders and playable files.
+
+    Files are returned as ``{path: (name, size, mtime_ns)}``.
+    """
+    subfolders = []
+    files = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    subfolders.append(os.path.normpath(entry.path))
+                elif entry.is_file() and is_audio_file(entry.name):
+                    stat = entry.stat()
+                    files[os.path.normpath(entry.path)] = (entry.name, stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                continue
+    return subfolders, files
+
+
+def probe_durations(files: dict, duration_probe: Callable[[str], float]) -> dict:
+    """Probe the duration of each listed file, skipping files that cannot be read."""
+    durations = {}
+    for file_path in files:
+        try:
+            durations[file_path] = duration_probe(file_path)
+        except Exception:
+            continue
+    return durations
+
+
+def read_file_tags(files: dict, tag_reader: Callable[[str], dict]) -> dict:
+    """Read the tags of each listed file, skipping files that cannot be read."""
+    tags = {}
+    for file_path in files:
+        try:
+            tags[file_path] = tag_reader(file_path)
+        except Exception:
+            continue
+    return tags
+
+
+class FolderSummary:
+    """Result of visiting one directory during a scan."""
+
+    def __init__(self, path: str, mtime_ns: int = 0, subfolders: Optional[list[str]] = None,
+                 files: Optional[dict] = None, track_count: int = 0, duration: float = 0.0,
+                 listed: bool = True, error: Optional[str] = None, missing: bool = False) -> None:
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.subfolders = subfolders or []
+        self.files = files or {}
+        self.durations: dict[str, float] = {}
+        self.tags: dict[str, dict] = {}
+        self.track_count = track_count
+        self.duration = duration
+        self.listed = listed  # False when the directory was unchanged and taken from the catalog
+        self.error = error
+        self.missing = missing
+        self.total_tracks = track_count
+        self.total_duration = duration
+
+
+class ScanResult:
+    """Per-folder summaries and throughput statistics of a scan."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.summaries: dict[str, FolderSummary] = {}
+        self.timed_out: list[str] = []
+        self.cancelled = False
+        self.seconds = 0.0
+
+    @property
+    def files_scanned(self) -> int:
+        """Files in the directories that were actually listed, not taken unchanged from the catalog."""
+        return sum(summary.track_count for summary in self.summaries.values() if summary.listed)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files_scanned / self.seconds if self.seconds else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "dirs": len(self.summaries),
+            "dirs_listed": sum(1 for summary in self.summaries.values() if summary.listed),
+            "files": self.files_scanned,
+            "seconds": round(self.seconds, 3),
+            "files_per_sec": round(self.files_per_second, 1),
+            "timed_out": len(self.timed_out),
+        }
+
+    def aggregate(self) -> None:
+        """Roll track counts and durations up from subfolders into their parents."""
+        for path in sorted(self.summaries, key=lambda p: p.count(os.sep), reverse=True):
+            summary = self.summaries[path]
+            for subfolder in summary.subfolders:
+                child = self.summaries.get(subfolder)
+                if child is not None:
+                    summary.total_tracks += child.total_tracks
+                    summary.total_duration += child.total_duration
+
+
+class _DaemonPool:
+    """Minimal thread pool whose workers are daemon threads.
+
+    ThreadPoolExecutor joins its workers at interpreter exit, so a listing
+    hung on a dead share would keep the application from quitting.
+    """
+
+    def __init__(self, max_workers: int, name: str) -> None:
+        self._tasks: queue.SimpleQueue = queue.SimpleQueue()
+        self._workers = [threading.Thread(target=self._work, name=f"{name}_{i}", daemon=True)
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        future = Future()
+        self._tasks.put((future, fn, args))
+        return future
+
+    def _work(self) -> None:
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            future, fn, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def shutdown(self) -> None:
+        """Cancel the queued tasks and let the workers exit once their current task returns, without waiting."""
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                task[0].cancel()
+        for _ in self._workers:
+            self._tasks.put(None)
+
+
+class DirectoryScanner:
+    """Walks a directory tree concurrently on a thread pool.
+
+    On network mounts a directory listing is dominated by round trips, so
+    listing many directories at once hides most of the latency. A directory
+    whose listing does not answer within ``timeout`` seconds is reported as
+    timed out and not descended into; its worker thread is abandoned rather
+    than blocking the scan, and being a daemon thread it does not hold up
+    interpreter exit either. Probing the durations of a listed directory's
+    files does not count towards the timeout.
+    """
+
+    def __init__(self, max_workers: int = 16, timeout: float = 10.0,
+                 duration_probe: Optional[Callable[[str], float]] = get_duration,
+                 tag_reader: Optional[Callable[[str], dict]] = read_tags) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.duration_probe = duration_probe
+        self.tag_reader = tag_reader
+
+    def scan(self, root: str,
+             cached: Optional[Callable[[str, int], Optional[FolderSummary]]] = None,
+             cancelled: Optional[Callable[[], bool]] = None) -> ScanResult:
+        """Scan ``root`` and everything below it.
+
+        ``cached(path, mtime_ns)`` may return a summary for a directory that
+        is known to be unchanged, in which case it is not listed again. Once
+        ``cancelled()`` returns True the scan stops and returns the
+        directories visited so far, with ``cancelled`` set on the result.
+        """
+        root = os.path.normpath(root)
+        result = ScanResult(root)
+        started: dict[str, float] = {}
+        start_time = time.perf_counter()
+        pool = _DaemonPool(self.max_workers, "scan")
+        try:
+            futures = {pool.submit(self._visit, root, cached, started): root}
+            while futures:
+                if cancelled is not None and cancelled():
+                    result.cancelled = True
+                    break
+                done, _ = wait(futures, timeout=min(self.timeout, 0.5), return_when=FIRST_COMPLETED)
+                for future in done:
+                    summary = future.result()
+                    del futures[future]
+                    result.summaries[summary.path] = summary
+                    for subfolder in summary.subfolders:
+                        futures[pool.submit(self._visit, subfolder, cached, started)] = subfolder
+                now = time.monotonic()
+                for future, path in list(futures.items()):
+                    # Read once: the worker pops the entry when its listing returns
+                    t0 = started.get(path)
+                    if t0 is not None and now - t0 > self.timeout:
+                        del futures[future]
+                        result.timed_out.append(path)
+                        logging.warning(f"Scan timed out: {path}")
+        finally:
+            pool.shutdown()
+        result.seconds = time.perf_counter() - start_time
+        result.aggregate()
+        return result
+
+    def _visit(self, path: str, cached, started: dict) -> FolderSummary:
+        # Only the stat and the listing are timed: they are the round trips that hang on a dead share
+        started[path] = time.monotonic()
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError as e:
+            return FolderSummary(path, error=str(e), missing=True)
+        finally:
+            started.pop(path, None)
+        if cached is not None:
+            summary = cached(path, mtime_ns)
+            if summary is not None:
+                return summary
+        started[path] = time.monotonic()
+        try:
+            subfolders, files = list_directory(path)
+        except OSError as e:
+            logging.warning(f"Permission denied: {path}" if isinstance(e, PermissionError) else f"Scan failed: {path}: {e}")
+            return FolderSummary(path, mtime_ns, error=str(e))
+        finally:
+            started.pop(path, None)
+        summary = FolderSummary(path, mtime_ns, subfolders, files, len(files))
+        if self.duration_probe is not None:
+            summary.durations = probe_durations(files, self.duration_probe)
+            summary.duration = summary.total_duration = sum(summary.durations.values())
+        if self.tag_reader is not None:
+            summary.tags = read_file_tags(files, self.tag_reader)
+        return summary
@@ -1,12 +1,20 @@
 import logging
+from typing import Optional
+
+from logging_utils import LOG_FORMAT
+
 
 class ErrorHandler:
-    def __init__(self, log_file: str = "error.log") -> None:
+    def __init__(self, log_file: Optional[str] = "error.log") -> None:
+        # Errors go through the application's logging setup; log_file additionally collects them on their own
         self.log_file = log_file
-        logging.basicConfig(filename=self.log_file, level=logging.ERROR,
-                            format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger("errors")
+        if log_file and not self.logger.handlers:
+            handler = logging.FileHandler(log_file)
+            handler.setLevel(logging.ERROR)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            self.logger.addHandler(handler)
 
     def log_error(self, error_message: str) -> None:
         """Log an error message."""
-        logging.error(error_message)
-        print(f"Error: {error_message}")
+        self.logger.error(error_message)
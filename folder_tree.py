@@ -1,38 +1,56 @@
+import logging
 import os
+from typing import Optional
+from library_catalog import LibraryCatalog
+
 class FolderTree:
-    def __init__(self, root_dir):
-        self.root_dir = root_dir
+    """Lazily populated folder tree.
+
+    Only the root node exists at first; a node's subfolders are read when
+    ``load_children`` is called for it, typically when the user expands it.
+    Nodes whose children have not been loaded yet have ``folders`` set to None.
+    """
+
+    def __init__(self, root_dir, catalog: Optional[LibraryCatalog] = None):
+        self.root_dir = os.path.normpath(root_dir)
+        self.catalog = catalog
         self.tree = self.build_tree_structure()
 
-        # Debugging output to verify the structure
-        # print("FolderTree initialized with tree structure:", self.tree)
+    def list_subfolders(self, path):
+        """List the direct subfolders of a path, from the catalog when one is available."""
+        if self.catalog is not None:
+            self.catalog.rescan(path, recursive=False)
+            return self.catalog.subfolders(path)
+        subfolders = []
+        try:
+            # List all directories in the current path
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subfolders.append(entry.path)
+        except PermissionError:
+            # Handle the case where the directory can't be accessed
+            logging.warning(f"Permission denied: {path}")
+        return sorted(subfolders)
 
     def build_tree_structure(self):
-        """Recursively builds a tree structure starting from the root folder."""
-        def recurse_directory(path):
-            subfolders = []
-            try:
-                # List all directories in the current path
-                with os.scandir(path) as entries:
-                    for entry in entries:
-                        if entry.is_dir():
-                            subfolders.append({
-                                "path": entry.path,
-                                "is_leaf": False,
-                                "folders": recurse_directory(entry.path)  # Recurse into subdirectory
-                            })
-            except PermissionError:
-                # Handle the case where the directory can't be accessed
-                print(f"Permission denied: {path}")
-            return subfolders
-
-        # Build the root folder structure
+        """Builds the root level of the tree; subfolders are loaded on demand."""
         return {
             "folders": [
                 {
                     "path": self.root_dir,
                     "is_leaf": False,
-                    "folders": recurse_directory(self.root_dir)
+                    "folders": None
                 }
             ]
         }
+
+    def load_children(self, node):
+        """Read the subfolders of a node if they have not been loaded yet."""
+        if node["folders"] is None:
+            node["folders"] = [
+                {"path": subfolder, "is_leaf": False, "folders": None}
+                for subfolder in self.list_subfolders(node["path"])
+            ]
+            node["is_leaf"] = not node["folders"]
+        return node["folders"]
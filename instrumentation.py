@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Samples kept per histogram for percentiles; count, total, min and max cover every sample
+HISTOGRAM_SAMPLES = 4096
+MAX_TRACE_EVENTS = 1_000_000
+
+_enabled = False
+_tracing = False
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_histograms: dict[str, "Histogram"] = {}
+_events: list[dict] = []
+_dropped_events = 0
+_origin = time.perf_counter()
+
+
+class Histogram:
+    """Distribution of one measured quantity."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.samples: deque = deque(maxlen=HISTOGRAM_SAMPLES)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else 0.0
+
+    def summary(self) -> dict:
+        return {"count": self.count, "mean": round(self.total / self.count, 3) if self.count else 0.0,
+                "min": round(self.min, 3), "p50": round(self.percentile(50), 3),
+                "p95": round(self.percentile(95), 3), "max": round(self.max, 3)}
+
+
+class _Span:
+    """Times a block of code into the histogram of its name, in milliseconds."""
+
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict) -> None:
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        end = time.perf_counter()
+        observe(self.name, (end - self.start) * 1000)
+        if _tracing:
+            _trace({"name": self.name, "ph": "X", "ts": (self.start - _origin) * 1e6,
+                    "dur": (end - self.start) * 1e6, "args": self.args})
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable(trace: bool = False) -> None:
+    """Start recording metrics, and trace events too if ``trace`` is set."""
+    global _enabled, _tracing
+    _enabled, _tracing = True, trace
+
+
+def disable() -> None:
+    global _enabled, _tracing
+    _enabled = _tracing = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Forget all recorded metrics and trace events."""
+    global _dropped_events
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _events.clear()
+        _dropped_events = 0
+
+
+def span(name: str, **args):
+    """Context manager timing its block as ``name``; a shared no-op while disabled."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def count(name: str, value: float = 1) -> None:
+    """Add ``value`` to a counter."""
+    if not _enabled:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + value
+    if _tracing:
+        _trace({"name": name, "ph": "C", "ts": (time.perf_counter() - _origin) * 1e6, "args": {name: total}})
+
+
+def observe(name: str, value: float) -> None:
+    """Add a sample to a histogram."""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(value)
+
+
+def _trace(event: dict) -> None:
+    global _dropped_events
+    event["pid"] = os.getpid()
+    event["tid"] = threading.get_ident()
+    with _lock:
+        if len(_events) < MAX_TRACE_EVENTS:
+            _events.append(event)
+        else:
+            _dropped_events += 1
+
+
+def snapshot() -> dict:
+    """Current counters and histogram summaries."""
+    with _lock:
+        return {"counters": dict(_counters),
+                "histograms": {name: histogram.summary() for name, histogram in _histograms.items()}}
+
+
+def log_summary() -> None:
+    """Write every counter and histogram to the log."""
+    metrics = snapshot()
+    for name, value in sorted(metrics["counters"].items()):
+        logger.info(f"{name}: {value:g}")
+    for name, summary in sorted(metrics["histograms"].items()):
+        logger.info(f"{name}: {summary}")
+
+
+def export_chrome_trace(path: str) -> None:
+    """Write the recorded events as Chrome trace JSON, viewable in chrome://tracing or Perfetto."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    with _lock:
+        events = list(_events)
+        dropped = _dropped_events
+    metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in names.items()]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                   "otherData": {"dropped_events": dropped, **snapshot()}}, f)
+    logger.info(f"Wrote {len(events)} trace events to {path}")
@@ -0,0 +1,362 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Callable, Optional
+
+import instrumentation
+from decoders import get_duration, read_tags
+from directory_scanner import DirectoryScanner, FolderSummary, ScanResult, list_directory, probe_durations, read_file_tags
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories(parent);
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration REAL,
+    tags TEXT,  -- JSON object of the file's tags; NULL until they have been read
+    analysis_status TEXT NOT NULL DEFAULT 'pending',
+    loudness_lufs REAL,
+    true_peak REAL,
+    gain_db REAL,  -- Loudness-normalising playback gain; NULL until measured
+    loudness_error TEXT  -- Why measuring failed; not retried until the file changes
+);
+CREATE INDEX IF NOT EXISTS tracks_directory ON tracks(directory);
+CREATE INDEX IF NOT EXISTS tracks_untagged ON tracks(directory) WHERE tags IS NULL;
+"""
+
+# Columns added after the first release, with their types, for catalogs created before them
+ADDED_COLUMNS = {"loudness_lufs": "REAL", "true_peak": "REAL", "gain_db": "REAL", "loudness_error": "TEXT"}
+
+LOUDNESS_RESET = "loudness_lufs = NULL, true_peak = NULL, gain_db = NULL, loudness_error = NULL"
+
+
+class LibraryCatalog:
+    """Persistent SQLite index of music folders and tracks.
+
+    A rescan only lists directories whose mtime changed since the previous
+    scan; unchanged directories are descended into using their known
+    subfolders, which costs one ``stat`` per directory instead of a full
+    listing. Folder and playlist lookups are indexed queries.
+
+    ``on_tracks_changed`` is called after each committed change with the
+    added or changed tracks as (path, tags) pairs and the removed paths,
+    from whichever thread made the change.
+    """
+
+    def __init__(self, db_path: str = os.path.join("cache", "library.db")) -> None:
+        self.db_path = db_path
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self.on_tracks_changed: Optional[Callable[[list[tuple[str, dict]], list[str]], None]] = None
+
+    def _migrate(self) -> None:
+        """Add the columns a catalog created by an older version lacks."""
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(tracks)")}
+        with self._conn:
+            for column, kind in ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE tracks ADD COLUMN {column} {kind}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _subtree_bounds(path: str) -> tuple[str, str]:
+        """Key range that contains every path below ``path``."""
+        prefix = path.rstrip(os.sep) + os.sep
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    def rescan(self, root: str, recursive: bool = True,
+               scanner: Optional[DirectoryScanner] = None) -> dict:
+        """Bring the index for ``root`` up to date and return scan statistics.
+
+        With ``recursive=False`` only ``root`` itself is checked; its
+        subfolders are recorded but not listed until they are rescanned.
+        """
+        if recursive:
+            return self.scan(root, scanner).catalog_stats
+        root = os.path.normpath(root)
+        stats = self._new_stats()
+        try:
+            mtime_ns = os.stat(root).st_mtime_ns
+        except OSError:
+            with self._lock, self._conn:
+                self._remove_directory(root, stats)
+            self._notify(stats)
+            return stats
+        if self._cached_summary(root, mtime_ns) is not None:
+            stats["dirs_skipped"] += 1
+            self._notify(stats)
+            return stats
+        try:
+            subfolders, files = list_directory(root)
+        except PermissionError:
+            logging.warning(f"Permission denied: {root}")
+            self._notify(stats)
+            return stats
+        summary = FolderSummary(root, mtime_ns, subfolders, files, len(files))
+        # Header-only probes, so this stays cheap even for large folders
+        summary.durations = probe_durations(files, get_duration)
+        summary.tags = read_file_tags(files, read_tags)
+        with self._lock, self._conn:
+            self._store_summary(summary, stats)
+        self._notify(stats)
+        return stats
+
+    def scan(self, root: str, scanner: Optional[DirectoryScanner] = None,
+             cancelled: Optional[Callable[[], bool]] = None) -> ScanResult:
+        """Rescan ``root`` recursively with a parallel scanner and store what changed.
+
+        Returns the scan result, whose per-folder summaries carry track
+        counts and durations for the whole subtree; the catalog changes are
+        in its ``catalog_stats`` attribute. A scan stopped by ``cancelled``
+        still stores the directories it listed.
+        """
+        scanner = scanner or DirectoryScanner()
+        result = scanner.scan(root, cached=self._cached_summary, cancelled=cancelled)
+        stats = self._new_stats()
+        with self._lock, self._conn:
+            for summary in result.summaries.values():
+                if summary.missing:
+                    self._remove_directory(summary.path, stats)
+                elif not summary.listed:
+                    stats["dirs_skipped"] += 1
+                elif summary.error is None:
+                    self._store_summary(summary, stats)
+        self._notify(stats)
+        instrumentation.count("scan.dirs_listed", stats["dirs_listed"])
+        instrumentation.observe("scan.files_per_sec", result.files_per_second)
+        stats.update(result.stats())
+        result.catalog_stats = stats
+        return result
+
+    @staticmethod
+    def _new_stats() -> dict:
+        # The underscored lists collect the changed and removed tracks for on_tracks_changed
+        return {"dirs_listed": 0, "dirs_skipped": 0, "tracks_added": 0,
+                "tracks_updated": 0, "tracks_removed": 0, "_changed": [], "_removed": []}
+
+    def _notify(self, stats: dict) -> None:
+        changed, removed = stats.pop("_changed"), stats.pop("_removed")
+        if self.on_tracks_changed is not None and (changed or removed):
+            self.on_tracks_changed(changed, removed)
+
+    def _cached_summary(self, path: str, mtime_ns: int) -> Optional[FolderSummary]:
+        """Summary of a directory from the index, if it is unchanged since it was last listed."""
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns FROM directories WHERE path = ?", (path,)).fetchone()
+            if row is None or row[0] != mtime_ns:
+                return None
+            # Tracks catalogued before tags were read are listed once more to read them
+            if self._conn.execute("SELECT 1 FROM tracks WHERE directory = ? AND tags IS NULL LIMIT 1",
+                                  (path,)).fetchone() is not None:
+                return None
+            subfolders = [subfolder for (subfolder,) in self._conn.execute(
+                "SELECT path FROM directories WHERE parent = ? ORDER BY path", (path,))]
+            count, duration = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(duration), 0) FROM tracks WHERE directory = ?",
+                (path,)).fetchone()
+        return FolderSummary(path, mtime_ns, subfolders, track_count=count, duration=duration, listed=False)
+
+    def _store_summary(self, summary: FolderSummary, stats: dict) -> None:
+        """Sync the tracks and subfolders of a freshly listed directory."""
+        path = summary.path
+        stats["dirs_listed"] += 1
+        known = {track_path: (size, mtime_ns, tagged) for track_path, size, mtime_ns, tagged in self._conn.execute(
+            "SELECT path, size, mtime_ns, tags IS NOT NULL FROM tracks WHERE directory = ?", (path,))}
+        for track_path, (name, size, mtime_ns) in summary.files.items():
+            previous = known.pop(track_path, None)
+            duration = summary.durations.get(track_path)
+            tags = summary.tags.get(track_path)
+            tags_json = json.dumps(tags) if tags is not None else None
+            if previous is None:
+                stats["tracks_added"] += 1
+                stats["_changed"].append((track_path, tags or {}))
+                self._conn.execute(
+                    "INSERT INTO tracks (path, directory, name, size, mtime_ns, duration, tags) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (track_path, path, name, size, mtime_ns, duration, tags_json))
+            elif previous[:2] != (size, mtime_ns):
+                stats["tracks_updated"] += 1
+                stats["_changed"].append((track_path, tags or {}))
+                self._conn.execute(
+                    f"UPDATE tracks SET size = ?, mtime_ns = ?, duration = ?, tags = ?, "
+                    f"analysis_status = 'pending', {LOUDNESS_RESET} WHERE path = ?",
+                    (size, mtime_ns, duration, tags_json, track_path))
+            elif not previous[2] and tags is not None:
+                stats["_changed"].append((track_path, tags))
+                self._conn.execute("UPDATE tracks SET tags = ? WHERE path = ?", (tags_json, track_path))
+        for track_path in known:
+            stats["tracks_removed"] += 1
+            stats["_removed"].append(track_path)
+            self._conn.execute("DELETE FROM tracks WHERE path = ?", (track_path,))
+
+        # New subfolders are recorded with mtime 0 so their first rescan always lists them
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO directories (path, parent, mtime_ns) VALUES (?, ?, 0)",
+            [(subfolder, path) for subfolder in summary.subfolders])
+        current = set(summary.subfolders)
+        for (subfolder,) in self._conn.execute(
+                "SELECT path FROM directories WHERE parent = ?", (path,)).fetchall():
+            if subfolder not in current:
+                self._remove_directory(subfolder, stats)
+
+        parent = os.path.dirname(path)
+        self._conn.execute(
+            "INSERT INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET parent = excluded.parent, mtime_ns = excluded.mtime_ns",
+            (path, parent if parent != path else None, summary.mtime_ns))
+
+    def _remove_directory(self, path: str, stats: dict) -> None:
+        """Forget a directory and everything below it."""
+        low, high = self._subtree_bounds(path)
+        removed = [track_path for (track_path,) in self._conn.execute(
+            "SELECT path FROM tracks WHERE directory = ? OR (directory >= ? AND directory < ?)",
+            (path, low, high))]
+        self._conn.execute("DELETE FROM tracks WHERE directory = ? OR (directory >= ? AND directory < ?)",
+                           (path, low, high))
+        stats["tracks_removed"] += len(removed)
+        stats["_removed"].extend(removed)
+        self._conn.execute("DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)",
+                           (path, low, high))
+
+    def is_indexed(self, folder: str) -> bool:
+        """Return True if the folder has been scanned before."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM directories WHERE path = ? AND mtime_ns != 0",
+                                      (os.path.normpath(folder),)).fetchone() is not None
+
+    def subfolders(self, folder: str) -> list[str]:
+        """Return the direct subfolders of an indexed folder, sorted by path."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM directories WHERE parent = ? ORDER BY path",
+                                      (os.path.normpath(folder),)).fetchall()
+        return [path for (path,) in rows]
+
+    def tracks_in(self, folder: str, recursive: bool = False) -> list[str]:
+        """Return the tracks stored directly in (or, if ``recursive``, below) a folder."""
+        folder = os.path.normpath(folder)
+        with self._lock:
+            if recursive:
+                low, high = self._subtree_bounds(folder)
+                rows = self._conn.execute(
+                    "SELECT path FROM tracks WHERE directory = ? OR (directory >= ? AND directory < ?) "
+                    "ORDER BY path", (folder, low, high)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT path FROM tracks WHERE directory = ? ORDER BY path",
+                                          (folder,)).fetchall()
+        return [path for (path,) in rows]
+
+    def track_durations(self, folder: str, recursive: bool = False) -> dict[str, float]:
+        """Return the known durations of the tracks in (or below) a folder."""
+        folder = os.path.normpath(folder)
+        with self._lock:
+            if recursive:
+                low, high = self._subtree_bounds(folder)
+                rows = self._conn.execute(
+                    "SELECT path, duration FROM tracks WHERE duration IS NOT NULL AND "
+                    "(directory = ? OR (directory >= ? AND directory < ?))", (folder, low, high)).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT path, duration FROM tracks WHERE duration IS NOT NULL AND directory = ?",
+                    (folder,)).fetchall()
+        return dict(rows)
+
+    def durations_of(self, paths: list[str]) -> dict[str, float]:
+        """Return the known durations of the given tracks, wherever they are."""
+        durations = {}
+        with self._lock:
+            # Chunked to stay below SQLite's limit on query parameters
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                durations.update(self._conn.execute(
+                    f"SELECT path, duration FROM tracks WHERE duration IS NOT NULL AND "
+                    f"path IN ({', '.join('?' * len(chunk))})", chunk).fetchall())
+        return durations
+
+    def tracks_with_tags(self, folder: str) -> list[tuple[str, dict]]:
+        """Return (path, tags) for every track below a folder, for building a search index."""
+        folder = os.path.normpath(folder)
+        low, high = self._subtree_bounds(folder)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, tags FROM tracks WHERE directory = ? OR (directory >= ? AND directory < ?)",
+                (folder, low, high)).fetchall()
+        return [(path, json.loads(tags) if tags else {}) for path, tags in rows]
+
+    def track(self, path: str) -> Optional[dict]:
+        """Return the stored metadata of a track."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, directory, name, size, mtime_ns, duration, tags, analysis_status "
+                "FROM tracks WHERE path = ?", (os.path.normpath(path),)).fetchone()
+        if row is None:
+            return None
+        keys = ("path", "directory", "name", "size", "mtime_ns", "duration", "tags", "analysis_status")
+        info = dict(zip(keys, row))
+        info["tags"] = json.loads(info["tags"]) if info["tags"] else {}
+        return info
+
+    def set_duration(self, path: str, duration: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE tracks SET duration = ? WHERE path = ?",
+                               (duration, os.path.normpath(path)))
+
+    def set_tags(self, path: str, tags: dict) -> None:
+        path = os.path.normpath(path)
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE tracks SET tags = ? WHERE path = ?", (json.dumps(tags), path))
+        if self.on_tracks_changed is not None:
+            self.on_tracks_changed([(path, tags)], [])
+
+    def loudness_pending(self, folder: str) -> list[tuple[str, int]]:
+        """Return (path, mtime_ns) of the tracks below a folder whose loudness has not been measured or failed."""
+        folder = os.path.normpath(folder)
+        low, high = self._subtree_bounds(folder)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, mtime_ns FROM tracks WHERE gain_db IS NULL AND loudness_error IS NULL AND "
+                "(directory = ? OR (directory >= ? AND directory < ?))", (folder, low, high)).fetchall()
+
+    def set_loudness(self, results: list[tuple[str, int, Optional[dict], Optional[str]]]) -> None:
+        """Store a batch of (path, mtime_ns, measurement, error) loudness results in one transaction.
+
+        A result only applies while the track still has the mtime it was
+        measured at; a failure is kept until the file changes.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE tracks SET loudness_lufs = ?, true_peak = ?, gain_db = ?, loudness_error = ? "
+                "WHERE path = ? AND mtime_ns = ?",
+                [(measured["integrated"], measured["true_peak"], measured["gain_db"], None, path, mtime_ns)
+                 if measured is not None else (None, None, None, error or "failed", path, mtime_ns)
+                 for path, mtime_ns, measured, error in results])
+
+    def gain_of(self, path: str) -> Optional[float]:
+        """Loudness-normalising playback gain of a track in dB, or None if it has not been measured."""
+        with self._lock:
+            row = self._conn.execute("SELECT gain_db FROM tracks WHERE path = ?", (os.path.normpath(path),)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_analysis_status(self, path: str, status: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE tracks SET analysis_status = ? WHERE path = ?",
+                               (status, os.path.normpath(path)))
@@ -1,18 +1,140 @@
+import atexit
 import logging
 import os
+import queue
+import threading
 import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+_listener: Optional["BatchingQueueListener"] = None
+_queue_handler: Optional[QueueHandler] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site for records below WARNING.
+
+    Each logging call site may emit ``burst`` records at once and
+    ``per_second`` records per second after that; the rest are dropped,
+    and the next record that passes reports how many were suppressed.
+    Warnings and errors always pass.
+    """
+
+    def __init__(self, per_second: float = 20.0, burst: int = 50) -> None:
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst
+        self._buckets: dict[tuple[str, int], list] = {}  # Call site -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class _BatchFlushMixin:
+    """Leaves flushing to the listener, which flushes once per batch instead of once per record."""
+
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        super().flush()
+
+
+class BatchStreamHandler(_BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchFileHandler(_BatchFlushMixin, logging.FileHandler):
+    pass
+
+
+class BatchingQueueListener(QueueListener):
+    """Writes queued records on a background thread, draining up to ``batch_size`` records per flush."""
+
+    def __init__(self, log_queue, *handlers, batch_size: int = 256) -> None:
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def _monitor(self) -> None:
+        while True:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+            for handler in self.handlers:
+                handler.flush_batch()
+            if stop:
+                return
+
+
+def setup_logger(debug: bool) -> logging.Logger:
+    """Configure the root logger once per process and return it.
+
+    Records are put on a queue by the calling thread (after rate limiting
+    of chatty call sites) and written to a timestamped file in log/ and
+    the console by a background thread. Later calls only adjust the level.
+    """
+    global _listener, _queue_handler
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    if _listener is not None:
+        return logger
 
-def setup_logger(debug: bool):
     log_folder = "log"
     if not os.path.exists(log_folder):
         os.makedirs(log_folder)
-
     timestamp = time.strftime("%Y%m%d-%H%M%S")
-    log_filename = os.path.join(log_folder, f"debug-{timestamp}.log")
+    log_filename = os.path.join(log_folder, f"dm_tools_{timestamp}.log")
 
-    logging.basicConfig(filename=log_filename,
-                        level=logging.DEBUG if debug else logging.INFO,
-                        format="%(asctime)s - %(levelname)s - %(message)s")
-    logger = logging.getLogger()
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [BatchFileHandler(log_filename, mode="w", encoding="utf-8"), BatchStreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = QueueHandler(log_queue)
+    _queue_handler.addFilter(RateLimitFilter())
+    logger.addHandler(_queue_handler)
+    _listener = BatchingQueueListener(log_queue, *handlers)
+    _listener.start()
+    atexit.register(stop_logging)
     logger.info("Logging started")
+    return logger
+
+
+def stop_logging() -> None:
+    """Write out every queued record and stop the background writer."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = _queue_handler = None
@@ -0,0 +1,174 @@
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Optional
+
+import numpy as np
+import soxr
+
+from decoders import stream_audio
+from library_catalog import LibraryCatalog
+
+TARGET_LUFS = -18.0
+TRUE_PEAK_CEILING = -1.0  # dBTP the normalised track may reach
+ANALYSIS_RATE = 48000
+OVERSAMPLE = 4
+STORE_BATCH = 64  # Results written to the catalog per transaction
+STORE_SECONDS = 5.0  # Longest a finished result waits before it is written
+
+
+def k_weighting(sample_rate: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """The two BS.1770 K-weighting biquads (high shelf, then high pass) for a sample rate."""
+    # Analogue prototype parameters; at 48 kHz they reproduce the coefficients tabled in BS.1770
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = (np.array([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]),
+             np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]))
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    high_pass = (np.array([1.0, -2.0, 1.0]), np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]))
+    return [shelf, high_pass]
+
+
+class LoudnessMeter:
+    """Streaming BS.1770 integrated loudness and true-peak meter.
+
+    Blocks of any length are K-weighted with the filter state carried
+    over, and reduced to the mean square of every 100 ms step; the gated
+    400 ms measurement blocks are assembled from those steps at the end.
+    True peak is the maximum of the signal oversampled 4x with a streaming
+    resampler.
+    """
+
+    STEP_SECONDS = 0.1
+
+    def __init__(self, sample_rate: int, channels: int) -> None:
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.weights = np.ones(channels)
+        if channels == 6:
+            self.weights = np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])  # L R C LFE Ls Rs
+        self._filters = k_weighting(sample_rate)
+        self._states = [np.zeros((2, channels)) for _ in self._filters]
+        self._step = int(round(self.STEP_SECONDS * sample_rate))
+        self._carry = np.empty((0, channels))
+        self._steps: list[np.ndarray] = []
+        self._oversampler = soxr.ResampleStream(sample_rate, sample_rate * OVERSAMPLE, channels, dtype="float32")
+        self._peak = 0.0
+
+    def feed(self, block: np.ndarray) -> None:
+        """Add a (frames, channels) float block."""
+        from scipy.signal import lfilter  # Deferred: scipy.signal is slow to import and only analysis needs it
+        weighted = block.astype(np.float64)
+        for i, (b, a) in enumerate(self._filters):
+            weighted, self._states[i] = lfilter(b, a, weighted, axis=0, zi=self._states[i])
+        weighted = np.concatenate([self._carry, weighted])
+        whole = len(weighted) // self._step * self._step
+        if whole:
+            squares = np.square(weighted[:whole]).reshape(-1, self._step, self.channels).mean(axis=1)
+            self._steps.append(squares @ self.weights)
+        self._carry = weighted[whole:]
+        oversampled = self._oversampler.resample_chunk(np.ascontiguousarray(block, dtype=np.float32))
+        if len(oversampled):
+            self._peak = max(self._peak, float(np.abs(oversampled).max()))
+
+    def integrated(self) -> float:
+        """Gated integrated loudness in LUFS, or -inf for silence."""
+        steps = np.concatenate(self._steps) if self._steps else np.empty(0)
+        if len(steps) < 4:
+            return float("-inf")
+        # 400 ms blocks with 75 % overlap are four consecutive 100 ms steps
+        power = np.convolve(steps, np.full(4, 0.25), mode="valid")
+        with np.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * np.log10(power)
+        gated = power[loudness > -70.0]
+        if not len(gated):
+            return float("-inf")
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+        with np.errstate(divide="ignore"):
+            gated = gated[-0.691 + 10 * np.log10(gated) > relative_gate]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+    def true_peak(self) -> float:
+        """True peak in dBTP."""
+        tail = self._oversampler.resample_chunk(np.zeros((0, self.channels), dtype=np.float32), last=True)
+        if len(tail):
+            self._peak = max(self._peak, float(np.abs(tail).max()))
+        return 20 * math.log10(self._peak) if self._peak > 0 else float("-inf")
+
+
+def playback_gain(integrated: float, true_peak: float, target: float = TARGET_LUFS,
+                  ceiling: float = TRUE_PEAK_CEILING) -> float:
+    """Gain in dB that brings a track to ``target`` without pushing its true peak above ``ceiling``."""
+    if not math.isfinite(integrated):
+        return 0.0
+    gain = target - integrated
+    if math.isfinite(true_peak):
+        gain = min(gain, ceiling - true_peak)
+    return gain
+
+
+def analyse_loudness(path: str) -> dict:
+    """Measure a track and return its integrated loudness, true peak and playback gain."""
+    meter = None
+    for block in stream_audio(path, ANALYSIS_RATE, mono=False):
+        if meter is None:
+            meter = LoudnessMeter(ANALYSIS_RATE, block.shape[1])
+        meter.feed(block)
+    if meter is None:
+        raise ValueError("no audio decoded")
+    integrated, true_peak = meter.integrated(), meter.true_peak()
+    return {"integrated": integrated, "true_peak": true_peak, "gain_db": playback_gain(integrated, true_peak)}
+
+
+def _analyse_worker(path: str) -> tuple[str, Optional[dict], Optional[str]]:
+    try:
+        return path, analyse_loudness(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def scan_loudness(catalog: LibraryCatalog, root: str, max_workers: Optional[int] = None,
+                  cancelled: Optional[Callable[[], bool]] = None) -> dict:
+    """Measure every track below ``root`` that the catalog has no loudness for yet, on a process pool.
+
+    Results, failures included, are stored in the catalog in batches as
+    they arrive, so a failed track is not decoded again until it changes.
+    Returns statistics including the throughput in tracks per minute.
+    """
+    start = time.perf_counter()
+    pending = catalog.loudness_pending(root)
+    stats = {"tracks": len(pending), "analysed": 0, "failed": 0}
+    if pending:
+        workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        mtimes = dict(pending)
+        batch, stored_at = [], time.monotonic()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_analyse_worker, path) for path, _ in pending]
+            for future in as_completed(futures):
+                if cancelled is not None and cancelled():
+                    for other in futures:
+                        other.cancel()
+                    break
+                path, result, error = future.result()
+                if result is None:
+                    stats["failed"] += 1
+                    logging.warning(f"Loudness analysis failed for {path}: {error}")
+                else:
+                    stats["analysed"] += 1
+                batch.append((path, mtimes[path], result, error))
+                if len(batch) >= STORE_BATCH or time.monotonic() - stored_at >= STORE_SECONDS:
+                    catalog.set_loudness(batch)
+                    batch, stored_at = [], time.monotonic()
+        if batch:
+            catalog.set_loudness(batch)
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    stats["tracks_per_minute"] = round(stats["analysed"] / stats["seconds"] * 60, 1) if stats["seconds"] else 0.0
+    return stats
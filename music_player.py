@@ -1,126 +1,295 @@
 import os
 import pygame
-import threading
-import random
 import logging
-from datetime import datetime
-from typing import Optional
+from typing import Callable, Optional
+from ambience_mixer import AmbienceMixer
+from analysis_cache import AnalysisCache
+from decoders import get_duration, is_audio_file
+from library_catalog import LibraryCatalog
+from playback_engine import PlaybackEngine, TrackSource
+from playlist import Playlist
+from transition_manager import TransitionManager
+
+MUSIC_CHANNEL = 0
+AMBIENCE_CHANNEL = 1
+
 
 class MusicPlayer:
-    def __init__(self, debug: bool = False) -> None:
+    def __init__(self, debug: bool = False, catalog: Optional[LibraryCatalog] = None,
+                 analysis_cache: Optional[AnalysisCache] = None) -> None:
         pygame.mixer.pre_init()  # Suppress pygame message
         pygame.mixer.init()
-        self.playlist: list[str] = []
+        # Reserved so that nothing else playing sounds through pygame takes over these channels
+        pygame.mixer.set_reserved(max(MUSIC_CHANNEL, AMBIENCE_CHANNEL) + 1)
+        self.playlist = Playlist()
         self.current_song: Optional[str] = None
         self.current_index: int = 0
+        self.current_track_id: Optional[int] = None  # Stable across shuffles, unlike current_index
+        self.durations: dict[str, float] = {}  # Track durations in seconds, from header probes
+        self.volume = 1.0
         self.is_playing: bool = False
         self.is_paused: bool = False
-        self.playback_thread: Optional[threading.Thread] = None
-        self.stop_event = threading.Event()
-        self.next_song_event = threading.Event()
-        self.pause_event = threading.Event()
         self.debug = debug
-
-        if self.debug:
-            self.setup_logging()
-
-    def setup_logging(self) -> None:
-        if not os.path.exists('log'):
-            os.makedirs('log')
-
-        log_filename = datetime.now().strftime("log/%Y-%m-%d_%H-%M-%S.log")
-        logging.basicConfig(filename=log_filename, level=logging.DEBUG,
-                            format='%(asctime)s - %(levelname)s - %(message)s')
+        self.catalog = catalog
+        self.repeat_mode = "playlist"  # none, one or playlist; decides which track is pre-decoded next
+        self.on_track_change: Optional[Callable[[], None]] = None  # Called from the engine thread on auto-advance
+        self.engine = PlaybackEngine(next_track=self._peek_next, on_track_started=self._on_engine_track_started,
+                                     channel_id=MUSIC_CHANNEL)
+        self.transitions = TransitionManager()
+        self.analysis_cache = analysis_cache
+        self.normalise = catalog is not None
+        self.engine.gain_lookup = self._track_gain
+        self.ambience = AmbienceMixer(channel_id=AMBIENCE_CHANNEL)
 
     def log(self, message: str) -> None:
         if self.debug:
             logging.debug(message)
 
+    def folder_tracks(self, folder_path: str) -> tuple[list[str], dict[str, float]]:
+        """Return the music files in a folder and their known durations."""
+        if self.catalog is not None:
+            # Cheap when the folder is unchanged: a single stat against the stored mtime
+            self.catalog.rescan(folder_path, recursive=False)
+            return self.catalog.tracks_in(folder_path), self.catalog.track_durations(folder_path)
+        tracks = [os.path.normpath(os.path.join(folder_path, f)) for f in os.listdir(folder_path) if is_audio_file(f)]
+        durations = {}
+        for song in tracks:
+            try:
+                durations[song] = get_duration(song)
+            except Exception:
+                continue
+        return tracks, durations
+
     def load_playlist(self, folder_path: str) -> None:
         """Load all music files from the specified folder into the playlist."""
         try:
-            all_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith('.mp3')]
-            random.shuffle(all_files)
-
-            self.playlist = [os.path.normpath(song) for song in all_files]
+            all_files, durations = self.folder_tracks(folder_path)
+            self.durations.update(durations)
+            self.playlist.replace(os.path.normpath(song) for song in all_files)
+            self.playlist.shuffle()
+            self._follow_current()
             self.log(f"Loaded playlist with {len(self.playlist)} songs from {folder_path}")
         except Exception as e:
-            self.log(f"Error loading playlist: {e}")
-            print(f"Error loading playlist: {e}")
+            logging.error(f"Error loading playlist: {e}", exc_info=True)
+
+    def load_tracks(self, paths: list[str]) -> None:
+        """Replace the playlist with the given tracks, in the given order."""
+        self.playlist.replace(os.path.normpath(path) for path in paths)
+        if self.catalog is not None:
+            self.durations.update(self.catalog.durations_of(list(self.playlist)))
+        self._follow_current()
+        self.log(f"Loaded playlist with {len(self.playlist)} songs")
 
-    def play(self) -> None:
-        """Play the currently selected song."""
+    def play(self, fade: bool = False, source: Optional[TrackSource] = None) -> None:
+        """Play the currently selected song, crossfading into it if ``fade`` is set and a transition is chosen.
+
+        ``source`` is an already decoding start of the song from ``engine.prepare``.
+        """
         if self.current_song:
-            self.stop_event.clear()  # Reset stop event before playing
             try:
                 self.log(f"Trying to play {self.current_song}")
-                pygame.mixer.music.load(self.current_song)
-                pygame.mixer.music.play()
+                if fade and self.is_playing:
+                    self.engine.crossfade_to(self.current_song, key=self.current_track_id, source=source)
+                else:
+                    self.engine.play(self.current_song, key=self.current_track_id, source=source)
                 self.is_playing = True
                 self.is_paused = False
                 self.log(f"Playing {self.current_song}")
             except Exception as e:
-                self.log(f"Error playing {self.current_song}: {e}")
-                print(f"Error playing {self.current_song}: {e}")
+                logging.error(f"Error playing {self.current_song}: {e}", exc_info=True)
 
-    def play_from_index(self, index: int) -> None:
+    def play_from_index(self, index: int, fade: bool = False, source: Optional[TrackSource] = None) -> None:
         """Play the song from the selected index."""
         if 0 <= index < len(self.playlist):
-            self.current_index = index  # Update index
-            self.current_song = self.playlist[self.current_index]  # Set the current song
-            self.play()  # Play the selected song
+            self._set_current(index)
+            self.play(fade, source)  # Play the selected song
+
+    def start_scene(self, prepared) -> None:
+        """Switch to a scene from ``ScenePresets.take``: its settings, its tracks and its first track playing.
 
-    def play_next_song(self) -> None:
+        The current song fades into the scene if the scene has a transition.
+        """
+        scene = prepared.scene
+        self.set_volume(scene.volume)
+        self.set_transition(scene.transition)
+        self.playlist.replace(prepared.tracks)
+        if scene.shuffle:
+            self.playlist.shuffle()
+        self.durations = dict(prepared.durations)
+        # Track ids start over with the new playlist, so the old current track must not enter its history
+        self.current_song = self.current_track_id = None
+        self.engine.rekey(None)
+        # The playlist was just filled, so track id ``first`` is the scene's first track
+        self.play_from_index(self.playlist.position_of(prepared.first), fade=True, source=prepared.source)
+        prepared.source = None
+        self.log(f"Started scene {scene.name} with {len(self.playlist)} songs")
+
+    def _follow_current(self) -> None:
+        """Find the playing song in a replaced playlist, so that what plays next follows on from it."""
+        self.current_index, self.current_track_id = 0, None
+        if self.current_song is not None and (self.is_playing or self.is_paused):
+            for position, path in enumerate(self.playlist):
+                if path == self.current_song:
+                    self.current_index, self.current_track_id = position, self.playlist.id_at(position)
+                    break
+        # Track ids start over with a new playlist, so the engine's id for the playing song means nothing now
+        self.engine.rekey(self.current_track_id)
+
+    def _set_current(self, index: int, remember: bool = True) -> None:
+        """Make the song at ``index`` current, recording the previous one in the play history."""
+        track_id = self.playlist.id_at(index)
+        if remember and self.current_track_id is not None and self.current_track_id != track_id:
+            self.playlist.push_history(self.current_track_id)
+        self.current_index = index  # Update index
+        self.current_track_id = track_id
+        self.current_song = self.playlist[index]  # Set the current song
+
+    def play_next_song(self, fade: bool = False) -> None:
         """Play the next song from the playlist."""
-        self.current_index = (self.current_index + 1) % len(self.playlist)  # Loop back to start if at the end
-        self.current_song = self.playlist[self.current_index]  # Update the current song
-        self.play()  # Play the next song
+        if not self.playlist:
+            return
+        self._set_current(self.playlist.next_position(self.current_index))  # Loop back to start if at the end
+        self.play(fade)  # Play the next song
+
+    def _peek_next(self, track_id: Optional[int]) -> Optional[tuple[str, int]]:
+        """The track that follows ``track_id`` under the repeat mode, as ``(path, track id)``.
+
+        Called from the playback thread, so it holds the playlist's lock against edits from the UI.
+        """
+        with self.playlist.lock:
+            if track_id is None:
+                # The playing song is not in the playlist, which replaced its own: play that from the start
+                position = 0
+            else:
+                position = self.playlist.position_of(track_id)
+                if position < 0:
+                    position = self.current_index
+                if self.repeat_mode != "one":
+                    position = self.playlist.next_position(position, wrap=self.repeat_mode == "playlist")
+            if position is None or not 0 <= position < len(self.playlist):
+                return None
+            return self.playlist[position], self.playlist.id_at(position)
+
+    def _on_engine_track_started(self, track_id: Optional[int]) -> None:
+        """Follow the engine across a gapless handover, or note that playback ran out."""
+        if track_id is None:
+            self.is_playing = False
+            self.log("Reached the end of the playlist.")
+        else:
+            with self.playlist.lock:
+                position = self.playlist.position_of(track_id)
+                if position >= 0:
+                    self._set_current(position)
+            self.log(f"Playing {self.current_song} (gap {self.engine.last_gap_ms or 0:.1f} ms)")
+        if self.on_track_change is not None:
+            self.on_track_change()
+
+    @property
+    def transition(self):
+        return self.engine.transition
+
+    def set_transition(self, name: Optional[str]) -> None:
+        """Crossfade between tracks with the named transition, or cut between them with None."""
+        self.engine.transition = self.transitions.get_transition(name) if name else None
+        self.engine.invalidate_next()
+
+    def _track_gain(self, path: str) -> Optional[float]:
+        """Loudness-normalising gain for a track in dB, applied by the engine as it decodes."""
+        if not self.normalise or self.catalog is None:
+            return None
+        return self.catalog.gain_of(path)
+
+    def set_repeat_mode(self, mode: str) -> None:
+        self.repeat_mode = mode
+        self.engine.invalidate_next()
+
+    def play_previous_song(self, fade: bool = False) -> None:
+        """Play the previously played song, or the one before the current position without history."""
+        if not self.playlist:
+            return
+        index = self.playlist.pop_history()
+        if index is None:
+            index = (self.current_index - 1) % len(self.playlist)
+        self._set_current(index, remember=False)
+        self.play(fade)
+
+    def upcoming(self, count: int) -> list[str]:
+        """Return the next ``count`` songs after the current one, wrapping around the playlist."""
+        if not self.playlist:
+            return []
+        count = min(count, len(self.playlist) - 1)
+        return [self.playlist[(self.current_index + offset) % len(self.playlist)]
+                for offset in range(1, count + 1)]
 
     def stop_music(self) -> None:
         """Stop the music playback."""
         if self.is_playing or self.is_paused:
-            self.stop_event.set()  # Signal to stop the control thread
-            pygame.mixer.music.stop()
+            self.engine.stop()
             self.is_playing = False
             self.is_paused = False
             self.current_song = None  # Clear the current song after stopping
             self.log("Stopped music playback.")
-            if self.playback_thread and self.playback_thread.is_alive():
-                self.playback_thread.join()
+
+    def seek(self, seconds: float) -> None:
+        """Jump to a position in the current song."""
+        if (self.is_playing or self.is_paused) and self.engine.is_active:
+            self.engine.seek(seconds)
+            self.log(f"Seeked to {seconds:.1f} s in {self.current_song}")
+
+    def set_volume(self, volume: float) -> None:
+        """Set the music volume from 0 (silent) to 1 (full), leaving the ambience layers alone."""
+        self.volume = max(0.0, min(1.0, volume))
+        self.engine.set_volume(self.volume)
+
+    def duration_of(self, path: Optional[str]) -> float:
+        """Duration of a track in seconds from the playlist, the catalog or a header probe; 0 if unknown."""
+        if path is None:
+            return 0.0
+        if path in self.durations:
+            return self.durations[path]
+        track = self.catalog.track(path) if self.catalog is not None else None
+        if track is not None and track["duration"]:
+            return track["duration"]
+        try:
+            return get_duration(path)
+        except Exception:
+            return 0.0
 
     def pause_music(self) -> None:
         """Pause the currently playing song."""
-        if self.is_playing and pygame.mixer.music.get_busy():
-            self.pause_event.set()  # Set pause event to stop playback
-            pygame.mixer.music.pause()
+        if self.is_playing and self.engine.is_active:
+            self.engine.pause()
             self.is_paused = True
 
     def resume_music(self) -> None:
         """Resume the paused song."""
         if self.is_paused:
-            self.pause_event.clear()  # Clear pause event to resume playback
-            pygame.mixer.music.unpause()
+            self.engine.resume()
             self.is_paused = False
 
-    def skip_to_next_song(self) -> None:
-        """Signal to skip to the next song."""
-        if self.is_playing:
-            self.next_song_event.set()
-            self.log("Skipping to next song.")
-
     def shuffle_playlist(self) -> None:
         """Shuffle the playlist without interrupting the current song."""
-        current_song = self.current_song
-        random.shuffle(self.playlist)
-        if current_song:
-            # Ensure the current song stays at the current position
-            self.current_index = self.playlist.index(current_song)
+        self.playlist.shuffle()
+        self.engine.invalidate_next()
+        if self.current_track_id is not None:
+            # Follow the current song to its new position
+            self.current_index = self.playlist.position_of(self.current_track_id)
+
+    def unshuffle_playlist(self) -> None:
+        """Restore the unshuffled order without interrupting the current song."""
+        self.playlist.unshuffle()
+        self.engine.invalidate_next()
+        if self.current_track_id is not None:
+            self.current_index = self.playlist.position_of(self.current_track_id)
 
     def clear_playlist(self) -> None:
-        """Clear the current playlist and reset the state."""
+        """Clear the current playlist; the current song keeps playing."""
         self.log("Clearing playlist.")
-        self.playlist = []
-        self.current_song = None
-        self.current_index = 0
-        self.is_playing = False
-        self.is_paused = False
+        self.playlist.clear()
+        self.durations.clear()
+        self._follow_current()
+
+    def shutdown(self) -> None:
+        """Stop playback, the ambience layers and their feeder threads."""
+        self.engine.shutdown()
+        self.ambience.shutdown()
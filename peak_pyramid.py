@@ -0,0 +1,110 @@
+from typing import Optional
+
+import numpy as np
+
+
+def _reduce_pairs(level: np.ndarray) -> np.ndarray:
+    pairs = level.reshape(2, -1, 2)
+    return np.stack([pairs[0].min(axis=1), pairs[1].max(axis=1)])
+
+
+class PeakPyramid:
+    """Multi-resolution min/max peak pyramid over a waveform envelope.
+
+    Level 0 is the envelope itself, each further level halves the number of
+    bins by taking the min of the minima and the max of the maxima of pairs
+    of bins. Rendering picks the coarsest level that still provides one bin
+    per pixel, so drawing cost depends on the canvas width only.
+
+    Envelope chunks can be appended as they are decoded; each append costs
+    time proportional to the chunk, not to the data already in the pyramid.
+    """
+
+    def __init__(self, block: int) -> None:
+        self.block = block
+        self._chunks: list[list[np.ndarray]] = []
+        self._carry: list[Optional[np.ndarray]] = []
+        self._materialised: dict[int, np.ndarray] = {}
+        self._num_bins = 0
+
+    @classmethod
+    def from_envelope(cls, envelope: np.ndarray, block: int) -> "PeakPyramid":
+        """Build all pyramid levels from a (2, n) min/max envelope."""
+        pyramid = cls(block)
+        pyramid.append(envelope)
+        return pyramid
+
+    def append(self, envelope: np.ndarray) -> None:
+        """Append a (2, n) envelope chunk and propagate it through the levels."""
+        chunk = np.asarray(envelope, dtype=np.float32)
+        self._num_bins += chunk.shape[1]
+        self._materialised.clear()
+        level = 0
+        while chunk.shape[1]:
+            if level == len(self._chunks):
+                self._chunks.append([])
+                self._carry.append(None)
+            self._chunks[level].append(chunk)
+            if self._carry[level] is not None:
+                chunk = np.concatenate([self._carry[level], chunk], axis=1)
+            even = chunk.shape[1] // 2 * 2
+            self._carry[level] = chunk[:, even:] if even < chunk.shape[1] else None
+            chunk = _reduce_pairs(chunk[:, :even])
+            level += 1
+
+    @property
+    def num_bins(self) -> int:
+        """Number of bins at full resolution."""
+        return self._num_bins
+
+    @property
+    def num_samples(self) -> int:
+        """Approximate number of audio samples covered by the pyramid."""
+        return self._num_bins * self.block
+
+    @property
+    def num_levels(self) -> int:
+        return len(self._chunks)
+
+    def level(self, index: int) -> np.ndarray:
+        """Return level ``index`` as a single (2, m) array.
+
+        Bins still waiting for their pair are folded into one trailing
+        partial bin so the end of a growing track is always visible.
+        """
+        if index not in self._materialised:
+            parts = list(self._chunks[index])
+            pending = [carry for carry in self._carry[:index] if carry is not None]
+            if pending:
+                pending = np.concatenate(pending, axis=1)
+                parts.append(np.array([[pending[0].min()], [pending[1].max()]], dtype=np.float32))
+            if not parts:
+                return np.empty((2, 0), dtype=np.float32)
+            self._materialised[index] = np.concatenate(parts, axis=1) if len(parts) > 1 else parts[0]
+        return self._materialised[index]
+
+    def level_for(self, num_bins: int, width: int) -> int:
+        """Pick the coarsest level that still has at least one bin per pixel."""
+        level = 0
+        while (level + 1 < self.num_levels
+               and num_bins >> (level + 1) >= max(width, 1)):
+            level += 1
+        return level
+
+    def view(self, start: int, stop: int, width: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return bin positions and (2, m) min/max values for a level-0 bin range.
+
+        The returned positions are in level-0 bins so callers can keep a
+        single x axis while zooming.
+        """
+        start = max(0, start)
+        stop = min(self._num_bins, stop)
+        if stop <= start:
+            return np.empty(0, dtype=np.float32), np.empty((2, 0), dtype=np.float32)
+        level = self.level_for(stop - start, width)
+        scale = 1 << level
+        lo = start // scale
+        hi = -(-stop // scale)
+        values = self.level(level)[:, lo:hi]
+        positions = np.arange(lo, lo + values.shape[1], dtype=np.float32) * scale
+        return positions, values
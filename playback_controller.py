@@ -0,0 +1,121 @@
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+from music_player import MusicPlayer
+
+
+class PlaybackController(QObject):
+    """Single owner of the playback lifecycle on the Qt side.
+
+    Transport actions go through here, and the playback engine's
+    end-of-track callbacks (which arrive on the engine's feeder thread) are
+    re-emitted on the Qt thread as ``track_changed`` or, when the playlist
+    ran out under the repeat mode, ``state_changed("stopped")``. There is
+    no polling: the only timer drives ``progress``, ticks about once per
+    pixel of the progress display, and is stopped while paused, stopped or
+    while nothing shows progress.
+    """
+
+    track_changed = pyqtSignal()
+    state_changed = pyqtSignal(str)  # "playing", "paused" or "stopped"
+    progress = pyqtSignal(float, float)  # Position and duration in seconds
+    _engine_event = pyqtSignal()
+
+    MIN_TICK_MS = 16  # About 60 updates per second for short tracks on wide displays
+    MAX_TICK_MS = 1000
+
+    def __init__(self, music_player: MusicPlayer, parent=None) -> None:
+        super().__init__(parent)
+        self.music_player = music_player
+        self.duration = 0.0
+        self.progress_steps = 0  # Distinguishable progress positions on screen; 0 when nothing shows progress
+        self._engine_event.connect(self._on_engine_event)
+        # Emitting a signal from the engine thread queues the slot onto this object's (the Qt) thread
+        music_player.on_track_change = self._engine_event.emit
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._tick)
+
+    @property
+    def state(self) -> str:
+        if self.music_player.is_paused:
+            return "paused"
+        return "playing" if self.music_player.is_playing else "stopped"
+
+    def play_index(self, index: int) -> None:
+        """Play the song at a playlist position, crossfading if a transition is set."""
+        self.music_player.play_from_index(index, fade=True)
+        self._started()
+
+    def start_scene(self, prepared) -> None:
+        """Switch to a prepared scene preset, see ``MusicPlayer.start_scene``."""
+        self.music_player.start_scene(prepared)
+        self._started()
+
+    def next(self) -> None:
+        if self.music_player.playlist:
+            self.music_player.play_next_song(fade=True)
+            self._started()
+
+    def previous(self) -> None:
+        if self.music_player.playlist:
+            self.music_player.play_previous_song(fade=True)
+            self._started()
+
+    def pause(self) -> None:
+        self.music_player.pause_music()
+        self._update_timer()
+        self.state_changed.emit(self.state)
+
+    def resume(self) -> None:
+        self.music_player.resume_music()
+        self._update_timer()
+        self.state_changed.emit(self.state)
+
+    def stop(self) -> None:
+        self.music_player.stop_music()
+        self._update_timer()
+        self.progress.emit(0.0, self.duration)
+        self.state_changed.emit(self.state)
+
+    def seek(self, seconds: float) -> None:
+        """Jump to a position in the current track and report the new position right away."""
+        if self.state == "stopped":
+            return
+        self.music_player.seek(max(0.0, min(seconds, self.duration or seconds)))
+        self._tick()
+
+    def set_repeat_mode(self, mode: str) -> None:
+        self.music_player.set_repeat_mode(mode)
+
+    def set_progress_steps(self, steps: int) -> None:
+        """Set how finely progress is displayed, e.g. the progress bar width; 0 stops progress updates."""
+        self.progress_steps = max(0, steps)
+        self._update_timer()
+
+    def _started(self) -> None:
+        if not self.music_player.is_playing:
+            return
+        self.duration = self.music_player.duration_of(self.music_player.current_song)
+        self._update_timer()
+        self.track_changed.emit()
+        self.state_changed.emit(self.state)
+
+    def _on_engine_event(self) -> None:
+        if self.music_player.is_playing:
+            self._started()
+        else:
+            self._update_timer()
+            self.progress.emit(0.0, self.duration)
+            self.state_changed.emit(self.state)
+
+    def _update_timer(self) -> None:
+        if self.state != "playing" or not self.progress_steps:
+            self.timer.stop()
+            return
+        interval = self.MAX_TICK_MS
+        if self.duration:
+            interval = int(self.duration * 1000 / self.progress_steps)
+        self.timer.start(max(self.MIN_TICK_MS, min(self.MAX_TICK_MS, interval)))
+        self._tick()
+
+    def _tick(self) -> None:
+        self.progress.emit(self.music_player.engine.position(), self.duration)
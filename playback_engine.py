@@ -0,0 +1,576 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import numpy as np
+import pygame
+
+import instrumentation
+from decoders import stream_audio
+from transition_manager import Crossfade, Transition
+
+logger = logging.getLogger(__name__)
+
+
+class TrackSource:
+    """One track being decoded on a background thread into a bounded buffer.
+
+    The decoder stays at most ``ahead_seconds`` ahead of playback, so a
+    source created for the upcoming track pre-decodes its first seconds and
+    then waits until playback catches up.
+    """
+
+    def __init__(self, path: str, sample_rate: int, channels: int, key=None,
+                 ahead_seconds: float = 5.0, block_frames: int = 16384, gain: float = 1.0,
+                 start_frame: int = 0) -> None:
+        self.path = path
+        self.key = key
+        self.gain = gain  # Linear gain applied as blocks are decoded
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_frames = block_frames
+        self.error: Optional[str] = None
+        self.start_frame = start_frame  # Decoding starts this far into the track, after a seek
+        self.frames_read = start_frame
+        self.started = False  # True once the first decoded frame has been handed to the mixer
+        self.leading_silence = 0  # Frames of silence played before the first decoded frame
+        self.handover = False  # True when this track follows another without a restart
+        self.underruns = 0
+        self._ahead = int(ahead_seconds * sample_rate)
+        self._blocks: deque[np.ndarray] = deque()
+        self._buffered = 0
+        self._decoded_all = False
+        self._cancelled = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._decode, name="decode", daemon=True)
+        self._thread.start()
+
+    def _fit_channels(self, block: np.ndarray) -> np.ndarray:
+        """Match the decoded channel count to the mixer's."""
+        if block.shape[1] == self.channels:
+            return block
+        if self.channels == 1:
+            return block.mean(axis=1, keepdims=True)
+        return block[:, np.arange(self.channels) % block.shape[1]]
+
+    def _decode(self) -> None:
+        try:
+            for block in stream_audio(self.path, self.sample_rate, mono=False, block_frames=self.block_frames,
+                                      start=self.start_frame / self.sample_rate):
+                block = self._fit_channels(block)
+                if self.gain != 1.0:
+                    block = block * np.float32(self.gain)
+                with self._cond:
+                    while self._buffered >= self._ahead and not self._cancelled:
+                        self._cond.wait()
+                    if self._cancelled:
+                        return
+                    self._blocks.append(block)
+                    self._buffered += len(block)
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Error playing {self.path}: {e}")
+        finally:
+            with self._cond:
+                self._decoded_all = True
+
+    @property
+    def buffered_frames(self) -> int:
+        return self._buffered
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._buffered * self.channels * 4
+
+    def set_ahead(self, seconds: float) -> None:
+        """Let the decoder run up to ``seconds`` ahead of playback from now on."""
+        with self._cond:
+            self._ahead = int(seconds * self.sample_rate)
+            self._cond.notify()
+
+    @property
+    def decoded_all(self) -> bool:
+        """True once the decoder reached the end of the file (or failed)."""
+        return self._decoded_all
+
+    @property
+    def exhausted(self) -> bool:
+        """True when every decoded frame has been read."""
+        with self._cond:
+            return self._decoded_all and not self._buffered
+
+    def read(self, frames: int) -> np.ndarray:
+        """Return up to ``frames`` decoded frames without blocking."""
+        parts = []
+        with self._cond:
+            while frames and self._blocks:
+                block = self._blocks[0]
+                if len(block) <= frames:
+                    parts.append(self._blocks.popleft())
+                else:
+                    parts.append(block[:frames])
+                    self._blocks[0] = block[frames:]
+                frames -= len(parts[-1])
+            read = sum(len(part) for part in parts)
+            self._buffered -= read
+            self._cond.notify()
+        self.frames_read += read
+        if not parts:
+            return np.empty((0, self.channels), dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def cancel(self) -> None:
+        with self._cond:
+            self._cancelled = True
+            self._blocks.clear()
+            self._buffered = 0
+            self._cond.notify()
+
+
+class _QueuedBlock:
+    """A block handed to the mixer channel, with the track boundaries inside it."""
+
+    def __init__(self, sound, frames: int, source: Optional[TrackSource], start_frame: int,
+                 marks: list) -> None:
+        self.sound = sound
+        self.frames = frames
+        self.source = source
+        self.start_frame = start_frame  # Position of the block start within ``source``
+        self.marks = marks  # [(offset in block, next source or None)]
+        self.started_at: Optional[float] = None
+
+
+class PlaybackEngine:
+    """Gapless player that streams decoded blocks onto a reserved mixer channel.
+
+    A feeder thread keeps the channel's play and queue slots filled with
+    ``block_frames``-long sounds. When a track runs out, the same block is
+    filled up with the first frames of the next track, which was chosen by
+    ``next_track`` and pre-decoded while the current one was still playing,
+    so the handover is sample-contiguous. If the next track is not ready in
+    time the block is padded with silence, and the length of that gap is
+    recorded in ``gaps``.
+
+    ``next_track(key)`` returns the ``(path, key)`` of the track to play
+    after the track with ``key``, or None to stop after it. ``on_track_started(key)`` is called from the feeder
+    thread when playback crosses into the next track, with None when
+    playback ran out or failed. ``next_track``, ``gain_lookup`` and the
+    transition's lookup are called without the engine's lock held.
+
+    With a ``transition`` set, the next track is mixed in over the end of
+    the current one instead; the fade starts on the exact frame the
+    transition plans, possibly in the middle of a block.
+
+    The caller reserves ``channel_id`` with ``pygame.mixer.set_reserved``.
+    """
+
+    def __init__(self, next_track: Optional[Callable[[object], Optional[tuple]]] = None,
+                 on_track_started: Optional[Callable[[object], None]] = None,
+                 block_frames: int = 4096, preroll_seconds: float = 5.0, channel_id: int = 0) -> None:
+        self.sample_rate, _, self.channels = pygame.mixer.get_init()
+        self.next_track = next_track
+        self.on_track_started = on_track_started
+        self.block_frames = block_frames
+        self.preroll_seconds = preroll_seconds
+        self.channel = pygame.mixer.Channel(channel_id)
+        self.gaps: list[float] = []  # Handover gaps in milliseconds
+        self.output_underruns = 0
+        self.transition: Optional[Transition] = None
+        self.gain_lookup: Optional[Callable[[str], Optional[float]]] = None  # Per-track gain in dB, e.g. loudness
+        self.crossfade_costs: list[float] = []  # Mixing time per block of each finished crossfade, in microseconds
+        self._fade: Optional[Crossfade] = None
+        self._fade_now = False  # Fade into the next track as soon as it is buffered, see crossfade_to()
+        self._fade_plan: Optional[tuple] = None  # (source, start frame, length) of the planned fade
+        self._current: Optional[TrackSource] = None
+        self._next: Optional[TrackSource] = None
+        self._next_requested = False
+        self._looked_up: Optional[tuple] = None  # (source, upcoming, gain in dB, transition, fade info), see _look_up()
+        self._generation = 0  # Bumped whenever looked up data goes stale
+        self._in_flight: deque[_QueuedBlock] = deque()
+        self._paused = False
+        self._paused_at = 0.0
+        self._shutdown = False
+        self._cond = threading.Condition()
+        self._poll = block_frames / self.sample_rate / 4
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def current(self) -> Optional[TrackSource]:
+        return self._current
+
+    @property
+    def is_active(self) -> bool:
+        """True while a track is playing or paused."""
+        return self._current is not None or bool(self._in_flight)
+
+    @property
+    def last_gap_ms(self) -> Optional[float]:
+        return self.gaps[-1] if self.gaps else None
+
+    def stats(self) -> dict:
+        return {
+            "handovers": len(self.gaps),
+            "last_gap_ms": self.last_gap_ms,
+            "max_gap_ms": max(self.gaps) if self.gaps else None,
+            "buffer_ms": round(self.block_frames / self.sample_rate * 1000, 1),
+            "output_underruns": self.output_underruns,
+            "crossfades": len(self.crossfade_costs),
+            "crossfade_block_us": round(max(self.crossfade_costs), 1) if self.crossfade_costs else None,
+        }
+
+    def _ahead_seconds(self) -> float:
+        if self.transition is not None:
+            # The fade has to be planned before it starts, which needs the end of the track decoded
+            return max(self.preroll_seconds, self.transition.max_duration + 1.0)
+        return self.preroll_seconds
+
+    def _lookup_gain(self, path: str) -> Optional[float]:
+        return self.gain_lookup(path) if self.gain_lookup is not None else None
+
+    def _new_source(self, path: str, key, gain_db: Optional[float], start_frame: int = 0,
+                    ahead: Optional[float] = None) -> TrackSource:
+        gain = 10 ** (gain_db / 20) if gain_db else 1.0
+        return TrackSource(path, self.sample_rate, self.channels, key, ahead_seconds=ahead or self._ahead_seconds(),
+                           gain=gain, start_frame=start_frame)
+
+    def prepare(self, path: str, ahead_seconds: float) -> TrackSource:
+        """Start decoding the first ``ahead_seconds`` of a track, to be passed to ``play`` or ``crossfade_to`` later."""
+        return self._new_source(path, None, self._lookup_gain(path), ahead=ahead_seconds)
+
+    def _adopt(self, source: Optional[TrackSource], path: str, key, gain_db: Optional[float]) -> TrackSource:
+        """Use a prepared source for ``path`` if it is still unplayed, or start a new one."""
+        if source is None or source.path != path or source.frames_read or source.error is not None:
+            return self._new_source(path, key, gain_db)
+        source.key = key
+        source.set_ahead(self._ahead_seconds())
+        return source
+
+    def play(self, path: str, key=None, source: Optional[TrackSource] = None) -> None:
+        """Start playing ``path`` immediately, replacing whatever is playing.
+
+        A ``source`` from ``prepare`` for the same path is played from its
+        already decoded start instead of opening the file again.
+        """
+        gain_db = self._lookup_gain(path)
+        with self._cond:
+            self._start(path, key, source, gain_db)
+
+    def _start(self, path: str, key, source: Optional[TrackSource], gain_db: Optional[float]) -> None:
+        self._reset()
+        self._current = self._adopt(source, path, key, gain_db)
+        self._paused = False
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="playback", daemon=True)
+            self._thread.start()
+        self._cond.notify()
+
+    def seek(self, seconds: float) -> None:
+        """Restart the current track ``seconds`` into it, staying paused if playback is paused."""
+        while True:
+            current = self._current
+            if current is None:
+                return
+            gain_db = self._lookup_gain(current.path)
+            with self._cond:
+                if self._current is not current:
+                    continue  # The track changed during the lookup
+                paused = self._paused
+                self._reset()
+                self._current = self._new_source(current.path, current.key, gain_db,
+                                                 max(0, int(seconds * self.sample_rate)))
+                if paused:
+                    self._paused_at = time.perf_counter()
+                self._cond.notify()
+                return
+
+    def crossfade_to(self, path: str, key=None, source: Optional[TrackSource] = None) -> None:
+        """Fade from the playing track into ``path`` using the current transition.
+
+        Falls back to ``play`` when there is no transition or nothing playing.
+        """
+        gain_db = self._lookup_gain(path)
+        with self._cond:
+            if self.transition is None or self._current is None or self._paused:
+                self._start(path, key, source, gain_db)
+                return
+            if self._next is not None:
+                self._next.cancel()
+            self._next = self._adopt(source, path, key, gain_db)
+            self._next_requested = True
+            self._fade_now = True
+
+    def stop(self) -> None:
+        with self._cond:
+            self._reset()
+            self._paused = False
+
+    def _reset(self) -> None:
+        self.channel.stop()
+        self._in_flight.clear()
+        for source in (self._current, self._next):
+            if source is not None:
+                source.cancel()
+        if self._fade is not None:
+            self._fade.outgoing.cancel()
+        self._current = self._next = self._fade = None
+        self._next_requested = self._fade_now = False
+        self._looked_up = None
+        self._generation += 1
+
+    def pause(self) -> None:
+        with self._cond:
+            if not self._paused:
+                self.channel.pause()
+                self._paused = True
+                self._paused_at = time.perf_counter()
+
+    def resume(self) -> None:
+        with self._cond:
+            if self._paused:
+                paused_for = time.perf_counter() - self._paused_at
+                for block in self._in_flight:
+                    if block.started_at is not None:
+                        block.started_at += paused_for
+                self._paused = False
+                self.channel.unpause()
+                self._cond.notify()
+
+    def set_volume(self, volume: float) -> None:
+        self.channel.set_volume(volume)
+
+    def invalidate_next(self) -> None:
+        """Forget the pre-decoded next track, e.g. after the playlist order changed."""
+        with self._cond:
+            if self._next is not None:
+                self._next.cancel()
+            self._next = None
+            self._next_requested = self._fade_now = False
+            self._looked_up = None
+            self._generation += 1
+
+    def rekey(self, key) -> None:
+        """Give the playing track a new key, e.g. after the playlist it was keyed by was replaced.
+
+        The pre-decoded next track was chosen by the old key, so it is dropped.
+        """
+        with self._cond:
+            if self._current is not None:
+                self._current.key = key
+        self.invalidate_next()
+
+    def position(self) -> float:
+        """Playback position within the current track in seconds."""
+        with self._cond:
+            if not self._in_flight or self._in_flight[0].started_at is None:
+                # Nothing audible yet, e.g. just after a seek while paused
+                return self._current.start_frame / self.sample_rate if self._current is not None else 0.0
+            block = self._in_flight[0]
+            now = self._paused_at if self._paused else time.perf_counter()
+            elapsed = min(block.frames, int((now - block.started_at) * self.sample_rate))
+            base = block.start_frame
+            for offset, _ in block.marks:
+                if elapsed >= offset:
+                    base, elapsed = 0, elapsed - offset
+            return (base + elapsed) / self.sample_rate
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._reset()
+            self._shutdown = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._look_up()
+                with self._cond:
+                    while not self._shutdown and (self._paused or (self._current is None and not self._in_flight)):
+                        self._cond.wait()
+                    if self._shutdown:
+                        return
+                    events = self._service()
+            except Exception:
+                # Stop rather than let the feeder die and leave the channel silent for good
+                logger.exception("Playback failed, stopping")
+                with self._cond:
+                    self._reset()
+                events = [None]
+            for key in events:
+                if self.on_track_started is not None:
+                    try:
+                        self.on_track_started(key)
+                    except Exception:
+                        logger.exception("Track change callback failed")
+            with self._cond:
+                # play(), seek() and resume() notify, so a new track is serviced at once instead of after the poll
+                if not self._shutdown:
+                    self._cond.wait(self._poll)
+
+    def _look_up(self) -> None:
+        """Once the current track is fully decoded, look up its successor, the successor's gain and the fade data.
+
+        Runs without the lock, since these call back into the player and
+        the analysis stores; the feeder uses the results on its next pass.
+        """
+        with self._cond:
+            current, transition, generation = self._current, self.transition, self._generation
+            if current is None or not current.decoded_all or (
+                    self._looked_up is not None and self._looked_up[0] is current):
+                return
+            key = current.key
+        upcoming = self.next_track(key) if self.next_track is not None else None
+        gain_db = self._lookup_gain(upcoming[0]) if upcoming is not None else None
+        fade_info = transition.lookup(current.path) if transition is not None else None
+        with self._cond:
+            if self._generation == generation and self._current is current and current.key == key:
+                self._looked_up = (current, upcoming, gain_db, transition, fade_info)
+
+    def _ready(self, current: TrackSource) -> bool:
+        """True when ``_look_up`` has run for ``current``."""
+        return self._looked_up is not None and self._looked_up[0] is current
+
+    def _service(self) -> list:
+        """Retire finished blocks, fire due track boundaries and refill the channel."""
+        events = []
+        # Match blocks by the channel's sound objects rather than get_busy(): while the mixer moves the
+        # queued sound into the play slot the channel briefly reports idle, but get_sound() is already set
+        playing_sound = self.channel.get_sound()
+        if playing_sound is None:
+            playing_sound = self.channel.get_queue()
+        if playing_sound is None and self._in_flight and self._current is not None:
+            self.output_underruns += 1
+            instrumentation.count("playback.output_underruns")
+        while self._in_flight and self._in_flight[0].sound is not playing_sound:
+            block = self._in_flight.popleft()
+            events.extend(source.key if source is not None else None for _, source in block.marks)
+            block.marks = []
+        while len(self._in_flight) < 2 and self._current is not None:
+            if not self._in_flight and not self._current.buffered_frames and not self._current.decoded_all:
+                break  # Nothing to hand over from: wait for the first decoded frames instead of queueing silence
+            with instrumentation.span("playback.compose_block"):
+                block = self._compose_block()
+            self.channel.queue(block.sound)
+            self._in_flight.append(block)
+        now = time.perf_counter()
+        if self._in_flight:
+            block = self._in_flight[0]
+            if block.started_at is None:
+                block.started_at = now
+            elapsed = (now - block.started_at) * self.sample_rate
+            while block.marks and block.marks[0][0] <= elapsed:
+                boundary, source = block.marks.pop(0)
+                # From here on the block belongs to the new track; rebase it so position() stays simple
+                block.started_at += boundary / self.sample_rate
+                block.frames -= boundary
+                block.start_frame = 0
+                elapsed -= boundary
+                events.append(source.key if source is not None else None)
+                block.marks = [(offset - boundary, nxt) for offset, nxt in block.marks]
+            if len(self._in_flight) > 1 and self._in_flight[1].started_at is None:
+                self._in_flight[1].started_at = block.started_at + block.frames / self.sample_rate
+        return events
+
+    def _compose_block(self) -> _QueuedBlock:
+        """Fill one block from the current track, crossing into the next one when it ends."""
+        out = np.zeros((self.block_frames, self.channels), dtype=np.float32)
+        source = self._current
+        start_frame = source.frames_read
+        marks = []
+        filled = 0
+        while filled < self.block_frames and self._current is not None:
+            current = self._current
+            if current.decoded_all and not self._next_requested and self._ready(current):
+                self._prepare_next()
+            want = self.block_frames - filled
+            if self._next is not None and self.transition is not None:
+                until = self._frames_until_fade(current)
+                if until is not None and until <= 0:
+                    self._start_fade(current)
+                    marks.append((filled, self._current))
+                    continue
+                if until is not None:
+                    want = min(want, until)
+            data = current.read(want)
+            out[filled:filled + len(data)] = data
+            fading = self._fade is not None
+            if fading:
+                self._fade.apply(out[filled:filled + want])
+                if self._fade.done:
+                    self._finish_fade()
+            filled += want if fading else len(data)
+            if len(data) and not current.started:
+                current.started = True
+                if current.handover:
+                    gap = current.leading_silence / self.sample_rate * 1000
+                    self.gaps.append(gap)
+                    instrumentation.observe("playback.gap_ms", gap)
+                    logger.info(f"Handover to {current.path}: gap {gap:.1f} ms")
+            if current.exhausted:
+                if not self._next_requested:
+                    break  # The successor is looked up on the feeder's next pass
+                if self._fade is not None:
+                    self._finish_fade()
+                nxt = self._next
+                self._next, self._next_requested = None, False
+                if nxt is not None:
+                    nxt.handover = True
+                marks.append((filled, nxt))
+                self._current = nxt
+            elif len(data) < want:
+                # Decoder fell behind, or the next track is not ready yet: pad with silence
+                if current.started:
+                    current.underruns += 1
+                    instrumentation.count("playback.decode_underruns")
+                else:
+                    current.leading_silence += want - len(data)
+                if not fading:
+                    break
+        pcm = np.clip(out * 32767.0, -32768, 32767).astype(np.int16)
+        sound = pygame.sndarray.make_sound(pcm if self.channels > 1 else pcm[:, 0])
+        return _QueuedBlock(sound, self.block_frames, source, start_frame, marks)
+
+    def _frames_until_fade(self, current: TrackSource) -> Optional[int]:
+        """Frames of ``current`` left to play before the fade into the next track, if known yet."""
+        if self._fade_now:
+            ready = self._next.decoded_all or self._next.buffered_frames >= self.block_frames
+            return 0 if ready else None
+        if not current.decoded_all or not self._ready(current) or self._looked_up[3] is not self.transition:
+            return None
+        if self._fade_plan is None or self._fade_plan[0] is not current:
+            total = current.frames_read + current.buffered_frames
+            self._fade_plan = (current,) + self.transition.plan(self._looked_up[4], total, self.sample_rate)
+        return self._fade_plan[1] - current.frames_read
+
+    def _start_fade(self, current: TrackSource) -> None:
+        """Make the next track current and fade the current one out underneath it."""
+        if self._fade_now or self._fade_plan is None or self._fade_plan[0] is not current:
+            length = int(self.transition.duration * self.sample_rate)
+        else:
+            length = self._fade_plan[2]
+        if current.decoded_all:
+            length = min(length, current.buffered_frames)
+        if self._fade is not None:
+            self._fade.outgoing.cancel()
+        self._fade = Crossfade(self.transition, current, length)
+        self._current, self._next = self._next, None
+        self._next_requested = self._fade_now = False
+        self._fade_plan = None
+
+    def _finish_fade(self) -> None:
+        fade, self._fade = self._fade, None
+        fade.outgoing.cancel()
+        self.crossfade_costs.append(fade.seconds_per_block * 1e6)
+        instrumentation.observe("playback.crossfade_block_us", fade.seconds_per_block * 1e6)
+        logger.info(f"Crossfade ({fade.transition.name}, {fade.length / self.sample_rate:.2f} s): "
+                    f"{fade.blocks} blocks, {fade.seconds_per_block * 1e6:.0f} us per block")
+
+    def _prepare_next(self) -> None:
+        self._next_requested = True
+        _, upcoming, gain_db, _, _ = self._looked_up
+        if upcoming is not None:
+            path, key = upcoming
+            self._next = self._new_source(path, key, gain_db)
@@ -0,0 +1,63 @@
+import os
+from typing import Optional
+
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, Qt
+from PyQt6.QtGui import QColor, QFont
+
+from music_player import MusicPlayer
+
+
+class PlaylistModel(QAbstractListModel):
+    """List model exposing ``MusicPlayer.playlist`` to a QListView.
+
+    Rows are produced on demand for the visible part of the view only.
+    Moving the current-song highlight touches just the old and new rows.
+    Replacing or reordering the playlist resets the model without copying
+    the playlist.
+    """
+
+    def __init__(self, music_player: MusicPlayer, parent=None) -> None:
+        super().__init__(parent)
+        self.music_player = music_player
+        self.current_row: Optional[int] = None
+        self._current_background = QColor(80, 80, 80)
+        self._current_font = QFont()
+        self._current_font.setBold(True)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.music_player.playlist)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.ItemDataRole.DisplayRole:
+            path = self.music_player.playlist[row]
+            duration = self.music_player.durations.get(path)
+            if duration is None:
+                return os.path.basename(path)
+            minutes, seconds = divmod(int(round(duration)), 60)
+            return f"{os.path.basename(path)}  ({minutes}:{seconds:02d})"
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return self.music_player.playlist[row]
+        if row == self.current_row:
+            if role == Qt.ItemDataRole.BackgroundRole:
+                return self._current_background
+            if role == Qt.ItemDataRole.FontRole:
+                return self._current_font
+        return None
+
+    def refresh(self) -> None:
+        """Notify views that the playlist was replaced or reordered."""
+        self.beginResetModel()
+        self.endResetModel()
+
+    def set_current_row(self, row: Optional[int]) -> None:
+        """Move the current-song highlight, repainting only the affected rows."""
+        previous, self.current_row = self.current_row, row
+        for changed in {previous, row}:
+            if changed is not None and 0 <= changed < self.rowCount():
+                index = self.index(changed)
+                self.dataChanged.emit(index, index, [Qt.ItemDataRole.BackgroundRole, Qt.ItemDataRole.FontRole])
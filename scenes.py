@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from music_player import MusicPlayer
+from playback_engine import TrackSource
+
+WARM_SECONDS = 2.0  # Decoded ahead for each warm scene; the engine's own read-ahead takes over once it plays
+WARM_BUDGET_BYTES = 48 * 1024 * 1024
+
+
+class Scene:
+    """A named music preset: a folder or a fixed list of tracks, and the volume and transition to play them with."""
+
+    def __init__(self, name: str, folder: Optional[str] = None, tracks: Optional[list[str]] = None,
+                 volume: float = 1.0, transition: Optional[str] = None, shuffle: bool = True) -> None:
+        self.name = name
+        self.folder = folder
+        self.tracks = tracks or []  # Used when there is no folder
+        self.volume = volume
+        self.transition = transition  # Transition name, or None to cut
+        self.shuffle = shuffle
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "folder": self.folder, "tracks": self.tracks, "volume": self.volume,
+                "transition": self.transition, "shuffle": self.shuffle}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Scene":
+        return cls(data["name"], data.get("folder"), data.get("tracks"), data.get("volume", 1.0),
+                   data.get("transition"), data.get("shuffle", True))
+
+
+class PreparedScene:
+    """A scene ready to start: its tracks in load order, their durations and the index of the first to play.
+
+    ``source`` is the first track already decoding into a small buffer,
+    or None when the scene was prepared on demand.
+    """
+
+    def __init__(self, scene: Scene, tracks: list[str], durations: dict[str, float], first: int,
+                 source: Optional[TrackSource] = None) -> None:
+        self.scene = scene
+        self.tracks = tracks
+        self.durations = durations
+        self.first = first
+        self.source = source
+
+    def release(self) -> None:
+        """Stop decoding the first track and free its buffer."""
+        if self.source is not None:
+            self.source.cancel()
+            self.source = None
+
+
+class ScenePresets:
+    """Named scene presets, kept warm so that switching to one starts audio at once.
+
+    Presets are stored as JSON. A background thread prepares each one
+    ahead of time: it lists the scene's tracks, picks the first track to
+    play and starts decoding it into a buffer of ``warm_seconds``. Taking
+    a warm scene then only hands over that buffer; there is no listing,
+    shuffling of paths or opening of files left to do. Warm scenes are
+    evicted least recently warmed first once their buffers would exceed
+    ``budget_bytes``, and a scene that is not warm is prepared on the spot
+    instead. A taken scene is warmed again, with a new first track if it
+    shuffles.
+    """
+
+    def __init__(self, music_player: MusicPlayer, path: str = os.path.join("cache", "scenes.json"),
+                 budget_bytes: int = WARM_BUDGET_BYTES, warm_seconds: float = WARM_SECONDS) -> None:
+        self.music_player = music_player
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self.warm_seconds = warm_seconds
+        engine = music_player.engine
+        # Upper bound on one warm buffer: the decoder may overshoot the limit by one of its blocks
+        self.warm_bytes = (int(warm_seconds * engine.sample_rate) + 16384) * engine.channels * 4
+        self.scenes = self._load()
+        self._warm: OrderedDict[str, PreparedScene] = OrderedDict()  # Least recently warmed first
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="scene-warmer", daemon=True)
+        self._thread.start()
+        for name in self.scenes:
+            self._queue.put(name)
+
+    def _load(self) -> dict[str, Scene]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {scene["name"]: Scene.from_dict(scene) for scene in data.get("scenes", [])}
+
+    def _save(self) -> None:
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"scenes": [scene.to_dict() for scene in self.scenes.values()]}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def warm_names(self) -> list[str]:
+        with self._lock:
+            return list(self._warm)
+
+    @property
+    def bytes_used(self) -> int:
+        with self._lock:
+            return sum(prepared.source.buffered_bytes for prepared in self._warm.values()
+                       if prepared.source is not None)
+
+    def save(self, scene: Scene) -> None:
+        """Add or replace a preset and warm it."""
+        with self._lock:
+            self.scenes[scene.name] = scene
+            self._drop(scene.name)
+            self._save()
+        self._queue.put(scene.name)
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self.scenes.pop(name, None)
+            self._drop(name)
+            self._save()
+
+    def invalidate(self) -> None:
+        """Re-warm every scene, e.g. after a setting that is baked into decoded audio changed."""
+        with self._lock:
+            for name in list(self._warm):
+                self._drop(name)
+            names = list(self.scenes)
+        for name in names:
+            self._queue.put(name)
+
+    def take(self, name: str) -> PreparedScene:
+        """Return a scene ready to start, warm if possible, and start warming it again.
+
+        The caller owns the result: it is passed to ``MusicPlayer.start_scene``.
+        """
+        scene = self.scenes.get(name)
+        if scene is None:
+            raise ValueError(f"Unknown scene: {name}")
+        with self._lock:
+            prepared = self._warm.pop(name, None)
+        if prepared is None:
+            logging.info(f"Scene {name} is not warm; preparing it now")
+            prepared = self.prepare(scene)
+        self._queue.put(name)
+        return prepared
+
+    def prepare(self, scene: Scene, warm: bool = False) -> PreparedScene:
+        """List a scene's tracks and pick its first track; with ``warm``, also start decoding that track."""
+        if scene.folder is not None:
+            if not os.path.isdir(scene.folder):
+                raise ValueError(f"Folder of scene {scene.name} not found: {scene.folder}")
+            tracks, durations = self.music_player.folder_tracks(scene.folder)
+            tracks = [os.path.normpath(track) for track in tracks]
+        else:
+            tracks = [os.path.normpath(track) for track in scene.tracks]
+            catalog = self.music_player.catalog
+            durations = catalog.durations_of(tracks) if catalog is not None else {}
+        if not tracks:
+            raise ValueError(f"Scene {scene.name} has no tracks")
+        first = int(self._rng.integers(len(tracks))) if scene.shuffle else 0
+        source = self.music_player.engine.prepare(tracks[first], self.warm_seconds) if warm else None
+        return PreparedScene(scene, tracks, durations, first, source)
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=2.0)
+        with self._lock:
+            for name in list(self._warm):
+                self._drop(name)
+
+    def _drop(self, name: str) -> None:
+        prepared = self._warm.pop(name, None)
+        if prepared is not None:
+            prepared.release()
+
+    def _run(self) -> None:
+        while True:
+            name = self._queue.get()
+            if name is None:
+                return
+            with self._lock:
+                scene = self.scenes.get(name)
+                if scene is None or name in self._warm or self.warm_bytes > self.budget_bytes:
+                    continue
+            try:
+                prepared = self.prepare(scene, warm=True)
+            except Exception as e:
+                logging.warning(f"Could not warm scene {name}: {e}")
+                continue
+            with self._lock:
+                if self.scenes.get(name) is not scene:
+                    prepared.release()  # Edited or deleted while it was being prepared
+                    continue
+                while self._warm and (len(self._warm) + 1) * self.warm_bytes > self.budget_bytes:
+                    evicted, _ = next(iter(self._warm.items()))
+                    logging.debug(f"Scene {evicted} evicted from the warm pool")
+                    self._drop(evicted)
+                self._warm[name] = prepared
@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from itertools import islice
+from typing import Iterable, Optional
+
+import numpy as np
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+MIN_COVERAGE = 0.3  # Share of the query's trigrams a track must contain; low enough for a swapped letter pair
+FOLDER_DEPTH = 2  # Parent folders indexed with each track, nearest first
+UPDATE_BATCH = 1000  # Tracks indexed per hold of the lock, so queries never wait long for a big update
+
+
+def normalise(text: str) -> str:
+    """Lowercase ASCII words separated by single spaces, with accents and punctuation removed."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def trigrams(text: str) -> set[str]:
+    """Trigrams of each word of normalised text, padded with a space on both sides."""
+    # Doubling the spaces pads every word at once; trigrams spanning two words then contain "  "
+    padded = f" {text.replace(' ', '  ')} "
+    return {gram for gram in (padded[i:i + 3] for i in range(len(padded) - 2)) if "  " not in gram}
+
+
+class SearchIndex:
+    """In-memory trigram index over track names, folder names and tags.
+
+    Each track becomes a document of the trigrams of its normalised file
+    name, its nearest ``FOLDER_DEPTH`` folder names and its tag values.
+    Postings are compact ``array('I')`` lists of document ids, so adding a
+    track appends to a few arrays. Re-adding a path replaces its document
+    and removing one leaves a tombstone; tombstones are compacted away once
+    they make up half of the index.
+
+    A query counts, per document, how many of its trigrams the document
+    contains with one ``bincount`` over the concatenated postings. Tracks
+    with at least ``MIN_COVERAGE`` of the trigrams are ranked by coverage,
+    with a bonus when the query appears verbatim in the name or folders,
+    so misspelt and partial words still find their track. The index is
+    safe to update from a scanner thread while the UI thread queries it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings: dict[str, array] = {}
+            self._paths: list[Optional[str]] = []  # Document id -> path, None once removed
+            self._names: list[str] = []  # Normalised file name of each document
+            self._folders: list[str] = []  # Normalised folder names and tags of each document
+            self._sizes = array("I")  # Trigrams per document
+            self._ids: dict[str, int] = {}  # Path -> live document id
+            self._removed = 0
+            self._folder_text: dict[str, tuple[str, set[str]]] = {}  # Folder -> normalised names and trigrams
+            self._word_grams: dict[str, tuple[str, ...]] = {}  # Word -> its trigrams; library vocabularies are small
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, path: str, tags: Optional[dict] = None) -> None:
+        """Index a track, replacing what was indexed for the same path before."""
+        with self._lock:
+            self._add(path, tags)
+
+    def update(self, changed: Iterable[tuple[str, dict]], removed: Iterable[str] = ()) -> None:
+        """Apply a batch of (path, tags) additions or changes and removed paths."""
+        with self._lock:
+            for path in removed:
+                self._remove(path)
+        changed = iter(changed)
+        while batch := list(islice(changed, UPDATE_BATCH)):
+            with self._lock:
+                for path, tags in batch:
+                    self._add(path, tags)
+        with self._lock:
+            if self._removed > 1024 and self._removed * 2 > len(self._paths):
+                self._compact()
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            self._remove(path)
+
+    def _add(self, path: str, tags: Optional[dict]) -> None:
+        self._remove(path)
+        folder, filename = os.path.split(path)
+        name = normalise(os.path.splitext(filename)[0])
+        # Tracks share folders, so each folder's text is normalised and split into trigrams once
+        cached = self._folder_text.get(folder)
+        if cached is None:
+            names, parent = [], folder
+            for _ in range(FOLDER_DEPTH):
+                parent, base = os.path.split(parent)
+                if not base:
+                    break
+                names.append(base)
+            context = normalise(" ".join(names))
+            cached = self._folder_text[folder] = (context, self._trigrams(context))
+        context, grams = cached
+        if tags:
+            context = f"{context} {normalise(' '.join(str(value) for value in tags.values()))}"
+            grams = self._trigrams(context)
+        self._append(path, name, context, self._trigrams(name) | grams)
+
+    def _trigrams(self, text: str) -> set[str]:
+        """Same as ``trigrams``, looking each word up in a cache first."""
+        grams = set()
+        for word in text.split():
+            word_grams = self._word_grams.get(word)
+            if word_grams is None:
+                padded = f" {word} "
+                word_grams = self._word_grams[word] = tuple(padded[i:i + 3] for i in range(len(padded) - 2))
+            grams.update(word_grams)
+        return grams
+
+    def _append(self, path: str, name: str, context: str, grams: set[str]) -> None:
+        doc = len(self._paths)
+        self._paths.append(path)
+        self._names.append(name)
+        self._folders.append(context)
+        self._sizes.append(len(grams))
+        self._ids[path] = doc
+        postings = self._postings
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array("I")
+            posting.append(doc)
+
+    def _remove(self, path: str) -> None:
+        doc = self._ids.pop(path, None)
+        if doc is not None:
+            self._paths[doc] = None
+            self._removed += 1
+
+    def _compact(self) -> None:
+        """Rebuild the index from its live documents, dropping tombstones."""
+        live = [(self._paths[doc], self._names[doc], self._folders[doc]) for doc in sorted(self._ids.values())]
+        self._postings, self._paths, self._names, self._folders = {}, [], [], []
+        self._sizes, self._ids, self._removed = array("I"), {}, 0
+        self._folder_text.clear()
+        self._word_grams.clear()
+        for path, name, context in live:
+            self._append(path, name, context, self._trigrams(name) | self._trigrams(context))
+
+    def search(self, query: str, limit: int = 200) -> list[str]:
+        """Paths of the best matching tracks, best first."""
+        text = normalise(query)
+        grams = trigrams(text)
+        if not grams:
+            return []
+        with self._lock:
+            postings = [self._postings[gram] for gram in grams if gram in self._postings]
+            if not postings:
+                return []
+            # Widened to intp while concatenating, which bincount would otherwise do in a second pass
+            ids = np.concatenate([np.frombuffer(posting, dtype=np.uint32) for posting in postings], dtype=np.intp)
+            counts = np.bincount(ids, minlength=len(self._paths))
+            candidates = np.flatnonzero(counts >= max(1, int(np.ceil(MIN_COVERAGE * len(grams)))))
+            # Rank only the best-covered tracks in Python; twice the limit leaves room for the bonuses
+            keep = 2 * limit
+            if len(candidates) > keep:
+                # Counts are small, so the cut-off comes from a histogram instead of a partial sort
+                covered = counts[candidates]
+                at_least = np.cumsum(np.bincount(covered)[::-1])[::-1]  # Candidates with at least each count
+                cutoff = int(np.searchsorted(-at_least, -keep, side="right")) - 1
+                above = candidates[covered > cutoff]
+                ties = candidates[covered == cutoff][:keep - len(above)]
+                candidates = np.concatenate([above, ties])
+            # Coverage of the query, less a little for unrelated text so the tighter of two equal matches wins
+            scores = (counts[candidates] / len(grams)
+                      - 0.001 * np.frombuffer(self._sizes, dtype=np.uint32)[candidates]).tolist()
+            ranked = []
+            paths, names, folders = self._paths, self._names, self._folders
+            for doc, score in zip(candidates.tolist(), scores):
+                path = paths[doc]
+                if path is None:
+                    continue
+                name = names[doc]
+                if text in name:
+                    score += 1.0
+                elif text in folders[doc]:
+                    score += 0.5
+                ranked.append((-score, name, path))
+        ranked.sort()
+        return [path for _, _, path in ranked[:limit]]
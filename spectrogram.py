@@ -1,33 +1,223 @@
-import time
-import librosa
+from typing import Iterator, Optional
+
 import numpy as np
 
-def generate_spectrogram_data(audio_file: str, include_bpm: bool = False) -> tuple:
-    """Generate waveform, energy, and BPM data for the given audio file."""
-    start_time = time.time()
+import instrumentation
+from analysis_cache import AnalysisCache
+from decoders import get_duration, stream_audio
+from peak_pyramid import PeakPyramid
+from tempo import exact_beat, fast_beat, fast_tempo
+
+SAMPLE_RATE = 22050
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+ENVELOPE_BLOCK = 64
+STREAM_BLOCK_SECONDS = 10.0
+N_MELS = 80
+MEL_FMIN = 30.0
+MEL_DB_RANGE = (-90.0, 0.0)  # dB mapped onto the 0-255 range of the stored mel frames
+
+
+def analysis_params(include_bpm: bool) -> dict:
+    """Parameters that identify an analysis result in the cache."""
+    return {
+        "sr": SAMPLE_RATE,
+        "frame_length": FRAME_LENGTH,
+        "hop_length": HOP_LENGTH,
+        "envelope_block": ENVELOPE_BLOCK,
+        "n_mels": N_MELS,
+        "mel_db_range": list(MEL_DB_RANGE),
+        "bpm": include_bpm,
+    }
+
+
+def waveform_envelope(y: np.ndarray, block: int = ENVELOPE_BLOCK) -> np.ndarray:
+    """Reduce samples to a (2, n_blocks) array of per-block minima and maxima."""
+    pad = -len(y) % block
+    if pad:
+        y = np.pad(y, (0, pad), mode="edge")
+    blocks = y.reshape(-1, block)
+    return np.stack([blocks.min(axis=1), blocks.max(axis=1)])
+
+
+def mel_filterbank(sample_rate: int = SAMPLE_RATE, n_fft: int = FRAME_LENGTH, n_mels: int = N_MELS,
+                   fmin: float = MEL_FMIN, fmax: Optional[float] = None) -> np.ndarray:
+    """Triangular (n_mels, n_fft // 2 + 1) mel filters on the HTK scale, normalised to equal area."""
+    fmax = fmax or sample_rate / 2
+    mels = np.linspace(2595 * np.log10(1 + fmin / 700), 2595 * np.log10(1 + fmax / 700), n_mels + 2)
+    hz = 700 * (10 ** (mels / 2595) - 1)
+    freqs = np.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+    rising = (freqs[None, :] - hz[:-2, None]) / (hz[1:-1] - hz[:-2])[:, None]
+    falling = (hz[2:, None] - freqs[None, :]) / (hz[2:] - hz[1:-1])[:, None]
+    weights = np.maximum(0, np.minimum(rising, falling))
+    return (weights * (2 / (hz[2:] - hz[:-2]))[:, None]).astype(np.float32)
+
+
+_MEL_FILTERS = None
+_WINDOW = None
+
+
+def mel_frames(frames: np.ndarray) -> np.ndarray:
+    """Mel spectrogram of (n, FRAME_LENGTH) sample frames as (N_MELS, n) uint8 levels over MEL_DB_RANGE."""
+    global _MEL_FILTERS, _WINDOW
+    if _MEL_FILTERS is None:
+        _MEL_FILTERS = mel_filterbank()
+        _WINDOW = np.hanning(FRAME_LENGTH).astype(np.float32)
+    spectrum = np.fft.rfft(frames * _WINDOW, axis=1)
+    # Scaled so a full-scale sine peaks near 0 dB whatever its frequency's filter width
+    power = (spectrum.real ** 2 + spectrum.imag ** 2) * np.float32(4 / _WINDOW.sum() ** 2)
+    mel = _MEL_FILTERS @ power.T.astype(np.float32)
+    low, high = MEL_DB_RANGE
+    db = 10 * np.log10(np.maximum(mel * np.float32(SAMPLE_RATE / FRAME_LENGTH), 1e-12))
+    return np.clip((db - low) * (255 / (high - low)), 0, 255).astype(np.uint8)
+
+
+class StreamingAnalyzer:
+    """Incremental waveform envelope, RMS energy and mel spectrogram over a mono sample stream.
+
+    Samples can be fed in chunks of any size; leftovers that do not yet fill
+    an envelope block or an analysis frame are carried over to the next
+    chunk, so the output does not depend on how the stream was split. RMS
+    energy and the mel spectrogram share the same frames.
+    """
+
+    def __init__(self) -> None:
+        self._envelope_tail = np.empty(0, dtype=np.float32)
+        self._frame_tail = np.empty(0, dtype=np.float32)
+
+    def feed(self, y: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Consume samples and return the newly completed (envelope, energy, mel) chunks."""
+        return (self._envelope(y),) + self._frames(y)
+
+    def finish(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Flush the partial envelope block and analysis frame at the end of the stream."""
+        envelope = np.empty((2, 0), dtype=np.float32)
+        if len(self._envelope_tail):
+            envelope = waveform_envelope(self._envelope_tail)
+            self._envelope_tail = self._envelope_tail[:0]
+        energy = np.empty(0, dtype=np.float32)
+        mel = np.empty((N_MELS, 0), dtype=np.uint8)
+        if len(self._frame_tail) > FRAME_LENGTH - HOP_LENGTH:
+            frame = np.pad(self._frame_tail, (0, FRAME_LENGTH - len(self._frame_tail)))[None, :]
+            energy = np.sqrt(np.mean(frame ** 2, axis=1))
+            mel = mel_frames(frame)
+        self._frame_tail = self._frame_tail[:0]
+        return envelope, energy, mel
+
+    def _envelope(self, y: np.ndarray) -> np.ndarray:
+        y = np.concatenate([self._envelope_tail, y])
+        full = len(y) // ENVELOPE_BLOCK * ENVELOPE_BLOCK
+        self._envelope_tail = y[full:]
+        return waveform_envelope(y[:full])
+
+    def _frames(self, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        y = np.concatenate([self._frame_tail, y])
+        if len(y) < FRAME_LENGTH:
+            self._frame_tail = y
+            return np.empty(0, dtype=np.float32), np.empty((N_MELS, 0), dtype=np.uint8)
+        n_frames = 1 + (len(y) - FRAME_LENGTH) // HOP_LENGTH
+        frames = np.lib.stride_tricks.sliding_window_view(y, FRAME_LENGTH)[::HOP_LENGTH][:n_frames]
+        self._frame_tail = y[n_frames * HOP_LENGTH:]
+        return np.sqrt(np.mean(frames ** 2, axis=1)), mel_frames(frames)
+
+
+def expected_envelope_bins(audio_file: str) -> int:
+    """Estimate the number of envelope bins a full analysis will produce."""
+    return int(np.ceil(get_duration(audio_file) * SAMPLE_RATE / ENVELOPE_BLOCK))
+
+
+def iter_spectrogram_data(audio_file: str, cache: Optional[AnalysisCache] = None,
+                          block_seconds: float = STREAM_BLOCK_SECONDS) -> Iterator[tuple]:
+    """Decode the file block by block and yield partial (envelope, energy, mel) chunks.
+
+    Memory use is bounded by the block size plus the (much smaller) analysis
+    output. The complete result is written to the cache once the stream ends,
+    together with a fast tempo estimate.
+    """
+    params = analysis_params(False)
+    if cache is not None:
+        cached = cache.get(audio_file, params)
+        if cached is not None:
+            arrays, _ = cached
+            yield arrays["envelope"], arrays["energy"], arrays["mel"]
+            return
+
+    analyzer = StreamingAnalyzer()
+    chunks = []
+    block_frames = int(block_seconds * SAMPLE_RATE)
+    for y in stream_audio(audio_file, SAMPLE_RATE, mono=True, block_frames=block_frames):
+        with instrumentation.span("analysis.block"):
+            chunk = analyzer.feed(y)
+        chunks.append(chunk)
+        yield chunk
+    chunk = analyzer.finish()
+    chunks.append(chunk)
+    yield chunk
+
+    if cache is not None:
+        envelopes, energies, mels = zip(*chunks)
+        tempo, confidence, beat_time = fast_beat(audio_file)
+        cache.put(audio_file, params,
+                  {"envelope": np.concatenate(envelopes, axis=1), "energy": np.concatenate(energies),
+                   "mel": np.concatenate(mels, axis=1)},
+                  {"tempo": tempo, "tempo_confidence": confidence, "beat_time": beat_time})
+
+
+def generate_spectrogram_data(audio_file: str, include_bpm: bool = False,
+                              cache: Optional[AnalysisCache] = None, profile: str = "exact") -> tuple:
+    """Generate a waveform peak pyramid, energy, and BPM data for the given audio file.
+
+    The "exact" profile runs librosa's beat tracker over the whole signal;
+    the "fast" profile streams the waveform analysis as usual and estimates
+    the tempo from a few short windows, see ``tempo.fast_tempo``.
+    """
+    with instrumentation.span("analysis.total", file=audio_file, bpm=include_bpm, profile=profile):
+        return _generate_spectrogram_data(audio_file, include_bpm, cache, profile)
+
+
+def _generate_spectrogram_data(audio_file: str, include_bpm: bool, cache: Optional[AnalysisCache],
+                               profile: str) -> tuple:
+    if not include_bpm or profile == "fast":
+        pyramid = PeakPyramid(ENVELOPE_BLOCK)
+        energies = []
+        for envelope, energy, _ in iter_spectrogram_data(audio_file, cache):
+            pyramid.append(envelope)
+            energies.append(energy)
+        tempo = 0.0
+        if include_bpm:
+            # A cached stream already carries the fast tempo
+            cached = cache.get(audio_file, analysis_params(False), touch=False) if cache is not None else None
+            tempo = cached[1]["tempo"] if cached is not None else fast_tempo(audio_file)[0]
+        return pyramid, np.concatenate(energies), tempo
 
-    # Load the audio
-    y, sr = librosa.load(audio_file)
-    load_time = time.time()
-    print(f"Audio loading took {load_time - start_time:.2f} seconds.")
+    params = analysis_params(include_bpm)
+    if cache is not None:
+        with instrumentation.span("analysis.cache_load"):
+            cached = cache.get(audio_file, params)
+        if cached is not None:
+            instrumentation.count("analysis.cache_hits")
+            arrays, values = cached
+            pyramid = PeakPyramid.from_envelope(arrays["envelope"], ENVELOPE_BLOCK)
+            return pyramid, arrays["energy"], values["tempo"]
 
-    # Generate waveform (time-domain representation)
-    waveform = y
+    # Load the audio through the same decoders as the player
+    with instrumentation.span("analysis.load"):
+        y = np.concatenate(list(stream_audio(audio_file, SAMPLE_RATE, mono=True)))
+    sr = SAMPLE_RATE
 
-    # Energy (RMS)
-    energy = librosa.feature.rms(y=y)[0]
-    energy_time = time.time()
-    print(f"Energy calculation took {energy_time - load_time:.2f} seconds.")
+    # Waveform envelope and energy (RMS)
+    with instrumentation.span("analysis.energy"):
+        analyzer = StreamingAnalyzer()
+        envelope, energy, _ = analyzer.feed(y)
+        envelope_tail, energy_tail, _ = analyzer.finish()
+        envelope = np.concatenate([envelope, envelope_tail], axis=1)
+        energy = np.concatenate([energy, energy_tail])
 
-    # BPM (optional)
-    if include_bpm:
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-    else:
-        tempo = 0
-    bpm_time = time.time()
-    print(f"BPM calculation took {bpm_time - energy_time:.2f} seconds.")
+    with instrumentation.span("analysis.bpm"):
+        tempo, beat_time = exact_beat(y, sr, HOP_LENGTH)
 
-    total_time = bpm_time - start_time
-    print(f"Total spectrogram data generation time: {total_time:.2f} seconds.")
+    if cache is not None:
+        cache.put(audio_file, params, {"envelope": envelope, "energy": energy},
+                  {"tempo": tempo, "beat_time": beat_time})
 
-    return waveform, energy, tempo
+    return PeakPyramid.from_envelope(envelope, ENVELOPE_BLOCK), energy, tempo
@@ -0,0 +1,162 @@
+from typing import Optional
+
+import numpy as np
+from PyQt6.QtCore import QRect, Qt, pyqtSignal
+from PyQt6.QtGui import QColor, QImage, QPainter
+from PyQt6.QtWidgets import QWidget
+
+import instrumentation
+from peak_pyramid import PeakPyramid
+from spectrogram import ENVELOPE_BLOCK, HOP_LENGTH, N_MELS
+
+BACKGROUND = 0xFF2B2B2B  # Matches the playlist background
+WAVEFORM_ALPHA = 0.35
+PLAYHEAD_COLOR = 0xFFFFFFFF
+
+# Anchor colours of a magma-like map, from silence to the loudest level
+_COLORMAP_ANCHORS = [(0, 0, 4), (28, 16, 68), (79, 18, 123), (129, 37, 129), (181, 54, 122),
+                     (229, 80, 100), (251, 135, 97), (254, 194, 135), (252, 253, 191)]
+
+
+def colormap_lut(anchors: list[tuple[int, int, int]] = _COLORMAP_ANCHORS) -> np.ndarray:
+    """256 opaque ARGB32 colours interpolated linearly between the anchors."""
+    anchors = np.asarray(anchors, dtype=np.float64)
+    positions = np.linspace(0, 255, len(anchors))
+    levels = np.arange(256)
+    r, g, b = (np.interp(levels, positions, anchors[:, channel]).round().astype(np.uint32) for channel in range(3))
+    return 0xFF000000 | (r << 16) | (g << 8) | b
+
+
+class SpectrogramView(QWidget):
+    """Mel spectrogram of the current track with its waveform drawn over it.
+
+    Mel frames arrive as (N_MELS, n) uint8 levels and are kept in one
+    growing array. Rendering reduces the frames to one column per pixel
+    (taking the loudest frame of each column), maps the levels through a
+    colour lookup table into a uint32 buffer and wraps that buffer in a
+    QImage without copying, so a redraw costs a few numpy passes over the
+    widget's pixels whatever the length of the track.
+
+    The rendered image doubles as the cached background for the playhead:
+    moving the playhead only repaints the two pixel columns it left and
+    entered, copying them from the image and drawing the line on top.
+    Clicking the view emits ``seek_requested`` with the clicked time.
+    """
+
+    seek_requested = pyqtSignal(float)  # Seconds into the track
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.lut = colormap_lut()
+        self._buffer: Optional[np.ndarray] = None  # Keeps the pixels of self._image alive
+        self._image: Optional[QImage] = None
+        self.duration = 0.0
+        self._playhead_x: Optional[int] = None
+        self.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.clear()
+
+    def clear(self) -> None:
+        """Forget the current track and blank the view."""
+        self._mel = np.empty((N_MELS, 0), dtype=np.uint8)
+        self.num_frames = 0
+        self.expected_frames = 0
+        self.pyramid = PeakPyramid(ENVELOPE_BLOCK)
+        self.refresh()
+
+    def set_expected_frames(self, num_frames: int) -> None:
+        """Reserve horizontal space for the whole track so it fills in from left to right."""
+        self.expected_frames = num_frames
+
+    def append(self, mel: np.ndarray, envelope: Optional[np.ndarray] = None) -> None:
+        """Add (N_MELS, n) mel frames and the matching (2, m) waveform envelope; call ``refresh`` to show them."""
+        if self.num_frames + mel.shape[1] > self._mel.shape[1]:
+            grown = np.empty((N_MELS, max(2 * self._mel.shape[1], self.num_frames + mel.shape[1], 1024)), dtype=np.uint8)
+            grown[:, :self.num_frames] = self._mel[:, :self.num_frames]
+            self._mel = grown
+        self._mel[:, self.num_frames:self.num_frames + mel.shape[1]] = mel
+        self.num_frames += mel.shape[1]
+        if envelope is not None and envelope.shape[1]:
+            self.pyramid.append(envelope)
+
+    def set_playhead(self, position: float, duration: float) -> None:
+        """Move the playhead to ``position`` seconds of a ``duration``-second track; 0 duration hides it."""
+        self.duration = duration
+        x = min(self.width() - 1, int(position / duration * self.width())) if duration > 0 else None
+        if x == self._playhead_x:
+            return
+        for old_or_new in (self._playhead_x, x):
+            if old_or_new is not None:
+                self.update(QRect(old_or_new, 0, 1, self.height()))
+        self._playhead_x = x
+
+    def refresh(self) -> None:
+        """Re-render the image from the frames received so far and schedule a repaint."""
+        self._render()
+        self.update()
+
+    def _render(self) -> None:
+        width, height = self.width(), self.height()
+        if width <= 0 or height <= 0:
+            self._buffer = self._image = None
+            return
+        with instrumentation.span("ui.redraw_spectrogram", frames=self.num_frames, width=width):
+            pixels = np.full((height, width), BACKGROUND, dtype=np.uint32)
+            total = max(self.num_frames, self.expected_frames)
+            columns = min(width, round(width * self.num_frames / total)) if total else 0
+            if columns:
+                mel = self._mel[:, :self.num_frames]
+                if self.num_frames >= columns:
+                    edges = np.arange(columns) * self.num_frames // columns
+                    mel = np.maximum.reduceat(mel, edges, axis=1)
+                else:
+                    mel = mel[:, np.arange(columns) * self.num_frames // columns]
+                # Low mel bands go at the bottom; each pixel row takes its nearest band
+                rows = (N_MELS - 1) - np.arange(height) * N_MELS // height
+                pixels[:, :columns] = self.lut[mel[rows]]
+                self._draw_waveform(pixels, columns)
+            self._buffer = pixels
+            self._image = QImage(pixels.data, width, height, width * 4, QImage.Format.Format_RGB32)
+
+    def _draw_waveform(self, pixels: np.ndarray, columns: int) -> None:
+        """Lighten the band between the waveform's minimum and maximum in each pixel column."""
+        # The envelope and the mel frames cover the same samples, so they share the x axis
+        span_bins = max(1, self.num_frames * HOP_LENGTH // ENVELOPE_BLOCK)
+        bins = min(self.pyramid.num_bins, span_bins)
+        if not bins:
+            return
+        positions, peaks = self.pyramid.view(0, bins, columns)
+        column = np.minimum((positions * columns // span_bins).astype(np.int64), columns - 1)
+        low = np.full(columns, np.inf, dtype=np.float32)
+        high = np.full(columns, -np.inf, dtype=np.float32)
+        np.minimum.at(low, column, peaks[0])
+        np.maximum.at(high, column, peaks[1])
+        filled = np.isfinite(low)
+        height = pixels.shape[0]
+        top = np.where(filled, (1 - np.clip(high, -1, 1)) * (height - 1) / 2, height).astype(np.int64)
+        bottom = np.where(filled, (1 - np.clip(low, -1, 1)) * (height - 1) / 2, -1).astype(np.int64)
+        rows = np.arange(height)[:, None]
+        mask = (rows >= top) & (rows <= bottom)
+        # Blending every byte leaves the opaque alpha byte at 255
+        channels = pixels.view(np.uint8).reshape(height, pixels.shape[1], 4)[:, :columns]
+        selected = channels[mask].astype(np.float32)
+        channels[mask] = (selected + (255 - selected) * WAVEFORM_ALPHA).astype(np.uint8)
+
+    def resizeEvent(self, event) -> None:
+        self._render()
+        super().resizeEvent(event)
+
+    def mousePressEvent(self, event) -> None:
+        if event.button() == Qt.MouseButton.LeftButton and self.duration > 0 and self.width() > 0:
+            self.seek_requested.emit(event.position().x() / self.width() * self.duration)
+        super().mousePressEvent(event)
+
+    def paintEvent(self, event) -> None:
+        painter = QPainter(self)
+        area = event.rect()
+        if self._image is None:
+            painter.fillRect(area, QColor(BACKGROUND))
+        else:
+            painter.drawImage(area, self._image, area)
+        if self._playhead_x is not None and area.left() <= self._playhead_x <= area.right():
+            painter.fillRect(self._playhead_x, 0, 1, self.height(), QColor(PLAYHEAD_COLOR))
+        painter.end()
@@ -0,0 +1,37 @@
+import sys
+import time
+
+# Modules that should only be imported once a feature needs them, never while the window opens
+DEFERRED_MODULES = ("librosa", "matplotlib", "scipy")
+
+
+class StartupProfile:
+    """Wall-clock timeline of application startup.
+
+    ``mark`` records the end of a startup phase; ``report`` lists every
+    phase with its own and cumulative time, and names any of the deferred
+    heavy modules that were imported during startup anyway.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.marks: list[tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        self.marks.append((phase, time.perf_counter()))
+
+    @property
+    def total(self) -> float:
+        """Seconds from the start of the profile to the last mark."""
+        return self.marks[-1][1] - self.start if self.marks else 0.0
+
+    def report(self) -> str:
+        lines = ["Startup profile:"]
+        previous = self.start
+        for phase, at in self.marks:
+            lines.append(f"  {phase:<28} {(at - previous) * 1000:8.1f} ms {(at - self.start) * 1000:8.1f} ms total")
+            previous = at
+        loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+        lines.append(f"  {len(sys.modules)} modules loaded")
+        lines.append(f"  Deferred modules imported at startup: {', '.join(loaded) if loaded else 'none'}")
+        return "\n".join(lines)
@@ -0,0 +1,166 @@
+from typing import Optional
+
+import numpy as np
+
+import instrumentation
+from decoders import decoder_for
+
+# Fast profile: a few bounded windows of mono audio decimated to about FAST_SAMPLE_RATE
+FAST_SAMPLE_RATE = 11025
+FAST_FRAME_LENGTH = 512
+FAST_HOP_LENGTH = 128  # About 86 onset frames per second
+FAST_WINDOW_SECONDS = 6.0
+FAST_WINDOWS = 3
+MIN_BPM = 60.0
+MAX_BPM = 200.0
+PRIOR_BPM = 120.0  # Centre of the log-normal tempo prior, one octave wide
+RISE_FLOOR = 0.1  # Log-magnitude rises below about 10 % are ripple, not onsets
+MIN_CONFIDENCE = 0.2  # Below this a tempo estimate is too weak to align transitions to
+
+
+def onset_envelope(y: np.ndarray, sample_rate: int = FAST_SAMPLE_RATE, frame_length: int = FAST_FRAME_LENGTH,
+                   hop_length: int = FAST_HOP_LENGTH) -> np.ndarray:
+    """Spectral flux of mono samples: the summed rise in log magnitude per frame, with the local mean removed."""
+    if len(y) < frame_length + hop_length:
+        return np.zeros(0, dtype=np.float32)
+    # Float64 on purpose: numpy's float64 FFT is faster than its float32 one
+    frames = np.lib.stride_tricks.sliding_window_view(y.astype(np.float64), frame_length)[::hop_length]
+    magnitude = np.abs(np.fft.rfft(frames * np.hanning(frame_length), axis=1))
+    flux = np.maximum(0, np.diff(np.log1p(100 * magnitude), axis=0) - RISE_FLOOR).sum(axis=1)
+    # Subtract a moving average of about half a second so slow loudness changes do not count as onsets
+    width = max(1, int(0.5 * sample_rate / hop_length))
+    padded = np.pad(flux, (width // 2, width - width // 2), mode="edge")
+    cumulative = np.concatenate([[0.0], np.cumsum(padded)])
+    local_mean = (cumulative[width:] - cumulative[:-width])[:len(flux)] / width
+    return np.maximum(0, flux - local_mean).astype(np.float32)
+
+
+def _autocorrelation(onsets: np.ndarray) -> np.ndarray:
+    """Autocorrelation of a mean-removed onset envelope, normalised to 1 at lag 0."""
+    x = onsets - onsets.mean()
+    spectrum = np.fft.rfft(x, n=2 * len(x))
+    acf = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2)[:len(x)]
+    return acf / acf[0] if acf[0] > 0 else np.zeros_like(acf)
+
+
+def estimate_tempo(onsets: list[np.ndarray], frame_rate: float) -> tuple[float, float]:
+    """Return (bpm, confidence) from one or more onset envelopes sampled at ``frame_rate``.
+
+    The autocorrelations of the envelopes are averaged, weighted by a
+    log-normal prior around PRIOR_BPM to settle octave ambiguity, and the
+    strongest lag between MIN_BPM and MAX_BPM is refined by parabolic
+    interpolation. The confidence is the normalised autocorrelation at that
+    lag, from 0 (no periodicity) to 1 (perfectly periodic onsets).
+    """
+    min_lag = int(np.ceil(frame_rate * 60 / MAX_BPM))
+    max_lag = int(np.ceil(frame_rate * 60 / MIN_BPM)) + 1
+    acfs = [_autocorrelation(x)[:max_lag + 1] for x in onsets if len(x) > max_lag + 1]
+    if not acfs:
+        return 0.0, 0.0
+    acf = np.mean(acfs, axis=0)
+    lags = np.arange(min_lag, max_lag)
+    bpms = frame_rate * 60 / lags
+    weighted = acf[lags] * np.exp(-0.5 * np.log2(bpms / PRIOR_BPM) ** 2)
+    lag = int(lags[np.argmax(weighted)])
+    below, at, above = acf[lag - 1], acf[lag], acf[lag + 1]
+    if at <= 0:
+        return 0.0, 0.0  # No periodicity at all, e.g. a steady tone
+    curvature = below - 2 * at + above
+    offset = 0.5 * (below - above) / curvature if curvature < 0 else 0.0
+    return float(frame_rate * 60 / (lag + offset)), float(np.clip(at, 0.0, 1.0))
+
+
+def beat_phase(onsets: np.ndarray, frame_rate: float, bpm: float) -> float:
+    """Time in seconds of the first beat in an onset envelope, from the beat grid that best lines up with its onsets.
+
+    Every phase of a grid with the period of ``bpm`` is scored by the sum of
+    the onsets on its beats; the result is the best phase, in [0, one beat).
+    """
+    period = frame_rate * 60 / bpm
+    if bpm <= 0 or len(onsets) < 2 * period:
+        return 0.0
+    phases = np.arange(int(np.ceil(period)))
+    grid = np.arange(0, len(onsets) - period, period)
+    positions = np.minimum(np.rint(phases[:, None] + grid[None, :]).astype(np.int64), len(onsets) - 1)
+    return float(np.argmax(onsets[positions].sum(axis=1)) / frame_rate)
+
+
+def exact_beat(y: np.ndarray, sample_rate: int, hop_length: int = 512) -> tuple[float, float]:
+    """Tempo of a whole mono signal and the time of its last beat in seconds, from librosa's beat tracker."""
+    # librosa takes seconds to import, so it is only loaded when exact tempo is needed
+    import librosa
+    tempo, beats = librosa.beat.beat_track(y=y, sr=sample_rate, hop_length=hop_length, units="time")
+    return float(np.atleast_1d(tempo)[0]), float(beats[-1]) if len(beats) else 0.0
+
+
+def exact_tempo(y: np.ndarray, sample_rate: int, hop_length: int = 512) -> float:
+    """Tempo of a whole mono signal from librosa's beat tracker."""
+    return exact_beat(y, sample_rate, hop_length)[0]
+
+
+def window_starts(duration: float, windows: int = FAST_WINDOWS,
+                  window_seconds: float = FAST_WINDOW_SECONDS) -> list[float]:
+    """Start times of the analysis windows, spread evenly over the track; one window covers a short track."""
+    if duration <= windows * window_seconds:
+        return [0.0]
+    return [(i + 1) * duration / (windows + 1) - window_seconds / 2 for i in range(windows)]
+
+
+def _read_window(audio_file: str, start: float, seconds: Optional[float]) -> tuple[np.ndarray, int]:
+    """Mono samples of one window and their sample rate.
+
+    The native stream is decimated by an integer factor, averaging each group
+    of samples, instead of being resampled: aliasing above the new Nyquist
+    frequency does not move onsets, and this is several times cheaper.
+    """
+    parts, have, wanted, factor, rate = [], 0, None, 1, FAST_SAMPLE_RATE
+    blocks = decoder_for(audio_file).blocks(audio_file, 32768, start)
+    for block, native_rate in blocks:
+        if wanted is None:
+            factor = max(1, round(native_rate / FAST_SAMPLE_RATE))
+            rate = native_rate // factor
+            wanted = int(seconds * native_rate) if seconds is not None else -1
+        mono = block @ np.full(block.shape[1], 1 / block.shape[1], dtype=np.float32)
+        parts.append(mono)
+        have += len(mono)
+        if 0 <= wanted <= have:
+            blocks.close()
+            break
+    y = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+    if wanted is not None and wanted >= 0:
+        y = y[:wanted]
+    y = y[:len(y) // factor * factor]
+    return y.reshape(-1, factor) @ np.full(factor, 1 / factor, dtype=np.float32), rate
+
+
+def fast_tempo(audio_file: str) -> tuple[float, float]:
+    """Approximate (bpm, confidence) of a track from a few windows of decimated mono audio."""
+    return fast_beat(audio_file)[:2]
+
+
+def fast_beat(audio_file: str) -> tuple[float, float, float]:
+    """Approximate (bpm, confidence, beat time) of a track from a few windows of decimated mono audio.
+
+    The beat time is the time in seconds of one beat in the last window. A
+    grid anchored there stays on the beat near the end of the track, where
+    transitions start, even when the estimated tempo is slightly off.
+    """
+    with instrumentation.span("analysis.fast_tempo", file=audio_file):
+        try:
+            duration = decoder_for(audio_file).probe(audio_file).duration
+        except Exception:
+            duration = 0.0
+        starts = window_starts(duration)
+        # A single window is the whole (short) track
+        seconds = FAST_WINDOW_SECONDS if len(starts) > 1 else None
+        onsets, rate = [], FAST_SAMPLE_RATE
+        for start in starts:
+            y, rate = _read_window(audio_file, start, seconds)
+            onsets.append(onset_envelope(y, rate))
+        frame_rate = rate / FAST_HOP_LENGTH
+        bpm, confidence = estimate_tempo(onsets, frame_rate)
+        if not bpm:
+            return bpm, confidence, 0.0
+        # Flux frame i measures the rise into frame i + 1, whose centre is half a frame into it
+        offset = 1 / frame_rate + FAST_FRAME_LENGTH / 2 / rate
+        return bpm, confidence, starts[-1] + offset + beat_phase(onsets[-1], frame_rate, bpm)
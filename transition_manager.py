@@ -1,6 +1,132 @@
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+
+class Transition:
+    """Linear crossfade of ``duration`` seconds at the end of the outgoing track.
+
+    Gain curves are evaluated per block on the positions inside that block
+    only, so the cost of mixing a block does not depend on the fade length.
+    """
+
+    name = "linear"
+
+    def __init__(self, duration: float = 3.0) -> None:
+        self.duration = duration
+
+    @property
+    def max_duration(self) -> float:
+        """Upper bound on the fade length; the engine pre-decodes at least this much."""
+        return self.duration
+
+    def gains(self, t: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (outgoing, incoming) gains at fade positions ``t`` in [0, 1]."""
+        return 1.0 - t, t
+
+    def lookup(self, path: str):
+        """Return what ``plan`` needs to know about a track; the engine calls this outside its lock."""
+        return None
+
+    def plan(self, info, total_frames: int, sample_rate: int) -> tuple[int, int]:
+        """Return the (start frame, length in frames) of the fade out of a track, given its ``lookup`` result."""
+        length = min(int(self.duration * sample_rate), total_frames)
+        return total_frames - length, length
+
+
+class EqualPowerTransition(Transition):
+    """Crossfade that keeps the summed power constant, avoiding the mid-fade dip."""
+
+    name = "equal_power"
+
+    def gains(self, t: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        angle = t * (np.pi / 2)
+        return np.cos(angle), np.sin(angle)
+
+
+class BeatAlignedTransition(EqualPowerTransition):
+    """Equal-power crossfade lasting ``beats`` beats that starts on a beat of the outgoing track.
+
+    ``beat_lookup(path)`` returns the tempo of a track in BPM and the time
+    in seconds of one of its beats, or None when the tempo is unknown, in
+    which case this behaves like an equal-power fade of ``duration``
+    seconds. The fade starts on the last beat of the grid through that
+    beat that leaves room for the whole fade.
+    """
+
+    name = "beat_aligned"
+
+    def __init__(self, beats: int = 8, duration: float = 3.0, max_seconds: float = 10.0,
+                 beat_lookup: Optional[Callable[[str], Optional[tuple[float, float]]]] = None) -> None:
+        super().__init__(duration)
+        self.beats = beats
+        self.max_seconds = max_seconds
+        self.beat_lookup = beat_lookup
+
+    @property
+    def max_duration(self) -> float:
+        return max(self.duration, self.max_seconds)
+
+    def lookup(self, path: str) -> Optional[tuple[float, float]]:
+        return self.beat_lookup(path) if self.beat_lookup is not None else None
+
+    def plan(self, info: Optional[tuple[float, float]], total_frames: int, sample_rate: int) -> tuple[int, int]:
+        if not info or not info[0]:
+            return super().plan(info, total_frames, sample_rate)
+        tempo, beat_time = info
+        beat = 60.0 / tempo * sample_rate
+        length = min(int(round(self.beats * beat)), int(self.max_seconds * sample_rate), total_frames)
+        anchor = beat_time * sample_rate
+        start = int(round(anchor + np.floor((total_frames - length - anchor) / beat) * beat))
+        return max(0, start), length
+
+
+class Crossfade:
+    """A fade in progress from ``outgoing`` into whatever is mixed on top of it.
+
+    ``apply`` is called by the playback engine's feeder thread with each
+    block of the incoming track; the time spent per block is accumulated
+    so the cost can be reported.
+    """
+
+    def __init__(self, transition: Transition, outgoing, length: int) -> None:
+        self.transition = transition
+        self.outgoing = outgoing
+        self.length = max(1, length)
+        self.position = 0
+        self.blocks = 0
+        self.seconds = 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.position >= self.length
+
+    @property
+    def seconds_per_block(self) -> float:
+        return self.seconds / self.blocks if self.blocks else 0.0
+
+    def apply(self, block: np.ndarray) -> None:
+        """Mix the next frames of the outgoing track into ``block`` (incoming audio, modified in place)."""
+        start = time.perf_counter()
+        count = min(len(block), self.length - self.position)
+        t = (np.arange(self.position, self.position + count, dtype=np.float32) + 0.5) / self.length
+        fade_out, fade_in = self.transition.gains(t)
+        block[:count] *= fade_in[:, None]
+        tail = self.outgoing.read(count)
+        block[:len(tail)] += tail * fade_out[:len(tail), None]
+        self.position += count
+        self.blocks += 1
+        self.seconds += time.perf_counter() - start
+
+
 class TransitionManager:
+    """Named transitions the player can switch between."""
+
     def __init__(self) -> None:
         self.transitions = {}
+        for transition in (Transition(), EqualPowerTransition(), BeatAlignedTransition()):
+            self.add_transition(transition.name, transition)
 
     def add_transition(self, name: str, transition) -> None:
         """Add a new transition by name."""
@@ -1,67 +1,129 @@
 import sys
 import os
-import pygame
 import logging
-from PyQt6.QtWidgets import QApplication, QMainWindow, QSplitter, QListWidget, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, QDockWidget, QTreeWidgetItem, QTreeWidget
-from PyQt6.QtGui import QAction, QIcon, QColor, QFont
-from PyQt6.QtCore import Qt, QTimer, QThread
+from concurrent.futures import Future
+import numpy as np
+from PyQt6.QtWidgets import QApplication, QMainWindow, QSplitter, QListView, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, QDockWidget, QTreeWidgetItem, QTreeWidget, QProgressBar, QLineEdit, QInputDialog, QMessageBox
+from PyQt6.QtGui import QAction, QIcon
+from PyQt6.QtCore import Qt, QTimer, QThread, QModelIndex, QObject, pyqtSignal
 from music_player import MusicPlayer
+from playlist_model import PlaylistModel
+from playback_controller import PlaybackController
+from ambience_panel import AmbiencePanel
 from folder_tree import FolderTree
-from spectrogram import generate_spectrogram_data
-from datetime import datetime
-
-# Suppress PyGame welcome message
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-pygame.mixer.init()
-
-# Logger configuration
-def setup_logger(debug: bool) -> logging.Logger:
-    logger = logging.getLogger('DMTools')
-    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+from library_catalog import LibraryCatalog
+from control_server import ControlServer, PlayerCommands
+from scenes import Scene, ScenePresets
+from search_index import SearchIndex
+from spectrogram import ENVELOPE_BLOCK, HOP_LENGTH, analysis_params
+from spectrogram_view import SpectrogramView
+from tempo import MIN_CONFIDENCE as MIN_TEMPO_CONFIDENCE
+from analysis_cache import AnalysisCache
+from analysis_pool import AnalysisPool
+from loudness import scan_loudness
+from logging_utils import setup_logger
+from typing import Optional
+
+class FolderScanThread(QThread):
+    scanned = pyqtSignal(object, object)
+
+    def __init__(self, folder_tree: FolderTree, node: dict) -> None:
+        super().__init__()
+        self.folder_tree = folder_tree
+        self.node = node
 
-    # Log to file
-    file_handler = logging.FileHandler('dm_tools_debug.log')
-    file_handler.setLevel(logging.DEBUG if debug else logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
+    def run(self) -> None:
+        """Read the subfolders of one folder tree node off the UI thread."""
+        self.folder_tree.load_children(self.node)
+        self.scanned.emit(self.folder_tree, self.node)
 
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG if debug else logging.INFO)
-    console_handler.setFormatter(formatter)
+class LibraryScanThread(QThread):
+    scanned = pyqtSignal(object, object)
 
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    def __init__(self, catalog: LibraryCatalog, root_dir: str, search_index: Optional[SearchIndex] = None) -> None:
+        super().__init__()
+        self.catalog = catalog
+        self.root_dir = root_dir
+        self.search_index = search_index
 
-    return logger
+    def run(self) -> None:
+        """Rescan the whole library in parallel and report per-folder summaries; stops early when interrupted."""
+        if self.search_index is not None:
+            # Index what the catalog already knows first; the scan then feeds in what changed
+            self.search_index.update(self.catalog.tracks_with_tags(self.root_dir))
+        self.scanned.emit(self.root_dir, self.catalog.scan(self.root_dir, cancelled=self.isInterruptionRequested))
 
-class SpectrogramThread(QThread):
-    finished = pyqtSignal(object, object, float)
+class LoudnessScanThread(QThread):
+    scanned = pyqtSignal(dict)
 
-    def __init__(self, audio_file: str, logger: logging.Logger) -> None:
+    def __init__(self, catalog: LibraryCatalog, root_dir: str) -> None:
         super().__init__()
-        self.audio_file = audio_file
-        self.logger = logger
+        self.catalog = catalog
+        self.root_dir = root_dir
 
     def run(self) -> None:
-        """Run the spectrogram data generation in a separate thread."""
-        self.logger.debug(f"Generating spectrogram for: {self.audio_file}")
-        waveform, energy, tempo = generate_spectrogram_data(self.audio_file, include_bpm=False)
-        self.logger.debug(f"Finished generating spectrogram for: {self.audio_file}")
-        self.finished.emit(waveform, energy, tempo)
+        """Measure the loudness of every library track that has not been measured yet."""
+        self.scanned.emit(scan_loudness(self.catalog, self.root_dir, cancelled=self.isInterruptionRequested))
+
+class ControlBridge(QObject):
+    """Runs control server commands on the Qt thread, where the player and its widgets live."""
+    _call = pyqtSignal(object, object)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        # Emitting from the server's thread queues the slot onto this object's (the Qt) thread
+        self._call.connect(self._run)
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        self._call.emit(fn, future)
+        return future
+
+    def _run(self, fn, future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
 
 class DMToolsUI(QMainWindow):
     def __init__(self, debug=False):
         super().__init__()
         self.debug = debug
-        self.init_logger()
+        self.logger = setup_logger(self.debug)
 
         self.logger.debug("DMToolsUI initialized in debug mode")
-        self.music_player = MusicPlayer(debug=self.debug)
-        self.is_playing = False  # Track if music is currently playing or paused
-        self.is_paused = False   # Track if music is paused
+        self.library_catalog = LibraryCatalog()
+        self.search_index = SearchIndex()
+        self.library_catalog.on_tracks_changed = self.on_catalog_tracks_changed
+        self.analysis_cache = AnalysisCache()
+        self.music_player = MusicPlayer(debug=self.debug, catalog=self.library_catalog,
+                                        analysis_cache=self.analysis_cache)
+        self.music_player.transitions.get_transition("beat_aligned").beat_lookup = self.cached_beat
+        self.analysis_pool = AnalysisPool(self.analysis_cache, logger=self.logger, catalog=self.library_catalog)
+        self.analysis_pool.analysis_started.connect(self.on_spectrogram_started)
+        self.analysis_pool.chunk_ready.connect(self.on_spectrogram_chunk)
+        self.analysis_pool.analysis_finished.connect(self.on_spectrogram_finished)
         self.root_dir = None     # To store the current folder
+        self.folder_tree = None
         self.repeat_mode = "none"  # Repeat mode (none, one, playlist)
+        self.music_player.set_repeat_mode(self.repeat_mode)
+        self.playback_controller = PlaybackController(self.music_player, self)
+        self.scene_presets = ScenePresets(self.music_player)
+        self.playback_controller.track_changed.connect(self.on_track_changed)
+        self.playback_controller.state_changed.connect(self.on_playback_state_changed)
+        self.playback_controller.progress.connect(self.update_progress)
         self.current_song_idx = None  # Store the current playing song index
+        self.folder_nodes = {}  # Folder path -> (tree item, folder tree node)
+        self.folder_scan_threads = []
+        self.folder_summaries = {}  # Folder path -> FolderSummary from the last library scan
+        self.library_scan_thread = None
+        self.loudness_scan_thread = None
+        self.stale_scan_threads = []  # Interrupted scans of a previous root, left to wind down on their own
+        self.control_server = None
+        self.spectrogram_file = None  # Track whose analysis is being shown
+        self.spectrogram_redraw_pending = False
 
         # Set the window icon using both icons
         self.setWindowIcon(QIcon("media/iconA.png"))  # Primary icon for the app
@@ -69,25 +131,6 @@ class DMToolsUI(QMainWindow):
 
         self.init_ui()
 
-    def init_logger(self):
-        """Initialize the logger with a timestamped log file for each session."""
-        log_dir = 'log'
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_file = os.path.join(log_dir, f"dm_tools_{timestamp}.log")
-
-        logging.basicConfig(
-            level=logging.DEBUG if self.debug else logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file, mode='w', encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
-        self.logger = logging.getLogger()
-
     def init_ui(self):
         self.logger.debug("Initializing UI...")
         self.setWindowTitle("Dungeon Master Music Player")
@@ -103,6 +146,7 @@ class DMToolsUI(QMainWindow):
         self.tree_view = QTreeWidget()
         self.tree_view.setHeaderHidden(True)
         self.tree_view.itemDoubleClicked.connect(self.on_folder_double_click)
+        self.tree_view.itemExpanded.connect(self.on_folder_expanded)
         splitter.addWidget(self.tree_view)
 
         # Right pane - Playlist and control buttons inside a dockable window
@@ -114,6 +158,9 @@ class DMToolsUI(QMainWindow):
         # Add the spectrogram widget
         self.init_spectrogram_window()
 
+        # Add the ambience layers widget
+        self.init_ambience_window()
+
         # Add the splitter to the central widget
         layout = QVBoxLayout()
         layout.addWidget(splitter)
@@ -129,16 +176,12 @@ class DMToolsUI(QMainWindow):
         # Hide the playlist and spectrogram subwindows by default
         self.dock_widget.hide()
         self.spectrogram_dock.hide()
+        self.ambience_dock.hide()
 
         # Connect the dock widget's visibilityChanged signal to control the toggle button visibility
         self.dock_widget.visibilityChanged.connect(self.handle_playlist_visibility)
         self.spectrogram_dock.visibilityChanged.connect(self.handle_spectrogram_visibility)
 
-        # Set up timer to constantly check for window resizing and keep buttons on the right edge
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_toggle_button_positions)
-        self.timer.start(100)  # Update every 100ms
-
     def init_spectrogram_window(self) -> None:
         """Initialize the spectrogram dockable window and progress bar."""
         # Dockable widget for spectrogram
@@ -151,16 +194,15 @@ class DMToolsUI(QMainWindow):
         # Progress bar above the spectrogram
         self.song_progress_bar = QProgressBar(self)
         self.song_progress_bar.setTextVisible(False)
+        self.song_progress_bar.setRange(0, 1000)
         spectrogram_layout.addWidget(self.song_progress_bar)
 
-        # Create the FigureCanvas (Matplotlib canvas) for the spectrogram plot
-        self.spectrogram_canvas = FigureCanvas(Figure(figsize=(10, 5)))
-        self.spectrogram_canvas.setFixedHeight(150)  # Set static height for the spectrogram subwindow
-
-        # Set initial background to grey (matching the playlist subwindow)
-        self.spectrogram_canvas.figure.patch.set_facecolor('#2b2b2b')
-
-        spectrogram_layout.addWidget(self.spectrogram_canvas)
+        self.spectrogram_view = SpectrogramView()
+        self.spectrogram_view.setFixedHeight(150)  # Set static height for the spectrogram subwindow
+        spectrogram_layout.addWidget(self.spectrogram_view)
+        # The playhead follows the progress ticks; clicking the spectrogram seeks
+        self.playback_controller.progress.connect(self.spectrogram_view.set_playhead)
+        self.spectrogram_view.seek_requested.connect(self.playback_controller.seek)
 
         spectrogram_pane.setLayout(spectrogram_layout)
         self.spectrogram_dock.setWidget(spectrogram_pane)
@@ -170,6 +212,13 @@ class DMToolsUI(QMainWindow):
         # Handle when spectrogram window is shown/closed
         self.spectrogram_dock.visibilityChanged.connect(self.handle_spectrogram_visibility)
 
+    def init_ambience_window(self) -> None:
+        """Initialize the dockable window listing the ambience layers."""
+        self.ambience_dock = QDockWidget("Ambience", self)
+        self.ambience_panel = AmbiencePanel(self.music_player.ambience, self)
+        self.ambience_dock.setWidget(self.ambience_panel)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.ambience_dock)
+
     def create_menu(self):
         self.logger.debug("Creating menu...")
         menubar = self.menuBar()
@@ -178,11 +227,49 @@ class DMToolsUI(QMainWindow):
         file_menu = menubar.addMenu('File')
         open_action = file_menu.addAction(QIcon("media/idon.png"), 'Open Folder')  # Using idon.png
         open_action.triggered.connect(self.open_folder)
+        search_action = file_menu.addAction('Search Library')
+        search_action.setShortcut("Ctrl+F")
+        search_action.triggered.connect(self.focus_search)
         exit_action = file_menu.addAction('Exit')
         exit_action.triggered.connect(self.close)
 
-        # Settings Menu (For future use)
+        # Ambience Menu
+        ambience_menu = menubar.addMenu('Ambience')
+        add_layer_action = ambience_menu.addAction('Add Layer...')
+        add_layer_action.triggered.connect(self.add_ambience_layer)
+
+        # Scenes Menu
+        self.scenes_menu = menubar.addMenu('Scenes')
+        self.populate_scenes_menu()
+
+        # Settings Menu
         settings_menu = menubar.addMenu('Settings')
+        normalise_action = settings_menu.addAction('Normalise Loudness')
+        normalise_action.setCheckable(True)
+        normalise_action.setChecked(self.music_player.normalise)
+        normalise_action.toggled.connect(self.set_normalise_loudness)
+
+    def populate_scenes_menu(self) -> None:
+        """Rebuild the Scenes menu: save actions, one action per scene (Ctrl+1 to Ctrl+9) and deletion."""
+        self.scenes_menu.clear()
+        save_folder_action = self.scenes_menu.addAction('Save Folder as Scene...')
+        save_folder_action.triggered.connect(self.save_folder_scene)
+        save_playlist_action = self.scenes_menu.addAction('Save Playlist as Scene...')
+        save_playlist_action.triggered.connect(self.save_playlist_scene)
+        names = sorted(self.scene_presets.scenes, key=str.lower)
+        if not names:
+            return
+        self.scenes_menu.addSeparator()
+        for number, name in enumerate(names, start=1):
+            scene_action = self.scenes_menu.addAction(name)
+            if number <= 9:
+                scene_action.setShortcut(f"Ctrl+{number}")
+            scene_action.triggered.connect(lambda checked, name=name: self.switch_scene(name))
+        self.scenes_menu.addSeparator()
+        delete_menu = self.scenes_menu.addMenu('Delete Scene')
+        for name in names:
+            delete_action = delete_menu.addAction(name)
+            delete_action.triggered.connect(lambda checked, name=name: self.delete_scene(name))
 
     def init_controls(self) -> None:
         """Initialize the control buttons (Play, Pause, Stop) at the bottom."""
@@ -198,8 +285,16 @@ class DMToolsUI(QMainWindow):
         stop_button = QPushButton("Stop", self)
         stop_button.clicked.connect(self.stop_music)
 
+        # Previous/Next Buttons
+        previous_button = QPushButton("Previous", self)
+        previous_button.clicked.connect(self.play_previous)
+        next_button = QPushButton("Next", self)
+        next_button.clicked.connect(self.play_next)
+
+        control_layout.addWidget(previous_button)
         control_layout.addWidget(self.play_pause_button)
         control_layout.addWidget(stop_button)
+        control_layout.addWidget(next_button)
 
         self.control_frame.setLayout(control_layout)
 
@@ -212,19 +307,39 @@ class DMToolsUI(QMainWindow):
         right_pane = QWidget()
         right_layout = QVBoxLayout()
 
+        # Search box; the results replace the playlist as you type
+        self.search_box = QLineEdit(self)
+        self.search_box.setPlaceholderText("Search library...")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.on_search_text_changed)
+        right_layout.addWidget(self.search_box)
+
         # Shuffle Button (action button, not toggle)
         self.shuffle_button = QPushButton("Shuffle", self)
         self.shuffle_button.clicked.connect(self.shuffle_playlist)
         right_layout.addWidget(self.shuffle_button)
 
+        # Unshuffle Button (restores the order the folder was loaded in)
+        self.unshuffle_button = QPushButton("Unshuffle", self)
+        self.unshuffle_button.clicked.connect(self.unshuffle_playlist)
+        right_layout.addWidget(self.unshuffle_button)
+
         # Repeat Button (cycle through None, One, Playlist)
         self.repeat_button = QPushButton(f"Repeat: {self.repeat_mode.capitalize()}", self)
         self.repeat_button.clicked.connect(self.cycle_repeat_mode)
         right_layout.addWidget(self.repeat_button)
 
-        # Playlist (QListWidget)
-        self.playlist_box = QListWidget()
-        self.playlist_box.itemDoubleClicked.connect(self.on_song_double_click)
+        # Crossfade Button (cycle through Off, Linear, Equal power, Beat aligned)
+        self.crossfade_button = QPushButton("Crossfade: Off", self)
+        self.crossfade_button.clicked.connect(self.cycle_crossfade_mode)
+        right_layout.addWidget(self.crossfade_button)
+
+        # Playlist (QListView over a model, only visible rows are rendered)
+        self.playlist_model = PlaylistModel(self.music_player, self)
+        self.playlist_box = QListView()
+        self.playlist_box.setUniformItemSizes(True)
+        self.playlist_box.setModel(self.playlist_model)
+        self.playlist_box.doubleClicked.connect(self.on_song_double_click)
         right_layout.addWidget(self.playlist_box)
 
         right_pane.setLayout(right_layout)
@@ -246,99 +361,284 @@ class DMToolsUI(QMainWindow):
     def load_folder_tree(self, folder_path: str) -> None:
         """Reload the folder tree structure based on the new root folder."""
         self.logger.debug(f"Loading folder tree for: {folder_path}")
-        self.folder_tree = FolderTree(folder_path)
+        self.folder_tree = FolderTree(folder_path, self.library_catalog)
 
         if not hasattr(self.folder_tree, 'tree') or not isinstance(self.folder_tree.tree, dict):
             self.logger.error("Error: FolderTree structure is invalid.")
             return
 
         self.tree_view.clear()
+        self.folder_nodes = {}
+        self.folder_summaries = {}
         for subtree in self.folder_tree.tree.get('folders', []):
             self.populate_tree(self.tree_view, subtree)
+            self.folder_nodes[subtree['path']][0].setExpanded(True)
+
+        # Walk the whole library in the background to collect per-folder track counts and fill the search index
+        self.retire_scan_thread(self.library_scan_thread)
+        self.retire_scan_thread(self.loudness_scan_thread)
+        self.loudness_scan_thread = None
+        self.search_index.clear()
+        self.library_scan_thread = LibraryScanThread(self.library_catalog, self.folder_tree.root_dir,
+                                                     self.search_index)
+        self.library_scan_thread.scanned.connect(self.on_library_scanned)
+        self.library_scan_thread.start()
+
+    def retire_scan_thread(self, thread: Optional[QThread]) -> None:
+        """Ask a running scan thread to stop and let it finish in the background instead of waiting for it."""
+        if thread is None or not thread.isRunning():
+            return
+        thread.requestInterruption()
+        self.stale_scan_threads.append(thread)
+        thread.finished.connect(lambda thread=thread: self.stale_scan_threads.remove(thread))
+
+    def on_catalog_tracks_changed(self, changed: list, removed: list) -> None:
+        """Index the tracks a scan found changed; called from scan threads.
+
+        A scan of a previous root may still be winding down, so only tracks
+        under the current root are indexed.
+        """
+        folder_tree = self.folder_tree
+        if folder_tree is None:
+            return
+        prefix = os.path.join(os.path.normpath(folder_tree.root_dir), "")
+        self.search_index.update([(path, tags) for path, tags in changed if path.startswith(prefix)],
+                                 [path for path in removed if path.startswith(prefix)])
+
+    def folder_label(self, folder_path: str) -> str:
+        """Tree label of a folder, with its track count once the library scan knows it."""
+        name = os.path.basename(folder_path) or folder_path
+        summary = self.folder_summaries.get(folder_path)
+        if summary is None:
+            return name
+        return f"{name} ({summary.total_tracks} tracks)"
+
+    def set_normalise_loudness(self, enabled: bool) -> None:
+        """Turn loudness normalisation on or off from the next track on."""
+        self.logger.debug(f"Normalise loudness: {enabled}")
+        self.music_player.normalise = enabled
+        self.music_player.engine.invalidate_next()
+        # Warm scenes were decoded with the old gain
+        self.scene_presets.invalidate()
+
+    def show_scene_error(self, message: str) -> None:
+        self.logger.warning(message)
+        QMessageBox.warning(self, "Scenes", message)
+
+    def ask_scene_name(self) -> Optional[str]:
+        """Ask for the name of a new scene; None if cancelled."""
+        name, accepted = QInputDialog.getText(self, "Save Scene", "Scene name:")
+        name = name.strip()
+        return name if accepted and name else None
+
+    def save_folder_scene(self) -> None:
+        """Save the selected folder with the current volume and crossfade as a scene."""
+        item = self.tree_view.currentItem()
+        folder_path = item.data(0, Qt.ItemDataRole.UserRole) if item is not None else None
+        if not folder_path or not os.path.isdir(folder_path):
+            self.show_scene_error("Select a folder to save as a scene first.")
+            return
+        name = self.ask_scene_name()
+        if name is None:
+            return
+        transition = self.music_player.transition
+        self.scene_presets.save(Scene(name, folder=folder_path, volume=self.music_player.volume,
+                                      transition=transition.name if transition else None))
+        self.populate_scenes_menu()
+
+    def save_playlist_scene(self) -> None:
+        """Save the tracks of the playlist with the current volume and crossfade as a scene."""
+        if not self.music_player.playlist:
+            self.show_scene_error("The playlist is empty.")
+            return
+        name = self.ask_scene_name()
+        if name is None:
+            return
+        transition = self.music_player.transition
+        self.scene_presets.save(Scene(name, tracks=list(self.music_player.playlist), volume=self.music_player.volume,
+                                      transition=transition.name if transition else None,
+                                      shuffle=self.music_player.playlist.shuffled))
+        self.populate_scenes_menu()
+
+    def delete_scene(self, name: str) -> None:
+        self.scene_presets.delete(name)
+        self.populate_scenes_menu()
+
+    def switch_scene(self, name: str) -> None:
+        """Switch to a scene: its tracks replace the playlist and its first track starts at once."""
+        self.logger.debug(f"Switching to scene: {name}")
+        try:
+            prepared = self.scene_presets.take(name)
+        except ValueError as e:
+            self.show_scene_error(str(e))
+            return
+        self.playback_controller.start_scene(prepared)
+        self.update_crossfade_button()
+        self.update_playlist_display()
+
+    def add_ambience_layer(self) -> None:
+        """Pick an audio file and loop it as an ambience layer."""
+        path, _ = QFileDialog.getOpenFileName(self, "Add Ambience Layer", "",
+                                              "Audio Files (*.mp3 *.ogg *.flac *.wav)")
+        if path:
+            self.logger.debug(f"Adding ambience layer: {path}")
+            self.ambience_panel.add_layer(path)
+            self.ambience_dock.show()
+
+    def on_library_scanned(self, root_dir: str, result) -> None:
+        """Label the tree with the per-folder track counts of a finished library scan."""
+        if self.folder_tree is None or root_dir != self.folder_tree.root_dir or result.cancelled:
+            return
+        self.logger.info(f"Library scan of {root_dir}: {result.catalog_stats}")
+        self.folder_summaries = result.summaries
+        for folder_path, (item, _) in self.folder_nodes.items():
+            item.setText(0, self.folder_label(folder_path))
+        self.start_loudness_scan(root_dir)
+
+    def start_loudness_scan(self, root_dir: str) -> None:
+        """Measure track loudness in the background so playback can be normalised."""
+        self.retire_scan_thread(self.loudness_scan_thread)
+        self.loudness_scan_thread = LoudnessScanThread(self.library_catalog, root_dir)
+        self.loudness_scan_thread.scanned.connect(self.on_loudness_scanned)
+        self.loudness_scan_thread.start()
+
+    def on_loudness_scanned(self, stats: dict) -> None:
+        self.logger.info(f"Loudness pass: {stats['analysed']}/{stats['tracks']} tracks in {stats['seconds']} s "
+                         f"({stats['tracks_per_minute']} tracks/min, {stats['failed']} failed)")
+        # Tracks measured in this pass get their gain from the next load on
+        self.music_player.engine.invalidate_next()
 
     def populate_tree(self, tree_view: QTreeWidget, tree_data: dict, parent: QTreeWidgetItem = None) -> None:
-        """Populate the folder tree with subdirectories."""
-        self.logger.debug(f"Populating tree with: {tree_data['path']}")
-        node = QTreeWidgetItem([os.path.basename(tree_data['path'])])
+        """Add a folder node; its subfolders are scanned in the background when it is expanded."""
+        node = QTreeWidgetItem([self.folder_label(tree_data['path'])])
         node.setData(0, Qt.ItemDataRole.UserRole, tree_data['path'])
+        self.folder_nodes[tree_data['path']] = (node, tree_data)
+
+        if tree_data['folders'] is None:
+            # Placeholder child so the node can be expanded before its contents are known
+            node.addChild(QTreeWidgetItem(["Loading..."]))
 
         if parent is None:
             tree_view.addTopLevelItem(node)
         else:
             parent.addChild(node)
 
-        for subtree in tree_data['folders']:
+        for subtree in tree_data['folders'] or []:
             self.populate_tree(tree_view, subtree, node)
 
+    def on_folder_expanded(self, item: QTreeWidgetItem) -> None:
+        """Start a background scan of a folder the first time it is expanded."""
+        folder_path = item.data(0, Qt.ItemDataRole.UserRole)
+        node = self.folder_nodes.get(folder_path, (None, None))[1]
+        if node is None or node['folders'] is not None:
+            return
+        if any(thread.node is node for thread in self.folder_scan_threads):
+            return
+        self.logger.debug(f"Scanning folder: {folder_path}")
+        thread = FolderScanThread(self.folder_tree, node)
+        thread.scanned.connect(self.on_folder_scanned)
+        thread.finished.connect(lambda thread=thread: self.folder_scan_threads.remove(thread))
+        self.folder_scan_threads.append(thread)
+        thread.start()
+
+    def on_folder_scanned(self, folder_tree: FolderTree, node: dict) -> None:
+        """Replace the placeholder of a scanned folder with its subfolders."""
+        if folder_tree is not self.folder_tree:
+            return
+        item = self.folder_nodes[node['path']][0]
+        item.takeChildren()
+        for subtree in node['folders']:
+            self.populate_tree(self.tree_view, subtree, item)
+
     def on_folder_double_click(self, item: QTreeWidgetItem) -> None:
         """Load playlist from the selected folder in the folder tree but keep the current song playing."""
         folder_path = item.data(0, Qt.ItemDataRole.UserRole)
         self.logger.debug(f"Folder double-clicked: {folder_path}")
-        if os.path.isdir(folder_path):
+        if folder_path and os.path.isdir(folder_path):
             self.music_player.clear_playlist()
             self.music_player.load_playlist(folder_path)
             self.update_playlist_display()
 
-    def on_song_double_click(self, item: QListWidget) -> None:
+    def focus_search(self) -> None:
+        """Show the playlist and put the cursor in the search box."""
+        self.dock_widget.show()
+        self.search_box.setFocus()
+        self.search_box.selectAll()
+
+    def on_search_text_changed(self, text: str) -> None:
+        """Replace the playlist with the library tracks that best match the search text."""
+        if not text.strip():
+            return
+        results = self.search_index.search(text)
+        self.logger.debug(f"Search for {text!r}: {len(results)} tracks")
+        self.music_player.clear_playlist()
+        self.music_player.load_tracks(results)
+        self.update_playlist_display()
+
+    def on_song_double_click(self, index: QModelIndex) -> None:
         """Play the selected song when double-clicked in the playlist."""
-        song_idx = self.playlist_box.row(item)
+        song_idx = index.row()
         self.logger.debug(f"Song double-clicked: {song_idx}")
-        self.stop_music()
-        self.music_player.play_from_index(song_idx)
-        self.is_playing = True
-        self.is_paused = False
-        self.current_song_idx = song_idx
-        self.play_pause_button.setText("Pause")
-        self.update_playlist_display()
+        self.playback_controller.play_index(song_idx)
+
+    def play_previous(self) -> None:
+        """Go back to the previously played song."""
+        self.logger.debug("Playing previous song")
+        self.playback_controller.previous()
+
+    def play_next(self) -> None:
+        """Skip to the next song in the playlist."""
+        self.logger.debug("Playing next song")
+        self.playback_controller.next()
+
+    def on_track_changed(self) -> None:
+        """Sync the playlist highlight and spectrogram with the player's current song."""
+        self.current_song_idx = self.music_player.current_index
+        self.playlist_model.set_current_row(self.current_song_idx)
 
         # Clear current spectrogram and generate the new one
         self.clear_spectrogram()
         if self.spectrogram_dock.isVisible():
             self.show_spectrogram()
 
+    def on_playback_state_changed(self, state: str) -> None:
+        """Update the controls when playback starts, pauses, stops or runs out."""
+        self.play_pause_button.setText("Pause" if state == "playing" else "Play")
+        if state == "stopped":
+            self.current_song_idx = None
+            self.playlist_model.set_current_row(None)
+
+    def update_progress(self, position: float, duration: float) -> None:
+        """Move the progress bar to the playback position."""
+        self.song_progress_bar.setValue(int(position / duration * 1000) if duration else 0)
+
     def update_playlist_display(self) -> None:
-        """Update the playlist view and highlight the current song."""
-        self.playlist_box.clear()
-        for idx, song in enumerate(self.music_player.playlist):
-            item = os.path.basename(song)
-            self.playlist_box.addItem(item)
-
-            if idx == self.current_song_idx:
-                self.playlist_box.item(idx).setBackground(QColor(80, 80, 80))
-                font = self.playlist_box.item(idx).font()
-                font.setBold(True)
-                self.playlist_box.item(idx).setFont(font)
-                
+        """Refresh the playlist view after the playlist was replaced or reordered."""
+        if self.playback_controller.state != "stopped":
+            # The playing song may have moved, or left the playlist
+            player = self.music_player
+            self.current_song_idx = player.current_index if player.current_track_id is not None else None
+        self.playlist_model.refresh()
+        self.playlist_model.set_current_row(self.current_song_idx)
+
     def start_playback(self):
         """Start playing the selected song."""
         self.logger.debug("Starting playback")
-        selected_item = self.playlist_box.currentItem()
-        if not selected_item:
-            self.playlist_box.setCurrentRow(0)
-            selected_item = self.playlist_box.item(0)
-        song_idx = self.playlist_box.row(selected_item)
-        self.music_player.play_from_index(song_idx)
-        self.is_playing = True
-        self.is_paused = False
-        self.current_song_idx = song_idx
-        self.play_pause_button.setText("Pause")
-        self.update_playlist_display()
-
-        # Generate and display the spectrogram
-        self.show_spectrogram()
+        selected = self.playlist_box.currentIndex()
+        if not selected.isValid():
+            selected = self.playlist_model.index(0)
+            self.playlist_box.setCurrentIndex(selected)
+        self.playback_controller.play_index(selected.row())
 
     def toggle_play_pause(self) -> None:
         """Toggle between play and pause."""
-        if self.is_playing and not self.is_paused:
+        state = self.playback_controller.state
+        if state == "playing":
             self.logger.debug("Pausing music")
-            self.music_player.pause_music()
-            self.is_paused = True
-            self.play_pause_button.setText("Play")
-        elif self.is_paused:
+            self.playback_controller.pause()
+        elif state == "paused":
             self.logger.debug("Resuming music")
-            self.music_player.resume_music()
-            self.is_paused = False
-            self.play_pause_button.setText("Pause")
+            self.playback_controller.resume()
         else:
             self.logger.debug("Starting playback")
             self.start_playback()
@@ -346,12 +646,7 @@ class DMToolsUI(QMainWindow):
     def stop_music(self) -> None:
         """Stop the music and reset the playlist state."""
         self.logger.debug("Stopping music")
-        self.music_player.stop_music()
-        self.is_playing = False
-        self.is_paused = False
-        self.current_song_idx = None
-        self.play_pause_button.setText("Play")
-        self.update_playlist_display()
+        self.playback_controller.stop()
 
     def shuffle_playlist(self) -> None:
         """Shuffle the playlist and refresh the display."""
@@ -359,6 +654,12 @@ class DMToolsUI(QMainWindow):
         self.music_player.shuffle_playlist()
         self.update_playlist_display()
 
+    def unshuffle_playlist(self) -> None:
+        """Restore the original playlist order and refresh the display."""
+        self.logger.debug("Unshuffling playlist")
+        self.music_player.unshuffle_playlist()
+        self.update_playlist_display()
+
     def cycle_repeat_mode(self) -> None:
         """Cycle between repeat modes: None, One, Playlist."""
         self.logger.debug("Cycling repeat mode")
@@ -369,6 +670,33 @@ class DMToolsUI(QMainWindow):
         else:
             self.repeat_mode = "none"
         self.repeat_button.setText(f"Repeat: {self.repeat_mode.capitalize()}")
+        self.playback_controller.set_repeat_mode(self.repeat_mode)
+
+    def cached_beat(self, audio_file: str) -> Optional[tuple[float, float]]:
+        """Tempo and a beat time of a track from the analysis cache, or None if it has not been analysed or has no clear beat."""
+        # Entries from before beat times were stored lack them; their grid starts at 0
+        cached = self.analysis_cache.get(audio_file, analysis_params(include_bpm=True), touch=False)
+        if cached is not None:
+            return cached[1].get("tempo"), cached[1].get("beat_time", 0.0)
+        # Every streamed analysis carries a fast tempo estimate
+        cached = self.analysis_cache.get(audio_file, analysis_params(include_bpm=False), touch=False)
+        if cached is not None and cached[1].get("tempo_confidence", 0.0) >= MIN_TEMPO_CONFIDENCE:
+            return cached[1]["tempo"], cached[1].get("beat_time", 0.0)
+        return None
+
+    def cycle_crossfade_mode(self) -> None:
+        """Cycle between crossfade modes: Off, Linear, Equal power, Beat aligned."""
+        modes = [None, "linear", "equal_power", "beat_aligned"]
+        current = self.music_player.transition
+        mode = modes[(modes.index(current.name if current else None) + 1) % len(modes)]
+        self.logger.debug(f"Crossfade mode: {mode}")
+        self.music_player.set_transition(mode)
+        self.update_crossfade_button()
+
+    def update_crossfade_button(self) -> None:
+        current = self.music_player.transition
+        mode = current.name if current else None
+        self.crossfade_button.setText(f"Crossfade: {mode.replace('_', ' ').capitalize() if mode else 'Off'}")
 
     def show_spectrogram(self) -> None:
         """Generate and display the spectrogram in a docked widget, only if the subwindow is visible."""
@@ -380,51 +708,40 @@ class DMToolsUI(QMainWindow):
             audio_file = self.music_player.playlist[self.current_song_idx]
             self.logger.debug(f"Generating spectrogram for song at index {self.current_song_idx}")
 
-            # Terminate existing spectrogram thread if running
-            if hasattr(self, 'spectrogram_thread') and self.spectrogram_thread.isRunning():
-                self.spectrogram_thread.terminate()
-
-            # Create a new background thread for spectrogram data generation
-            self.spectrogram_thread = SpectrogramThread(audio_file, self.logger)
-            self.spectrogram_thread.finished.connect(self.plot_spectrogram)
-            self.spectrogram_thread.start()
-
-    def plot_spectrogram(self, waveform: np.ndarray, energy: np.ndarray, tempo: float) -> None:
-        """Plot the spectrogram in the main thread using the provided waveform and energy."""
-        self.logger.debug("Plotting spectrogram...")
-
-        # Clear the previous plot
-        self.spectrogram_canvas.figure.clear()
-
-        # Create a new axes on the canvas
-        ax = self.spectrogram_canvas.figure.add_subplot(111)
-
-        # Hide axes (background, ticks, labels)
-        ax.set_axis_off()
+            # Hand the track to the analysis pool, which also prefetches the upcoming songs
+            self.spectrogram_file = audio_file
+            self.spectrogram_view.clear()
+            self.analysis_pool.request(audio_file, self.music_player.upcoming(self.analysis_pool.prefetch))
 
-        # Set background color to match the playlist window (using grey color)
-        self.spectrogram_canvas.figure.patch.set_facecolor('#2b2b2b')  # Match playlist background
+    def on_spectrogram_started(self, audio_file: str, expected_bins: int) -> None:
+        """Remember the expected track length so the spectrogram fills in left to right."""
+        if audio_file == self.spectrogram_file:
+            self.spectrogram_view.set_expected_frames(expected_bins * ENVELOPE_BLOCK // HOP_LENGTH)
 
-        # Ensure waveform and energy are scaled correctly over time
-        ax.plot(waveform, label="Waveform", color='white', alpha=0.7)
-
-        # Adjust the energy data length to match the waveform
-        energy_scaled = np.interp(np.linspace(0, len(waveform), len(energy)), np.arange(len(energy)), energy)
-        ax.plot(energy_scaled, label="Energy", color='red', alpha=0.7)
+    def on_spectrogram_chunk(self, audio_file: str, envelope: np.ndarray, energy: np.ndarray, mel: np.ndarray) -> None:
+        """Append a partial analysis result and schedule a throttled redraw."""
+        if audio_file != self.spectrogram_file:
+            return
+        self.spectrogram_view.append(mel, envelope)
+        if not self.spectrogram_redraw_pending:
+            self.spectrogram_redraw_pending = True
+            QTimer.singleShot(250, self.plot_spectrogram)
 
-        # Remove margins and padding to make the plot span full width
-        ax.margins(0)
-        ax.set_position([0, 0, 1, 1])  # Make plot fill the entire figure
+    def on_spectrogram_finished(self, audio_file: str) -> None:
+        """Draw the complete analysis once the stream has ended."""
+        if audio_file == self.spectrogram_file:
+            self.plot_spectrogram()
 
-        # Draw the updated plot onto the canvas
-        self.spectrogram_canvas.draw()
-        self.logger.debug("Spectrogram plotted.")
+    def plot_spectrogram(self) -> None:
+        """Render the spectrogram in the main thread from the analysis received so far."""
+        self.spectrogram_redraw_pending = False
+        self.spectrogram_view.refresh()
 
     def clear_spectrogram(self) -> None:
         """Clear the current spectrogram."""
         self.logger.debug("Clearing spectrogram")
-        self.spectrogram_canvas.figure.clear()
-        self.spectrogram_canvas.draw()
+        self.spectrogram_file = None  # Ignore results still in flight for the old track
+        self.spectrogram_view.clear()
 
     def handle_playlist_visibility(self, visible: bool) -> None:
         """Handle the visibility of the playlist dock widget."""
@@ -441,7 +758,10 @@ class DMToolsUI(QMainWindow):
         if visible:
             self.show_spectrogram()
         else:
+            self.analysis_pool.cancel_all()
             self.clear_spectrogram()
+        # The progress bar lives in this dock, so only tick while it can be seen
+        self.playback_controller.set_progress_steps(self.song_progress_bar.width() if visible else 0)
 
     def init_toggle_buttons(self) -> None:
         """Initialize the toggle buttons for playlist and spectrogram subwindows."""
@@ -470,6 +790,13 @@ class DMToolsUI(QMainWindow):
         # Position the spectrogram button at the bottom right edge
         self.toggle_spectrogram_button.move(self.width() - 50, self.height() - spectrogram_button_height - 60)
 
+    def resizeEvent(self, event) -> None:
+        """Keep the toggle buttons on the right edge and the progress tick rate matched to the bar width."""
+        super().resizeEvent(event)
+        self.update_toggle_button_positions()
+        if self.spectrogram_dock.isVisible():
+            self.playback_controller.set_progress_steps(self.song_progress_bar.width())
+
     def toggle_playlist(self) -> None:
         """Toggle the visibility of the playlist dock."""
         self.logger.debug(f"Toggling playlist visibility. Currently {'Visible' if self.dock_widget.isVisible() else 'Hidden'}")
@@ -478,6 +805,42 @@ class DMToolsUI(QMainWindow):
         else:
             self.dock_widget.show()
 
+    def start_control_server(self, **options) -> None:
+        """Accept play/pause/next/seek/volume/scene commands from local clients, e.g. a macro pad."""
+        self.control_bridge = ControlBridge(self)
+        commands = PlayerCommands(self.playback_controller, self.scene_presets)
+        commands.on_playlist_changed = self.on_control_playlist_changed
+        self.control_server = ControlServer(commands, self.control_bridge.submit, **options)
+        self.playback_controller.track_changed.connect(self.control_server.notify)
+        self.playback_controller.state_changed.connect(lambda state: self.control_server.notify())
+        self.control_server.start()
+
+    def on_control_playlist_changed(self) -> None:
+        """Refresh the controls after a control client replaced the playlist, e.g. with a scene."""
+        self.update_crossfade_button()
+        self.update_playlist_display()
+
+    def closeEvent(self, event) -> None:
+        """Stop background analysis workers when the window closes."""
+        if self.control_server is not None:
+            self.control_server.stop()
+        self.analysis_pool.shutdown()
+        self.scene_presets.shutdown()
+        self.music_player.shutdown()
+        for thread in list(self.folder_scan_threads):
+            thread.wait()
+        # Interrupted scans return within a poll of the scanner, so waiting here is short; the catalog must outlive them
+        scan_threads = [self.library_scan_thread, self.loudness_scan_thread] + self.stale_scan_threads
+        for thread in scan_threads:
+            if thread is not None:
+                thread.requestInterruption()
+        for thread in scan_threads:
+            if thread is not None:
+                thread.wait()
+        self.analysis_cache.close()
+        self.library_catalog.close()
+        super().closeEvent(event)
+
     def toggle_spectrogram(self) -> None:
         """Toggle the visibility of the spectrogram dock."""
         self.logger.debug(f"Toggling spectrogram visibility. Currently {'Visible' if self.spectrogram_dock.isVisible() else 'Hidden'}")